@@ -2,14 +2,39 @@ import discord
 from discord.ext import commands
 from discord.ui import Select, View, Button
 import ipaddress
+import abc
+import array
 import asyncio
+import bisect
+import calendar
+import contextvars
+import csv
+import datetime
+import enum
+import functools
+import gzip
+import hashlib
+import heapq
+import itertools
+import json
+import operator
+import random
 import subprocess
 import platform
 import socket
+import ssl
+import sqlite3
 import os
 import re
+import shutil
+import struct
 import sys
+import time
 import traceback
+import zlib
+from collections import OrderedDict
+from urllib.parse import parse_qs
+from xml.etree.ElementTree import XMLPullParser
 from dotenv import load_dotenv
 
 # Modo Debug - ativar para ver erros detalhados
@@ -26,6 +51,109 @@ TOKEN = os.getenv('DISCORD_TOKEN')
 DEFAULT_NETWORK = ""  # Sua rede com máscara 255.255.252.0
 DEFAULT_GATEWAY = ""     # Seu gateway padrão
 
+# Descoberta passiva (ARP/DHCP) - interface para captura e validade dos avistamentos
+PASSIVE_INTERFACE = os.getenv('PASSIVE_INTERFACE', '')        # Ex: "eth0" (vazio = desativado)
+PASSIVE_PCAP_REPLAY = os.getenv('PASSIVE_PCAP_REPLAY', '')    # Arquivo pcap para reproduzir na inicialização
+PASSIVE_MAX_AGE = int(os.getenv('PASSIVE_MAX_AGE', '600'))    # Segundos em que um avistamento vale como "em uso"
+
+# Atribuições conhecidas sem sondagem: arquivos de lease DHCP (dnsmasq/ISC) e planilhas CSV do IPAM
+DHCP_LEASE_FILES = os.getenv('DHCP_LEASE_FILES', '')    # Ex: "/var/lib/misc/dnsmasq.leases,/var/lib/dhcp/dhcpd.leases"
+IPAM_CSV_FILES = os.getenv('IPAM_CSV_FILES', '')        # Ex: "/srv/ipam/servidores.csv"
+ASSIGNMENT_POLL_INTERVAL = int(os.getenv('ASSIGNMENT_POLL_INTERVAL', '30'))  # Segundos entre verificações dos arquivos
+
+# Interface usada na descoberta IPv6 (ping multicast ff02::1 + tabela NDP); vazio = a da captura passiva
+IPV6_INTERFACE = os.getenv('IPV6_INTERFACE', '') or PASSIVE_INTERFACE
+
+# Índice de fabricantes (OUI) gerado com: python nettracker.py --build-oui oui.bin oui.csv mam.csv oas.csv
+OUI_DB_PATH = os.getenv('OUI_DB_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'oui.bin'))
+
+# Detalhes em massa (!ip_details 10.0.1.0/24): limite de IPs por consulta e de verificações simultâneas
+BULK_DETAILS_MAX_HOSTS = 1024
+BULK_DETAILS_CONCURRENCY = 32
+
+# Varredura em lote com ferramenta externa: "auto", "fping", "nmap", "arp-scan" ou "none" (IP a IP)
+SCAN_BACKEND = os.getenv('SCAN_BACKEND', 'auto')
+SCAN_BACKEND_TIMEOUT = 300  # Segundos máximos para uma varredura em lote
+
+# Inventário persistente (SQLite) - vazio desativa
+INVENTORY_DB_PATH = os.getenv('INVENTORY_DB_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'nettracker.db'))
+STORE_ALIVE_TTL = int(os.getenv('STORE_ALIVE_TTL', '600'))  # Segundos em que um host visto ativo não é sondado de novo
+STORE_BATCH_SIZE = 200  # Resultados acumulados antes de gravar uma transação
+
+# Retomada de varreduras longas (progresso gravado no inventário persistente)
+SCAN_CHECKPOINT_INTERVAL = int(os.getenv('SCAN_CHECKPOINT_INTERVAL', '10'))  # Segundos entre gravações do progresso
+SCAN_CHECKPOINT_CHUNK = 1024     # Hosts por chamada do backend em lote quando o progresso é gravado
+SCAN_JOB_MAX_AGE = 24 * 3600     # Varreduras interrompidas há mais tempo que isso não são retomadas
+
+# Histórico de presença por IP (intervalos ativos por dia, no inventário persistente)
+HISTORY_DAYS = int(os.getenv('HISTORY_DAYS', '90'))  # Dias guardados (0 = desativado)
+HISTORY_MERGE_GAP = 3600     # Observações "em uso" separadas por até isso (sem "livre" entre elas) viram um só intervalo
+HISTORY_CACHE_MAX = 20000    # Dias de IPs mantidos em memória para as próximas observações
+
+# Reservas de IPs entregues pelo !next_free e pelas varreduras (evita entregar o mesmo IP a duas pessoas)
+RESERVATION_TTL = int(os.getenv('RESERVATION_TTL', '900'))                # Segundos até uma reserva não confirmada expirar (0 = desativado)
+RESERVATION_CONFIRM_TTL = int(os.getenv('RESERVATION_CONFIRM_TTL', str(7 * 24 * 3600)))  # Validade após !confirm_ip (0 = sem prazo)
+
+# Canal que recebe as mudanças detectadas entre varreduras (0 = nenhum; usuários podem usar !subscribe)
+NOTIFY_CHANNEL_ID = int(os.getenv('NOTIFY_CHANNEL_ID', '0') or 0)
+
+# Tabela ARP dos roteadores via SNMP (cobre as sub-redes roteadas que este host não enxerga)
+SNMP_ROUTERS = os.getenv('SNMP_ROUTERS', '')             # Ex: "gateway,10.0.0.2:1161" (vazio = desativado)
+SNMP_VERSION = os.getenv('SNMP_VERSION', '2c')           # "2c" (nativo) ou "3" (requer pysnmp)
+SNMP_COMMUNITY = os.getenv('SNMP_COMMUNITY', 'public')
+SNMP_V3_USER = os.getenv('SNMP_V3_USER', '')
+SNMP_V3_AUTH_KEY = os.getenv('SNMP_V3_AUTH_KEY', '')     # SHA
+SNMP_V3_PRIV_KEY = os.getenv('SNMP_V3_PRIV_KEY', '')     # AES-128
+SNMP_CACHE_TTL = int(os.getenv('SNMP_CACHE_TTL', '60'))  # Segundos em que a tabela lida é reaproveitada
+SNMP_TIMEOUT = 2.0
+SNMP_RETRIES = 1
+SNMP_MAX_REPETITIONS = 25   # Linhas pedidas por GETBULK
+
+# Cotas de sondagem (token bucket, 1 unidade = 1 IP sondado): taxa em unidades/s e rajada máxima. Taxa 0 = sem limite
+USER_PROBE_RATE = float(os.getenv('USER_PROBE_RATE', '2'))
+USER_PROBE_BURST = int(os.getenv('USER_PROBE_BURST', '600'))
+GUILD_PROBE_RATE = float(os.getenv('GUILD_PROBE_RATE', '10'))
+GUILD_PROBE_BURST = int(os.getenv('GUILD_PROBE_BURST', '3000'))
+
+# Perfis de rede por servidor/canal do Discord (JSON); sem o arquivo, só o perfil padrão acima é usado
+DEFAULT_PROFILE_NAME = "padrao"
+PROFILES_FILE = os.getenv('PROFILES_FILE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'profiles.json'))
+
+# Varreduras agendadas: arquivo JSON e/ou variável "nome|cron|faixa; ..." (ex: "manha|0 7 * * 1-5|10.0.0.0/22")
+SCHEDULE_FILE = os.getenv('SCHEDULE_FILE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'schedules.json'))
+SCAN_SCHEDULE = os.getenv('SCAN_SCHEDULE', '')
+SCHEDULE_JITTER = int(os.getenv('SCHEDULE_JITTER', '60'))  # Atraso aleatório máximo (segundos) no início de cada varredura
+SCHEDULE_SPREAD = int(os.getenv('SCHEDULE_SPREAD', '900'))  # Janela máxima (segundos) para espalhar as /24 de uma faixa (0 = em sequência)
+
+# Snapshot do estado em memória para reinícios rápidos (vazio = desativado)
+WARM_SNAPSHOT_PATH = os.getenv('WARM_SNAPSHOT_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'nettracker.snapshot'))
+WARM_SNAPSHOT_INTERVAL = int(os.getenv('WARM_SNAPSHOT_INTERVAL', '300'))  # Segundos entre gravações
+WARM_MAX_AGE = 7 * 24 * 3600  # Registros mais antigos que isso não são restaurados
+
+# Cache de hostnames (segundos de validade de nomes encontrados e de falhas)
+HOSTNAME_CACHE_TTL = 3600
+HOSTNAME_NEGATIVE_TTL = 300
+
+# Descoberta de nomes em massa (mDNS, NetBIOS, LLMNR): um socket por protocolo para a faixa inteira
+NAME_DISCOVERY = os.getenv('NAME_DISCOVERY', 'mdns,netbios,llmnr')             # Vazio = desativado
+NAME_DISCOVERY_WINDOW = float(os.getenv('NAME_DISCOVERY_WINDOW', '1.5'))      # Segundos aguardando respostas
+
+# Identificação de serviços (banner SSH, cabeçalho Server/título HTTP, certificado TLS) dos hosts ativos
+FINGERPRINT_CONCURRENCY = int(os.getenv('FINGERPRINT_CONCURRENCY', '256'))  # Conexões simultâneas no total
+FINGERPRINT_TIMEOUT = float(os.getenv('FINGERPRINT_TIMEOUT', '2.0'))        # Segundos por host e porta (conexão + leitura)
+FINGERPRINT_CACHE_TTL = int(os.getenv('FINGERPRINT_CACHE_TTL', '3600'))     # Segundos em que o resultado por IP+porta é reaproveitado
+FINGERPRINT_MAX_BYTES = 4096    # Bytes lidos no máximo por porta
+FINGERPRINT_CACHE_MAX = 20000   # Pares IP+porta mantidos no cache (os mais antigos são descartados)
+
+# Hash da árvore de comandos slash da última sincronização (evita sync a cada reconexão)
+COMMAND_SYNC_STATE = os.getenv('COMMAND_SYNC_STATE', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.command_tree.hash'))
+FORCE_COMMAND_SYNC = os.getenv('FORCE_COMMAND_SYNC', '').lower() in ('1', 'true', 'sim')
+
+# API HTTP/JSON somente leitura do inventário (API_PORT vazio = desativada)
+API_HOST = os.getenv('API_HOST', '127.0.0.1')
+API_PORT = int(os.getenv('API_PORT', '0') or 0)
+API_CACHE_SECONDS = int(os.getenv('API_CACHE_SECONDS', '5'))  # Atraso máximo para avistamentos e varreduras aparecerem na API
+
 # Configurar intenções do bot
 intents = discord.Intents.default()
 intents.message_content = True
@@ -90,12 +218,28 @@ def log_error(error_msg, error=None):
 def is_windows():
     return platform.system().lower() == 'windows'
 
+# Registra a latência informada na saída do ping
+def record_rtt(ip, output):
+    """Atualiza a média móvel do RTT do IP a partir da saída do ping (time=0.42 ms / tempo<1ms)"""
+    match = re.search(r'(?:time|tempo)\s*[=<]\s*([\d.,]+)\s*ms', output, re.IGNORECASE)
+    if not match:
+        return None
+    rtt_estimates = current_profile().rtt_estimates
+    rtt = float(match.group(1).replace(',', '.'))
+    previous = rtt_estimates.get(str(ip))
+    if previous:
+        rtt = 0.7 * previous[0] + 0.3 * rtt
+    rtt_estimates[str(ip)] = (rtt, time.time())
+    return rtt
+
 # Função para verificar IPs com ping - com tratamento de erros
 async def ping_ip(ip):
     """Verifica se um IP está respondendo usando ping"""
     try:
         param = '-n' if is_windows() else '-c'
         command = ['ping', param, '1', '-w', '1', str(ip)]
+        if ipaddress.ip_address(ip).version == 6:
+            command.insert(1, '-6')
         
         if DEBUG_MODE:
             print(f"Executando comando ping: {' '.join(command)}")
@@ -118,6 +262,7 @@ async def ping_ip(ip):
             
             # Se o ping foi bem-sucedido (returncode=0), o IP está em uso
             if process.returncode == 0:
+                record_rtt(ip, output)
                 return False  # IP está ocupado (em uso)
             else:
                 return True   # IP está disponível (livre)
@@ -132,53 +277,216 @@ async def ping_ip(ip):
         log_error(f"Erro ao fazer ping para {ip}", e)
         return False  # Em caso de erro, consideramos como indisponível/ocupado por segurança
 
-# Função para verificar se um IP está na tabela ARP - com tratamento de erros
-async def check_arp(ip):
-    """Verifica se um IP está na tabela ARP (mesmo se o PC estiver desligado)"""
-    try:
-        if is_windows():
-            # Comando para Windows
-            cmd = ['arp', '-a']
-        else:
-            # Comando para Linux
-            cmd = ['arp', '-n']
+# Regex para extrair entradas da saída dos comandos arp -a / arp -n
+ARP_IP_PATTERN = re.compile(r'(?<![\d.])(\d{1,3}(?:\.\d{1,3}){3})(?![\d.])')
+ARP_MAC_PATTERN = re.compile(r'[0-9A-Fa-f]{2}(?:[:-][0-9A-Fa-f]{2}){5}')
+
+# Validade (segundos) da cópia da tabela ARP obtida pelo comando arp
+ARP_SNAPSHOT_TTL = 2.0
+
+# Última cópia da tabela ARP obtida pelo comando (usada quando não há netlink)
+arp_snapshot = {"time": 0.0, "table": {}}
+arp_snapshot_lock = None
+
+# Converte a saída do comando arp em entradas no mesmo formato da tabela netlink
+def parse_arp_output(output):
+    """Retorna um dicionário IP -> entrada (mac_address, state) a partir da saída do arp"""
+    entries = {}
+    for line in output.splitlines():
+        ip_match = ARP_IP_PATTERN.search(line)
+        if not ip_match:
+            continue
+        mac_match = ARP_MAC_PATTERN.search(line)
+        entries[ip_match.group(1)] = {
+            "ip": ip_match.group(1),
+            "mac_address": mac_match.group(0) if mac_match else None,
+            # Linhas sem MAC ("incomplete") não indicam dispositivo presente
+            "state": "REACHABLE" if mac_match else "INCOMPLETE",
+            "ifindex": None
+        }
+    return entries
+
+# Função para ler a tabela ARP inteira - com tratamento de erros
+async def read_arp_table():
+    """Retorna a tabela ARP (netlink no Linux; senão uma cópia do comando arp compartilhada por alguns segundos)"""
+    global arp_snapshot_lock
+    neighbors = get_neighbor_table()
+    if neighbors:
+        return neighbors.current()
+    
+    if arp_snapshot_lock is None:
+        arp_snapshot_lock = asyncio.Lock()
+    
+    # Chamadas simultâneas aguardam e reaproveitam a mesma execução do comando
+    async with arp_snapshot_lock:
+        if time.time() - arp_snapshot["time"] < ARP_SNAPSHOT_TTL:
+            return arp_snapshot["table"]
         
-        if DEBUG_MODE:
-            print(f"Executando comando ARP: {' '.join(cmd)}")
+        try:
+            if is_windows():
+                # Comando para Windows
+                cmd = ['arp', '-a']
+            else:
+                # Comando para Linux
+                cmd = ['arp', '-n']
+            
+            if DEBUG_MODE:
+                print(f"Executando comando ARP: {' '.join(cmd)}")
+                
+            # Executar o comando
+            process = await asyncio.create_subprocess_exec(
+                *cmd,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE
+            )
+            
+            stdout, stderr = await process.communicate()
+            output = stdout.decode('utf-8', errors='ignore')
+            
+            if DEBUG_MODE and stderr:
+                err_output = stderr.decode('utf-8', errors='ignore')
+                print(f"Erro na saída ARP: {err_output}")
             
-        # Executar o comando
+            arp_snapshot["table"] = parse_arp_output(output)
+        except Exception as e:
+            log_error("Erro ao ler a tabela ARP", e)
+            arp_snapshot["table"] = {}
+        arp_snapshot["time"] = time.time()
+        return arp_snapshot["table"]
+
+# Última cópia da tabela de vizinhos IPv6 obtida pelo comando ip (usada quando não há netlink)
+ndp_snapshot = {"time": 0.0, "table": {}}
+
+# Converte a saída de "ip -6 neigh show" em entradas no mesmo formato da tabela netlink
+def parse_ip_neigh_output(output):
+    """Retorna um dicionário IP -> entrada (mac_address, state) a partir da saída do ip -6 neigh"""
+    entries = {}
+    for line in output.splitlines():
+        fields = line.split()
+        if not fields or ':' not in fields[0]:
+            continue
+        mac = None
+        if 'lladdr' in fields:
+            index = fields.index('lladdr')
+            if index + 1 < len(fields):
+                mac = fields[index + 1].lower()
+        state = fields[-1].upper() if fields[-1].isalpha() else "NONE"
+        entries[fields[0].split('%')[0]] = {
+            "ip": fields[0].split('%')[0],
+            "mac_address": mac,
+            "state": state,
+            "ifindex": None
+        }
+    return entries
+
+# Função para ler a tabela de vizinhos IPv6 (NDP) - com tratamento de erros
+async def read_ndp_table():
+    """Retorna a tabela de vizinhos IPv6 (netlink no Linux; senão o comando ip -6 neigh)"""
+    neighbors = get_neighbor_table()
+    if neighbors:
+        return {ip: entry for ip, entry in neighbors.current().items() if ':' in ip}
+    if time.time() - ndp_snapshot["time"] < ARP_SNAPSHOT_TTL:
+        return ndp_snapshot["table"]
+    try:
+        process = await asyncio.create_subprocess_exec(
+            'ip', '-6', 'neigh', 'show',
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+        stdout, _ = await process.communicate()
+        ndp_snapshot["table"] = parse_ip_neigh_output(stdout.decode('utf-8', errors='ignore'))
+    except Exception as e:
+        log_error("Erro ao ler a tabela de vizinhos IPv6", e)
+        ndp_snapshot["table"] = {}
+    ndp_snapshot["time"] = time.time()
+    return ndp_snapshot["table"]
+
+# Descoberta IPv6: um /64 não pode ser varrido endereço a endereço
+async def discover_ipv6_neighbors(interface):
+    """Envia ping multicast para ff02::1 na interface e coleta a tabela de vizinhos IPv6.
+    Retorna a lista de entradas (ip, mac_address, state) registradas no inventário"""
+    responders = set()
+    cmd = ['ping', '-6', '-c', '2', '-w', '3', '-I', interface, 'ff02::1']
+    if DEBUG_MODE:
+        print(f"Executando descoberta IPv6: {' '.join(cmd)}")
+    try:
         process = await asyncio.create_subprocess_exec(
             *cmd,
             stdout=asyncio.subprocess.PIPE,
             stderr=asyncio.subprocess.PIPE
         )
-        
-        stdout, stderr = await process.communicate()
+        stdout, stderr = await asyncio.wait_for(process.communicate(), timeout=10)
         output = stdout.decode('utf-8', errors='ignore')
-        
+        # Todas as respostas ao multicast aparecem como "bytes from <endereço>[%escopo]: icmp_seq=..."
+        for match in re.finditer(r'from ([0-9A-Fa-f:]+?)(?:%[\w.-]+)?:?\s', output):
+            try:
+                responders.add(str(ipaddress.IPv6Address(match.group(1))))
+            except ValueError:
+                if DEBUG_MODE:
+                    print(f"Resposta IPv6 ignorada (endereço inválido): {match.group(0)}")
+        if DEBUG_MODE and stderr:
+            print(f"Erro no ping multicast: {stderr.decode('utf-8', errors='ignore')}")
+    except Exception as e:
+        log_error(f"Erro no ping multicast IPv6 pela interface {interface}", e)
+
+    # As respostas preenchem a tabela NDP, que traz os MACs (e endereços globais já vistos)
+    table = await read_ndp_table()
+    found = {}
+    for ip, entry in table.items():
+        address = ipaddress.ip_address(ip)
+        if address.is_multicast or entry["state"] in NUD_ABSENT_STATES:
+            continue
+        found[ip] = entry
+    for ip in responders:
+        if ip not in found:
+            found[ip] = {"ip": ip, "mac_address": None, "state": "REACHABLE", "ifindex": None}
+
+    target_inventory = current_profile().inventory
+    for entry in found.values():
+        target_inventory.record_sighting(entry["ip"], mac=entry["mac_address"], source="ndp")
+
+    if DEBUG_MODE:
+        print(f"Descoberta IPv6 em {interface}: {len(found)} vizinhos ({len(responders)} responderam ao ff02::1)")
+    return sorted(found.values(), key=lambda e: ipaddress.ip_address(e["ip"]))
+
+# Função para consultar um IP na tabela ARP - com tratamento de erros
+async def get_arp_entry(ip):
+    """Retorna (está na tabela, MAC) em uma única consulta à tabela ARP (ou NDP para IPv6)"""
+    if ipaddress.ip_address(ip).version == 6:
+        table = await read_ndp_table()
+    else:
+        table = await read_arp_table()
+    # Endereços link-local podem vir com escopo (fe80::1%eth0); a tabela usa só o endereço
+    address = str(ip).split('%')[0]
+    entry = table.get(address)
+    if entry and entry["state"] not in NUD_ABSENT_STATES:
+        return True, entry["mac_address"]
+    # Tabela ARP dos roteadores (SNMP), para IPs de sub-redes roteadas
+    entry = (await read_router_arp_table()).get(address)
+    if entry:
+        return True, entry["mac_address"]
+    return False, None
+
+# Função para verificar se um IP está na tabela ARP - com tratamento de erros
+async def check_arp(ip):
+    """Verifica se um IP está na tabela ARP (mesmo se o PC estiver desligado)"""
+    try:
+        present, _ = await get_arp_entry(ip)
         if DEBUG_MODE:
-            print(f"Verificando IP {ip} na tabela ARP")
-            if stderr:
-                err_output = stderr.decode('utf-8', errors='ignore')
-                print(f"Erro na saída ARP: {err_output}")
-        
-        # Verificar se o IP aparece na saída
-        ip_to_check = str(ip)
-        
-        if is_windows():
-            # No Windows, o IP aparece com espaços
-            return ip_to_check in output
-        else:
-            # No Linux, procurar padrão IP seguido de espaço
-            return re.search(r'{}(\s|$)'.format(re.escape(ip_to_check)), output) is not None
-        
+            print(f"IP {ip} na tabela ARP: {'sim' if present else 'não'}")
+        return present
     except Exception as e:
         log_error(f"Erro ao verificar ARP para {ip}", e)
         return False
 
-# Função para verificar usando socket TCP - com tratamento de erros
-async def check_tcp_port(ip, port=80, timeout=0.5):
-    """Verifica se uma porta específica está aberta no IP"""
+# Resultados de probe_tcp_port
+TCP_SILENT = 0    # Ninguém respondeu
+TCP_OPEN = 1      # Porta aberta
+TCP_REFUSED = 2   # Conexão recusada: o host existe, a porta está fechada
+TCP_ERROR = 3
+
+async def probe_tcp_port(ip, port=80, timeout=0.5):
+    """Tenta conectar na porta e retorna TCP_OPEN, TCP_REFUSED, TCP_SILENT ou TCP_ERROR"""
     try:
         if DEBUG_MODE:
             print(f"Verificando conexão TCP para {ip}:{port}")
@@ -190,7 +498,7 @@ async def check_tcp_port(ip, port=80, timeout=0.5):
         try:
             reader, writer = await asyncio.wait_for(future, timeout=timeout)
             
-            # Se conseguiu conectar, fecha a conexão e retorna ocupado
+            # Se conseguiu conectar, fecha a conexão
             if writer:
                 if DEBUG_MODE:
                     print(f"Conexão TCP bem-sucedida para {ip}:{port}")
@@ -200,22 +508,42 @@ async def check_tcp_port(ip, port=80, timeout=0.5):
                 except:
                     pass
             
-            return False  # IP está ocupado (porta aberta)
+            return TCP_OPEN
         except asyncio.TimeoutError:
             if DEBUG_MODE:
                 print(f"Timeout ao conectar TCP para {ip}:{port}")
-            return True   # IP está disponível (ninguém respondeu)
+            return TCP_SILENT
         except ConnectionRefusedError:
-            # Recusou a conexão, mas o host existe
             if DEBUG_MODE:
                 print(f"Conexão recusada para {ip}:{port} - host existe mas porta fechada")
-            return False  # IP está ocupado (maquina existe mas porta fechada)
+            return TCP_REFUSED
     except Exception as e:
         log_error(f"Erro ao verificar porta {port} em {ip}", e)
-        return False  # Em caso de erro, consideramos como indisponível/ocupado por segurança
+        return TCP_ERROR
 
-# Função para resolver hostname a partir do IP - com tratamento de erros
+# Função para verificar usando socket TCP - com tratamento de erros
+async def check_tcp_port(ip, port=80, timeout=0.5):
+    """Verifica se uma porta específica está aberta no IP (True = ninguém respondeu, IP disponível)"""
+    # Porta aberta, recusada ou erro contam como ocupado (erro: por segurança)
+    return await probe_tcp_port(ip, port, timeout) == TCP_SILENT
+
+# Função para resolver hostname com cache (um cache por perfil de rede)
 async def resolve_hostname(ip):
+    """Tenta obter o nome do host a partir do IP, reaproveitando consultas recentes"""
+    hostname_cache = current_profile().hostname_cache
+    key = str(ip)
+    cached = hostname_cache.get(key)
+    if cached:
+        hostname, stamp = cached
+        ttl = HOSTNAME_CACHE_TTL if hostname else HOSTNAME_NEGATIVE_TTL
+        if time.time() - stamp <= ttl:
+            return hostname
+    hostname = await lookup_hostname(ip)
+    hostname_cache[key] = (hostname, time.time())
+    return hostname
+
+# Função para resolver hostname a partir do IP - com tratamento de erros
+async def lookup_hostname(ip):
     """Tenta obter o nome do host a partir do IP"""
     try:
         if DEBUG_MODE:
@@ -300,52 +628,347 @@ async def resolve_hostname(ip):
         log_error(f"Erro ao resolver hostname para {ip}", e)
         return None
 
-# Método melhorado de verificação (combina ping, arp e socket) - com tratamento de erros
-async def is_ip_available(ip):
-    """Método melhorado para verificar se um IP está disponível"""
+# Descoberta de nomes em massa: consultas mDNS/LLMNR (formato DNS) e NetBIOS node status
+MDNS_ADDRESS = ('224.0.0.251', 5353)
+MDNS_SERVICES = "_services._dns-sd._udp.local"
+LLMNR_PORT = 5355
+NETBIOS_PORT = 137
+DNS_TYPE_A = 1
+DNS_TYPE_PTR = 12
+DNS_TYPE_NBSTAT = 0x21
+DNS_QUESTIONS_PER_PACKET = 30   # Perguntas PTR por pacote mDNS (abaixo de 1500 bytes)
+
+def _dns_name(name):
+    return b''.join(bytes([len(label)]) + label.encode() for label in name.split('.') if label) + b'\x00'
+
+def dns_query(transaction_id, questions):
+    """Monta uma consulta DNS com várias perguntas [(nome, tipo)]"""
+    packet = struct.pack('!HHHHHH', transaction_id, 0, len(questions), 0, 0, 0)
+    for name, qtype in questions:
+        packet += _dns_name(name) + struct.pack('!HH', qtype, 1)
+    return packet
+
+def netbios_status_query(transaction_id):
+    # Nome "*" em codificação de primeiro nível (cada nibble + 'A'), tipo NBSTAT
+    encoded = ''.join(chr(0x41 + (byte >> 4)) + chr(0x41 + (byte & 0x0F)) for byte in b'*' + b'\x00' * 15)
+    return struct.pack('!HHHHHH', transaction_id, 0, 1, 0, 0, 0) + bytes([32]) + encoded.encode() + b'\x00' + struct.pack('!HH', DNS_TYPE_NBSTAT, 1)
+
+def _dns_read_name(data, offset):
+    """Lê um nome DNS (com compressão). Retorna (nome, offset após o nome)"""
+    labels = []
+    end = None
+    for _ in range(128):
+        length = data[offset]
+        if length & 0xC0 == 0xC0:
+            if end is None:
+                end = offset + 2
+            offset = (length & 0x3F) << 8 | data[offset + 1]
+            continue
+        offset += 1
+        if length == 0:
+            break
+        labels.append(data[offset:offset + length].decode('utf-8', errors='ignore'))
+        offset += length
+    return '.'.join(labels), end if end is not None else offset
+
+def parse_dns_records(data):
+    """Retorna os registros (nome, tipo, dados brutos, offset dos dados) de respostas e adicionais"""
+    _, _, qdcount, ancount, nscount, arcount = struct.unpack_from('!HHHHHH', data, 0)
+    offset = 12
+    for _ in range(qdcount):
+        _, offset = _dns_read_name(data, offset)
+        offset += 4
+    records = []
+    for _ in range(ancount + nscount + arcount):
+        name, offset = _dns_read_name(data, offset)
+        rtype, _, _, rdlength = struct.unpack_from('!HHIH', data, offset)
+        offset += 10
+        records.append((name, rtype, data[offset:offset + rdlength], offset))
+        offset += rdlength
+    return records
+
+def names_from_dns_reply(data):
+    """Extrai {ip: nome} dos registros A e PTR reversos (in-addr.arpa) de uma resposta mDNS/LLMNR"""
+    names = {}
+    for name, rtype, rdata, rdata_offset in parse_dns_records(data):
+        if rtype == DNS_TYPE_A and len(rdata) == 4:
+            names.setdefault(str(ipaddress.IPv4Address(rdata)), name)
+        elif rtype == DNS_TYPE_PTR and name.lower().endswith('.in-addr.arpa'):
+            octets = name.split('.')[:4]
+            try:
+                ip = str(ipaddress.IPv4Address('.'.join(reversed(octets))))
+            except ValueError:
+                continue
+            names[ip] = _dns_read_name(data, rdata_offset)[0]
+    return {ip: name.rstrip('.') for ip, name in names.items() if name}
+
+def name_from_netbios_reply(data):
+    """Retorna o nome da estação (sufixo 0x00, nome único) de uma resposta NetBIOS node status, ou None"""
+    records = parse_dns_records(data)
+    for _, rtype, rdata, _ in records:
+        if rtype != DNS_TYPE_NBSTAT or not rdata:
+            continue
+        for index in range(rdata[0]):
+            entry = rdata[1 + index * 18:19 + index * 18]
+            if len(entry) < 18:
+                break
+            flags = int.from_bytes(entry[16:18], 'big')
+            if entry[15] == 0x00 and not flags & 0x8000:
+                return entry[:15].decode('ascii', errors='ignore').strip() or None
+    return None
+
+class NameDiscoveryProtocol(asyncio.DatagramProtocol):
+    """Recebe as respostas de um protocolo e acumula {ip: nome}"""
+    def __init__(self, parser, targets):
+        self.parser = parser
+        self.targets = targets
+        self.names = {}
+
+    def datagram_received(self, data, addr):
+        try:
+            found = self.parser(data, addr[0])
+        except (ValueError, IndexError, struct.error, UnicodeError):
+            return
+        for ip, name in found.items():
+            if ip in self.targets:
+                self.names.setdefault(ip, name)
+
+def _parse_dns_datagram(data, sender):
+    return names_from_dns_reply(data)
+
+def _parse_netbios_datagram(data, sender):
+    name = name_from_netbios_reply(data)
+    return {sender: name} if name else {}
+
+async def discover_names(ips, window=None):
+    """Descobre em massa os nomes dos IPs (IPv4) por mDNS, LLMNR e NetBIOS, cada protocolo em um único socket,
+    aguardando as respostas por `window` segundos. Retorna {ip: nome} e preenche o cache de hostnames do perfil"""
+    protocols = {name.strip() for name in NAME_DISCOVERY.split(',') if name.strip()}
+    targets = {str(ip) for ip in ips if ipaddress.ip_address(ip).version == 4}
+    hostname_cache = current_profile().hostname_cache
+    now = time.time()
+    # IPs com nome recente no cache não precisam de nova consulta
+    targets = {ip for ip in targets if not (hostname_cache.get(ip) and hostname_cache[ip][0] and now - hostname_cache[ip][1] <= HOSTNAME_CACHE_TTL)}
+    if not targets or not protocols:
+        return {}
+
+    loop = asyncio.get_running_loop()
+    endpoints = []
+    try:
+        if protocols & {"mdns", "llmnr"}:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 255)
+            sock.bind(('', 0))
+            transport, protocol = await loop.create_datagram_endpoint(lambda: NameDiscoveryProtocol(_parse_dns_datagram, targets), sock=sock)
+            endpoints.append((transport, protocol))
+            reverse = sorted(targets)
+            if "mdns" in protocols:
+                # Consulta de origem não-5353 ("legacy unicast"): os dispositivos respondem direto a este socket.
+                # A enumeração de serviços traz registros A nos adicionais; os PTR reversos cobrem os demais
+                transport.sendto(dns_query(0, [(MDNS_SERVICES, DNS_TYPE_PTR)]), MDNS_ADDRESS)
+                for start in range(0, len(reverse), DNS_QUESTIONS_PER_PACKET):
+                    questions = [(ipaddress.ip_address(ip).reverse_pointer, DNS_TYPE_PTR) for ip in reverse[start:start + DNS_QUESTIONS_PER_PACKET]]
+                    transport.sendto(dns_query(0, questions), MDNS_ADDRESS)
+            if "llmnr" in protocols:
+                # Consultas reversas LLMNR vão por unicast ao próprio IP
+                for index, ip in enumerate(reverse):
+                    transport.sendto(dns_query(index & 0xFFFF, [(ipaddress.ip_address(ip).reverse_pointer, DNS_TYPE_PTR)]), (ip, LLMNR_PORT))
+        if "netbios" in protocols:
+            transport, protocol = await loop.create_datagram_endpoint(lambda: NameDiscoveryProtocol(_parse_netbios_datagram, targets), family=socket.AF_INET)
+            endpoints.append((transport, protocol))
+            for index, ip in enumerate(sorted(targets)):
+                transport.sendto(netbios_status_query(index & 0xFFFF), (ip, NETBIOS_PORT))
+                if index % 64 == 63:
+                    await asyncio.sleep(0.01)  # Não estourar o buffer de envio em faixas grandes
+        await asyncio.sleep(window if window is not None else NAME_DISCOVERY_WINDOW)
+    except OSError as e:
+        log_error("Erro na descoberta de nomes em massa", e)
+    finally:
+        for transport, _ in endpoints:
+            transport.close()
+
+    names = {}
+    for _, protocol in endpoints:
+        for ip, name in protocol.names.items():
+            names.setdefault(ip, name)
+    now = time.time()
+    for ip, name in names.items():
+        hostname_cache[ip] = (name, now)
+    if DEBUG_MODE:
+        print(f"Descoberta de nomes em massa: {len(names)} de {len(targets)} IPs responderam")
+    return names
+
+# Estado de um host depois das sondagens
+class HostState(enum.IntEnum):
+    DESCONHECIDO = 0   # Sem resultado (erro no lote, varredura interrompida)
+    LIVRE = 1
+    EM_USO = 2
+    REGISTRADO = 3     # Só na tabela ARP (provavelmente desligado)
+    ERRO = 4           # Falha na sondagem: conta como ocupado por segurança
+    ATRIBUIDO = 5      # Lease DHCP ou IPAM, sem sondagem
+
+# Evidências (bits) que levaram ao estado
+EVIDENCE_ARP = 0x001
+EVIDENCE_PING = 0x002
+EVIDENCE_TCP_80 = 0x004
+EVIDENCE_TCP_22 = 0x008
+EVIDENCE_TCP_443 = 0x010
+EVIDENCE_TCP_REFUSED = 0x020   # Alguma porta recusou a conexão (host existe, porta fechada)
+EVIDENCE_INVENTORY = 0x040     # Resultado recente do inventário, sem nova sondagem
+EVIDENCE_BACKEND = 0x080       # Varredura em lote (fping/nmap/arp-scan)
+EVIDENCE_SNMP = 0x100          # Tabela ARP de um roteador
+EVIDENCE_LEASE = 0x200         # Lease ativo em um arquivo do servidor DHCP
+EVIDENCE_IPAM = 0x400          # Documentado na planilha do IPAM
+EVIDENCE_TCP = EVIDENCE_TCP_80 | EVIDENCE_TCP_22 | EVIDENCE_TCP_443
+TCP_EVIDENCE_PORTS = ((80, EVIDENCE_TCP_80), (22, EVIDENCE_TCP_22), (443, EVIDENCE_TCP_443))
+
+# Estados que ocupam o IP (erro, registrado e atribuído contam como ocupados)
+OCCUPIED_STATES = frozenset((HostState.EM_USO, HostState.REGISTRADO, HostState.ERRO, HostState.ATRIBUIDO))
+
+def assignment_evidence(assigned):
+    return EVIDENCE_LEASE if assigned["source"] == "lease" else EVIDENCE_IPAM
+
+def _mac_bytes(mac):
+    raw = re.sub(r'[^0-9A-Fa-f]', '', mac or '')
+    return bytes.fromhex(raw) if len(raw) == 12 else None
+
+class HostRecord:
+    """Resultado das sondagens de um IP: IP inteiro, estado, evidências (bits EVIDENCE_*), RTT (ms) e MAC (6 bytes)"""
+    __slots__ = ('ip', 'version', 'state', 'evidence', 'rtt', 'mac')
+
+    def __init__(self, ip, state=HostState.DESCONHECIDO, evidence=0, rtt=None, mac=None):
+        address = ipaddress.ip_address(ip)
+        self.ip = int(address)
+        self.version = address.version
+        self.state = state
+        self.evidence = evidence
+        self.rtt = rtt
+        self.mac = _mac_bytes(mac) if isinstance(mac, str) else mac
+
+    @property
+    def address(self):
+        return str(ipaddress.IPv4Address(self.ip) if self.version == 4 else ipaddress.IPv6Address(self.ip))
+
+    @property
+    def is_free(self):
+        return self.state == HostState.LIVRE
+
+    @property
+    def mac_address(self):
+        return format_mac(self.mac) if self.mac else None
+
+    @property
+    def status_text(self):
+        """Descrição do estado usada nas mensagens"""
+        if self.state == HostState.EM_USO:
+            if self.evidence & EVIDENCE_PING:
+                return "ativo (responde ping)"
+            if self.evidence & (EVIDENCE_TCP | EVIDENCE_TCP_REFUSED):
+                return "ativo (responde em portas TCP)"
+            return "em uso"
+        return {
+            HostState.LIVRE: "livre (disponível)",
+            HostState.REGISTRADO: "registrado (na tabela ARP, provavelmente desligado)",
+            HostState.ERRO: "erro ao verificar",
+            HostState.ATRIBUIDO: "atribuído (lease DHCP ou IPAM)",
+        }.get(self.state, "desconhecido")
+
+    def as_details(self, hostname=None):
+        """Dicionário no formato exibido pelo ip_details"""
+        return {
+            "ip": self.address,
+            "status": self.status_text,
+            "mac_address": self.mac_address,
+            "vendor": lookup_vendor(self.mac_address) if self.mac else None,
+            "hostname": hostname,
+            "responde_ping": bool(self.evidence & EVIDENCE_PING)
+        }
+
+# Guarda o resultado de uma verificação no inventário persistente
+def remember_result(ip, is_free, source="sonda", mac=None, hostname=None):
+    """Registra o resultado no inventário (se ativo) e devolve is_free"""
+    store = get_inventory_store()
+    if store:
+        store.record(ip, is_free, mac=mac, hostname=hostname, source=source)
+    return is_free
+
+def remember_record(record, source, hostname=None):
+    """Registra o HostRecord no inventário (se ativo) e o devolve"""
+    remember_result(record.address, record.is_free, source, record.mac_address, hostname)
+    return record
+
+# Sonda as portas TCP de TCP_EVIDENCE_PORTS em paralelo e anota as evidências no registro
+async def probe_tcp_evidence(record, ip):
+    outcomes = await asyncio.gather(*[probe_tcp_port(ip, port) for port, _ in TCP_EVIDENCE_PORTS])
+    failed = False
+    for (_, flag), outcome in zip(TCP_EVIDENCE_PORTS, outcomes):
+        if outcome in (TCP_OPEN, TCP_REFUSED):
+            record.evidence |= flag
+        if outcome == TCP_REFUSED:
+            record.evidence |= EVIDENCE_TCP_REFUSED
+        failed = failed or outcome == TCP_ERROR
+    return failed
+
+# Sondagem completa de um IP (ARP, ping e portas TCP, conforme o perfil)
+async def probe_host(ip):
+    """Retorna o HostRecord do IP; para na primeira evidência de uso"""
+    record = HostRecord(ip)
     try:
         if DEBUG_MODE:
             print(f"\nVerificando disponibilidade do IP {ip}")
-            
-        # Primeiro verifica ARP (se estiver na tabela ARP, está em uso mesmo que desligado)
-        arp_result = await check_arp(ip)
-        if arp_result:
+        
+        # IP atribuído por lease DHCP ou pelo IPAM: em uso sem enviar nenhum pacote
+        assigned = current_profile().inventory.assignment(ip)
+        if assigned:
             if DEBUG_MODE:
-                print(f"IP {ip} encontrado na tabela ARP -> EM USO")
-            return False  # IP está na tabela ARP, então está em uso (mesmo desligado)
+                print(f"IP {ip} atribuído ({assigned['source']}: {assigned['origin']}) -> EM USO")
+            record.state = HostState.ATRIBUIDO
+            record.evidence |= assignment_evidence(assigned)
+            record.mac = _mac_bytes(assigned["mac_address"])
+            return record
         
-        # Depois tenta ping
-        ping_result = await ping_ip(ip)
+        # Sondas habilitadas no perfil de rede ativo
+        probes = current_profile().probes
         
-        # Se o ping indicar que está livre, tenta conexão TCP para confirmação
-        if ping_result:
-            if DEBUG_MODE:
-                print(f"Ping para {ip} falhou -> verificando portas TCP")
-                
-            # Tenta verificar portas comuns
-            tcp_80 = await check_tcp_port(ip, 80)   # HTTP
-            tcp_22 = await check_tcp_port(ip, 22)   # SSH
-            tcp_443 = await check_tcp_port(ip, 443) # HTTPS
-            
-            # Se todas as portas deram como livre, considera o IP disponível
-            is_available = tcp_80 and tcp_22 and tcp_443
-            
-            if DEBUG_MODE:
-                if is_available:
-                    print(f"Todas as portas TCP para {ip} falharam -> LIVRE")
-                else:
-                    print(f"Pelo menos uma porta TCP para {ip} respondeu -> EM USO")
-                    
-            return is_available
-        else:
+        # Primeiro verifica ARP (se estiver na tabela ARP, está em uso mesmo que desligado)
+        if "arp" in probes:
+            present, mac = await get_arp_entry(ip)
+            if present:
+                if DEBUG_MODE:
+                    print(f"IP {ip} encontrado na tabela ARP -> EM USO")
+                record.state = HostState.EM_USO
+                record.evidence |= EVIDENCE_ARP
+                record.mac = _mac_bytes(mac)
+                return remember_record(record, "arp")
+        
+        # Depois tenta ping
+        if "ping" in probes and not await ping_ip(ip):
             if DEBUG_MODE:
                 print(f"Ping para {ip} bem-sucedido -> EM USO")
+            record.state = HostState.EM_USO
+            record.evidence |= EVIDENCE_PING
+            rtt = current_profile().rtt_estimates.get(str(ip))
+            record.rtt = rtt[0] if rtt else None
+            return remember_record(record, "ping")
         
-        # Se ping já indicou que está ocupado, não precisa verificar portas
-        return False
+        # Ping não respondeu: portas comuns (HTTP, SSH, HTTPS) para confirmação
+        failed = "tcp" in probes and await probe_tcp_evidence(record, ip)
+        record.state = HostState.EM_USO if record.evidence or failed else HostState.LIVRE
+        if DEBUG_MODE:
+            if record.is_free:
+                print(f"Todas as portas TCP para {ip} falharam -> LIVRE")
+            else:
+                print(f"Pelo menos uma porta TCP para {ip} respondeu -> EM USO")
+        return remember_record(record, "tcp")
     except Exception as e:
         log_error(f"Erro ao verificar disponibilidade do IP {ip}", e)
-        return False  # Em caso de erro, consideramos como indisponível/ocupado por segurança
+        record.state = HostState.ERRO  # Em caso de erro, consideramos como indisponível/ocupado por segurança
+        return record
+
+# Método melhorado de verificação (combina ping, arp e socket) - com tratamento de erros
+async def is_ip_available(ip):
+    """Método melhorado para verificar se um IP está disponível"""
+    return (await probe_host(ip)).is_free
 
 # Função para obter detalhes completos sobre um IP - com tratamento de erros
 async def get_ip_details(ip):
@@ -354,102 +977,4013 @@ async def get_ip_details(ip):
         if DEBUG_MODE:
             print(f"\nObtendo detalhes para o IP {ip}")
             
-        details = {
-            "ip": str(ip),
-            "status": "desconhecido",
-            "mac_address": None,
-            "hostname": None,
-            "responde_ping": False
-        }
+        record = HostRecord(ip)
         
-        # Verificar se responde a ping
-        ping_result = not await ping_ip(ip)  # Inverter lógica: False=livre, True=ocupado
-        details["responde_ping"] = ping_result
+        # O ping preenche a tabela ARP, então a leitura do ARP (e do MAC) vem logo depois dele
+        async def ping_and_arp():
+            if not await ping_ip(ip):
+                record.evidence |= EVIDENCE_PING
+                rtt = current_profile().rtt_estimates.get(str(ip))
+                record.rtt = rtt[0] if rtt else None
+            arp_present, mac = await get_arp_entry(ip)
+            if arp_present:
+                record.evidence |= EVIDENCE_ARP
+                record.mac = _mac_bytes(mac)
         
-        if DEBUG_MODE:
-            print(f"Responde a ping: {ping_result}")
+        # Etapas independentes em paralelo: ping+ARP, hostname e portas TCP
+        _, hostname, tcp_failed = await asyncio.gather(
+            ping_and_arp(),
+            resolve_hostname(ip),
+            probe_tcp_evidence(record, ip)
+        )
         
-        # Verificar se está na tabela ARP
-        arp_result = await check_arp(ip)
+        # Determinar o status final (erro na sondagem TCP conta como ocupado)
+        if record.evidence & EVIDENCE_PING:
+            record.state = HostState.EM_USO
+        elif record.evidence & EVIDENCE_ARP:
+            record.state = HostState.REGISTRADO
+        elif record.evidence & EVIDENCE_TCP or tcp_failed:
+            record.state = HostState.EM_USO
+        else:
+            record.state = HostState.LIVRE
         
+        details = record.as_details(hostname)
         if DEBUG_MODE:
-            print(f"Está na tabela ARP: {arp_result}")
+            print(f"Evidências: {record.evidence:#05x}, status: {details['status']}, MAC: {details['mac_address']}, hostname: {hostname}")
         
-        # Obter o hostname (se disponível)
-        hostname = await resolve_hostname(ip)
+        remember_record(record, "detalhes", hostname)
+        return details
+    except Exception as e:
+        log_error(f"Erro ao obter detalhes do IP {ip}", e)
+        return {
+            "ip": str(ip),
+            "status": "erro ao verificar",
+            "mac_address": None,
+            "vendor": None,
+            "hostname": None,
+            "responde_ping": False
+        }
+
+# Identificação de serviços: porta -> protocolo falado nela
+FINGERPRINT_PORTS = ((22, "ssh"), (80, "http"), (443, "https"))
+HTTP_TITLE_PATTERN = re.compile(rb'<title[^>]*>(.*?)</title>', re.I | re.S)
+X509_NAME_FIELDS = {(2, 5, 4, 3): "CN", (2, 5, 4, 10): "O", (2, 5, 4, 11): "OU"}
+
+fingerprint_semaphore = None   # Limite global de conexões, criado no primeiro uso
+fingerprint_ssl_context = None
+
+def get_fingerprint_semaphore():
+    global fingerprint_semaphore
+    if fingerprint_semaphore is None:
+        fingerprint_semaphore = asyncio.Semaphore(max(1, FINGERPRINT_CONCURRENCY))
+    return fingerprint_semaphore
+
+def get_fingerprint_ssl_context():
+    """Contexto TLS sem validação (só identificação), criado uma vez: carregar as CAs do sistema
+    a cada conexão custaria dezenas de milissegundos de CPU no loop"""
+    global fingerprint_ssl_context
+    if fingerprint_ssl_context is None:
+        fingerprint_ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+        fingerprint_ssl_context.check_hostname = False
+        fingerprint_ssl_context.verify_mode = ssl.CERT_NONE
+    return fingerprint_ssl_context
+
+# Assunto (CN, O, OU) de um certificado X.509 em DER
+def certificate_subject(der):
+    _, certificate, _ = _ber_read(der, 0)
+    _, tbs, _ = _ber_read(certificate, 0)
+    fields = []
+    offset = 0
+    while offset < len(tbs):
+        tag, value, offset = _ber_read(tbs, offset)
+        fields.append(value)
+    # [0] versão (opcional), serial, algoritmo, emissor, validade, assunto
+    subject = fields[5 if tbs[0] == 0xA0 else 4]
+    parts = []
+    offset = 0
+    while offset < len(subject):
+        _, rdn, offset = _ber_read(subject, offset)
+        _, attribute, _ = _ber_read(rdn, 0)
+        _, oid, next_offset = _ber_read(attribute, 0)
+        _, value, _ = _ber_read(attribute, next_offset)
+        name = X509_NAME_FIELDS.get(_ber_decode_oid(oid))
+        if name:
+            parts.append(f"{name}={value.decode('utf-8', 'replace')}")
+    return ', '.join(parts) or None
+
+# Resume a resposta HTTP: cabeçalho Server e título da página
+def parse_http_banner(data):
+    head, _, body = data.partition(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    if not lines[0].startswith('HTTP/'):
+        return None
+    server = next((line.split(':', 1)[1].strip() for line in lines[1:] if line.lower().startswith('server:')), None)
+    match = HTTP_TITLE_PATTERN.search(body)
+    title = ' '.join(match.group(1).decode('utf-8', 'replace').split())[:80] if match else None
+    parts = [server or lines[0].split(' ', 1)[-1]]
+    if title:
+        parts.append(f'"{title}"')
+    return ' '.join(parts)
+
+async def _read_limited(reader, until=None):
+    """Lê até FINGERPRINT_MAX_BYTES, o fim da conexão ou o marcador `until`"""
+    data = b''
+    while len(data) < FINGERPRINT_MAX_BYTES:
+        chunk = await reader.read(FINGERPRINT_MAX_BYTES - len(data))
+        if not chunk:
+            break
+        data += chunk
+        if until and until in data.lower():
+            break
+    return data
+
+async def grab_banner(ip, port, kind):
+    """Conecta na porta e retorna a descrição do serviço (ou None); sem limite de tempo próprio"""
+    context = get_fingerprint_ssl_context() if kind == "https" else None
+    reader, writer = await asyncio.open_connection(str(ip), port, ssl=context)
+    try:
+        if kind == "ssh":
+            line = (await _read_limited(reader, b'\n')).split(b'\n')[0].strip()
+            return line.decode('latin-1') if line.startswith(b'SSH-') else None
+        parts = []
+        if kind == "https":
+            der = writer.get_extra_info('ssl_object').getpeercert(binary_form=True)
+            subject = certificate_subject(der) if der else None
+            if subject:
+                parts.append(f"certificado {subject}")
+        writer.write(f"GET / HTTP/1.0\r\nHost: {ip}\r\nUser-Agent: nettracker\r\nConnection: close\r\n\r\n".encode())
+        http = parse_http_banner(await _read_limited(reader, b'</title>'))
+        if http:
+            parts.insert(0, http)
+        return '; '.join(parts) or None
+    finally:
+        writer.close()
+
+async def fingerprint_host(ip):
+    """{porta: descrição} dos serviços identificados no IP. Cada porta tem até FINGERPRINT_TIMEOUT segundos
+    e FINGERPRINT_MAX_BYTES bytes; as portas são lidas em paralelo, dentro do limite global de conexões,
+    e o resultado fica em cache por IP+porta"""
+    profile = current_profile()
+    now = time.time()
+    services = {}
+    pending = []
+    for port, kind in FINGERPRINT_PORTS:
+        cached = profile.fingerprints.get((str(ip), port))
+        if cached and now - cached[1] <= FINGERPRINT_CACHE_TTL:
+            if cached[0]:
+                services[port] = cached[0]
+        else:
+            pending.append((port, kind))
+
+    async def grab(port, kind):
+        async with get_fingerprint_semaphore():
+            try:
+                text = await asyncio.wait_for(grab_banner(ip, port, kind), FINGERPRINT_TIMEOUT)
+            except (OSError, asyncio.TimeoutError, ssl.SSLError, ValueError, IndexError):
+                text = None
+        store_fingerprint(profile, (str(ip), port), text)
+        return port, text
+
+    for port, text in await asyncio.gather(*(grab(port, kind) for port, kind in pending)):
+        if text:
+            services[port] = text
+    return dict(sorted(services.items()))
+
+def store_fingerprint(profile, key, text):
+    """Guarda no cache do perfil; a ordem de inserção é a ordem de leitura, então a limpeza só olha o início"""
+    cache = profile.fingerprints
+    cache.pop(key, None)
+    now = time.time()
+    cache[key] = (text, now)
+    while len(cache) > FINGERPRINT_CACHE_MAX or now - next(iter(cache.values()))[1] > FINGERPRINT_CACHE_TTL:
+        del cache[next(iter(cache))]
+
+# Linhas com os serviços identificados de um host
+def format_services(services, indent=""):
+    kinds = dict(FINGERPRINT_PORTS)
+    return [f"{indent}{port}/{kinds.get(port, 'tcp')}: {text}" for port, text in services.items()]
+
+# Inventário em memória dos dispositivos observados na rede
+class NetworkInventory:
+    """Guarda os avistamentos de cada IP (IP ↔ MAC ↔ hostname) com horário da última vez visto"""
+    def __init__(self, persist=False, profile=None):
+        self.hosts = {}
+        # Incrementado a cada alteração (usado pelos caches da API)
+        self.generation = 0
+        # persist=True também grava os avistamentos no inventário SQLite (o do perfil dono, se houver)
+        self.persist = persist
+        self.profile = profile
+        # IPs atribuídos por fontes externas (leases DHCP, IPAM), válidos sem nenhuma sondagem:
+        # IP -> {"source", "origin" (arquivo), "expires" (None = sem prazo), "mac_address", "hostname"}
+        self.assignments = {}
+
+    def record_sighting(self, ip, mac=None, hostname=None, source="passivo", timestamp=None, persist=True):
+        """Registra (ou atualiza) um avistamento de um IP"""
+        ip = str(ip)
+        now = timestamp if timestamp is not None else time.time()
+        if self.persist and persist:
+            store = self.profile.get_store() if self.profile else get_inventory_store()
+            if store:
+                store.record(ip, False, mac=mac, hostname=hostname, source=source, timestamp=now)
+        entry = self.hosts.get(ip)
+        if entry is None:
+            entry = {
+                "ip": ip,
+                "mac_address": None,
+                "hostname": None,
+                "first_seen": now,
+                "last_seen": now,
+                "source": source
+            }
+            self.hosts[ip] = entry
+        if mac:
+            entry["mac_address"] = mac
         if hostname:
-            details["hostname"] = hostname
-            if DEBUG_MODE:
-                print(f"Hostname: {hostname}")
-        
-        # Determinar o status final
-        if ping_result:
-            details["status"] = "ativo (responde ping)"
-        elif arp_result:
-            details["status"] = "registrado (na tabela ARP, provavelmente desligado)"
+            entry["hostname"] = hostname
+        if now >= entry["last_seen"]:
+            entry["last_seen"] = now
+            entry["source"] = source
+        self.generation += 1
+        return entry
+
+    def get(self, ip):
+        """Retorna o registro de um IP ou None se nunca foi visto"""
+        return self.hosts.get(str(ip))
+
+    def recently_seen(self, ip, max_age):
+        """Retorna o registro se o IP foi visto nos últimos max_age segundos"""
+        entry = self.hosts.get(str(ip))
+        if entry and time.time() - entry["last_seen"] <= max_age:
+            return entry
+        return None
+
+    def assign(self, ip, source, origin, expires=None, mac=None, hostname=None):
+        """Registra que o IP está atribuído segundo uma fonte externa (até `expires`, ou sem prazo)"""
+        self.assignments[str(ip)] = {
+            "ip": str(ip),
+            "source": source,
+            "origin": origin,
+            "expires": expires,
+            "mac_address": mac,
+            "hostname": hostname
+        }
+        self.generation += 1
+
+    def unassign(self, ip, origin):
+        """Remove a atribuição do IP, se ela veio desta origem"""
+        entry = self.assignments.get(str(ip))
+        if entry and entry["origin"] == origin:
+            del self.assignments[str(ip)]
+            self.generation += 1
+
+    def replace_assignments(self, origin, source, entries):
+        """Substitui todas as atribuições de uma origem pelas entradas lidas agora (arquivo relido inteiro)"""
+        current = {entry["ip"] for entry in entries}
+        for ip in [ip for ip, entry in self.assignments.items() if entry["origin"] == origin and ip not in current]:
+            del self.assignments[ip]
+        for entry in entries:
+            self.assign(entry["ip"], source, origin, entry["expires"], entry["mac_address"], entry["hostname"])
+        self.generation += 1
+
+    def assignment(self, ip, now=None):
+        """Atribuição em vigor do IP, ou None"""
+        entry = self.assignments.get(str(ip))
+        if entry and (entry["expires"] is None or entry["expires"] > (now if now is not None else time.time())):
+            return entry
+        return None
+
+
+# Filtro BPF clássico equivalente a: arp or (udp and (port 67 or port 68))
+PASSIVE_BPF_FILTER = [
+    (0x28, 0, 0, 0x0000000c),   # ldh [12]            (ethertype)
+    (0x15, 0, 1, 0x00000806),   # jeq ARP
+    (0x06, 0, 0, 0x00040000),   # ret aceitar
+    (0x15, 0, 12, 0x00000800),  # jeq IPv4
+    (0x30, 0, 0, 0x00000017),   # ldb [23]            (protocolo)
+    (0x15, 0, 10, 0x00000011),  # jeq UDP
+    (0x28, 0, 0, 0x00000014),   # ldh [20]            (fragmento)
+    (0x45, 8, 0, 0x00001fff),   # jset -> descartar fragmentos
+    (0xb1, 0, 0, 0x0000000e),   # ldxb 4*([14]&0xf)   (tamanho do cabeçalho IP)
+    (0x48, 0, 0, 0x0000000e),   # ldh [x+14]          (porta de origem)
+    (0x15, 4, 0, 0x00000043),   # jeq 67
+    (0x15, 3, 0, 0x00000044),   # jeq 68
+    (0x48, 0, 0, 0x00000010),   # ldh [x+16]          (porta de destino)
+    (0x15, 1, 0, 0x00000043),   # jeq 67
+    (0x15, 0, 1, 0x00000044),   # jeq 68
+    (0x06, 0, 0, 0x00040000),   # ret aceitar
+    (0x06, 0, 0, 0x00000000),   # ret descartar
+]
+
+# Formata bytes de MAC no padrão aa:bb:cc:dd:ee:ff
+def format_mac(raw):
+    return ':'.join(f'{b:02x}' for b in raw)
+
+# Extrai avistamentos de um pacote ARP
+def parse_arp_packet(payload):
+    """Retorna (ip, mac) do remetente de um pacote ARP Ethernet/IPv4, ou None"""
+    if len(payload) < 28:
+        return None
+    htype, ptype, hlen, plen, _oper = struct.unpack_from('!HHBBH', payload, 0)
+    if htype != 1 or ptype != 0x0800 or hlen != 6 or plen != 4:
+        return None
+    sender_mac = payload[8:14]
+    sender_ip = payload[14:18]
+    # ARP probes (RFC 5227) usam 0.0.0.0 como remetente - não identificam o IP
+    if sender_ip == b'\x00\x00\x00\x00':
+        return None
+    return socket.inet_ntoa(sender_ip), format_mac(sender_mac)
+
+# Extrai avistamentos de um pacote DHCP
+def parse_dhcp_packet(payload):
+    """Retorna (ip, mac, hostname) de uma mensagem DHCP, ou None"""
+    if len(payload) < 240 or payload[236:240] != b'\x63\x82\x53\x63':
+        return None
+    op = payload[0]
+    ciaddr = payload[12:16]
+    yiaddr = payload[16:20]
+    mac = format_mac(payload[28:34])
+
+    options = {}
+    i = 240
+    while i < len(payload):
+        code = payload[i]
+        if code == 255:  # fim
+            break
+        if code == 0:    # preenchimento
+            i += 1
+            continue
+        if i + 1 >= len(payload):
+            break
+        length = payload[i + 1]
+        options[code] = payload[i + 2:i + 2 + length]
+        i += 2 + length
+
+    hostname = None
+    if 12 in options:
+        hostname = options[12].decode('utf-8', errors='ignore').strip('\x00').strip() or None
+
+    msg_type = options.get(53, b'\x00')[0:1]
+    ip_raw = None
+    if op == 2 and msg_type == b'\x05':
+        # DHCPACK do servidor: yiaddr é o endereço entregue ao cliente
+        ip_raw = yiaddr
+    elif op == 1 and msg_type in (b'\x03', b'\x08'):
+        # DHCPREQUEST (renovação) ou DHCPINFORM do cliente: só o ciaddr, que o cliente já está usando.
+        # DISCOVER, DECLINE, RELEASE e o IP apenas solicitado (opção 50) não provam que o endereço está em uso
+        ip_raw = ciaddr
+
+    if not ip_raw or ip_raw == b'\x00\x00\x00\x00':
+        return None
+    return socket.inet_ntoa(ip_raw), mac, hostname
+
+# Processa um quadro Ethernet capturado e atualiza o inventário
+def process_passive_frame(frame, target_inventory, timestamp=None):
+    """Registra no inventário os avistamentos ARP/DHCP contidos em um quadro Ethernet"""
+    try:
+        if len(frame) < 14:
+            return None
+        offset = 12
+        ethertype = struct.unpack_from('!H', frame, offset)[0]
+        # Pular tags 802.1Q (aparecem em arquivos pcap de portas trunk)
+        while ethertype in (0x8100, 0x88a8) and len(frame) >= offset + 6:
+            offset += 4
+            ethertype = struct.unpack_from('!H', frame, offset)[0]
+        payload = frame[offset + 2:]
+
+        if ethertype == 0x0806:
+            sighting = parse_arp_packet(payload)
+            if sighting:
+                ip, mac = sighting
+                return target_inventory.record_sighting(ip, mac=mac, source="arp", timestamp=timestamp)
+        elif ethertype == 0x0800 and len(payload) >= 20:
+            ihl = (payload[0] & 0x0f) * 4
+            if payload[9] != 17 or len(payload) < ihl + 8:
+                return None
+            src_port, dst_port = struct.unpack_from('!HH', payload, ihl)
+            if src_port in (67, 68) or dst_port in (67, 68):
+                sighting = parse_dhcp_packet(payload[ihl + 8:])
+                if sighting:
+                    ip, mac, hostname = sighting
+                    return target_inventory.record_sighting(ip, mac=mac, hostname=hostname, source="dhcp", timestamp=timestamp)
+    except Exception as e:
+        log_error("Erro ao processar pacote capturado", e)
+    return None
+
+# Reproduz um arquivo pcap (útil para testes sem acesso à rede)
+def replay_pcap(path, target_inventory=None):
+    """Lê um arquivo pcap Ethernet e alimenta o inventário com os avistamentos. Retorna a quantidade de avistamentos"""
+    target_inventory = target_inventory if target_inventory is not None else inventory
+    count = 0
+    with open(path, 'rb') as f:
+        header = f.read(24)
+        if len(header) < 24:
+            raise ValueError("Arquivo pcap inválido (cabeçalho incompleto)")
+        magic = header[:4]
+        if magic in (b'\xd4\xc3\xb2\xa1', b'\x4d\x3c\xb2\xa1'):
+            endian = '<'
+        elif magic in (b'\xa1\xb2\xc3\xd4', b'\xa1\xb2\x3c\x4d'):
+            endian = '>'
         else:
-            # Verificar portas TCP
-            tcp_80 = not await check_tcp_port(ip, 80)
-            tcp_22 = not await check_tcp_port(ip, 22)
-            tcp_443 = not await check_tcp_port(ip, 443)
-            
-            if DEBUG_MODE:
-                print(f"Responde porta 80: {tcp_80}")
-                print(f"Responde porta 22: {tcp_22}")
-                print(f"Responde porta 443: {tcp_443}")
-            
-            if tcp_80 or tcp_22 or tcp_443:
-                details["status"] = "ativo (responde em portas TCP)"
-            else:
-                details["status"] = "livre (disponível)"
-        
-        # Obter MAC se estiver na tabela ARP
-        if arp_result:
+            raise ValueError("Arquivo pcap inválido (formato pcapng não é suportado)")
+        nanoseconds = magic in (b'\x4d\x3c\xb2\xa1', b'\xa1\xb2\x3c\x4d')
+        linktype = struct.unpack_from(endian + 'I', header, 20)[0]
+        if linktype != 1:
+            raise ValueError(f"Tipo de enlace {linktype} não suportado (apenas Ethernet)")
+
+        while True:
+            record = f.read(16)
+            if len(record) < 16:
+                break
+            ts_sec, ts_frac, incl_len, _orig_len = struct.unpack(endian + 'IIII', record)
+            frame = f.read(incl_len)
+            if len(frame) < incl_len:
+                break
+            timestamp = ts_sec + ts_frac / (1e9 if nanoseconds else 1e6)
+            if process_passive_frame(frame, target_inventory, timestamp):
+                count += 1
+
+    if DEBUG_MODE:
+        print(f"Replay de {path}: {count} avistamentos registrados")
+    return count
+
+# Escuta passiva de ARP/DHCP em um socket AF_PACKET
+class PassiveListener:
+    """Captura ARP e DHCP da interface e registra os avistamentos no inventário sem enviar pacotes"""
+    def __init__(self, interface, target_inventory=None):
+        self.interface = interface
+        self.inventory = target_inventory if target_inventory is not None else inventory
+        self.sock = None
+        self.loop = None
+
+    def _attach_filter(self):
+        # ctypes só é necessário aqui, para passar o ponteiro do programa BPF ao kernel
+        import ctypes
+        program = b''.join(struct.pack('HBBI', *ins) for ins in PASSIVE_BPF_FILTER)
+        self._filter_buffer = ctypes.create_string_buffer(program)
+        fprog = struct.pack('HL', len(PASSIVE_BPF_FILTER), ctypes.addressof(self._filter_buffer))
+        SO_ATTACH_FILTER = 26
+        self.sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_FILTER, fprog)
+
+    def start(self, loop=None):
+        """Abre o socket de captura e registra o leitor no loop asyncio"""
+        if not hasattr(socket, 'AF_PACKET'):
+            raise OSError("Captura passiva requer Linux (AF_PACKET)")
+        ETH_P_ALL = 0x0003
+        self.sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ETH_P_ALL))
+        try:
+            self._attach_filter()
+            self.sock.bind((self.interface, 0))
+            self.sock.setblocking(False)
+            self.loop = loop or asyncio.get_event_loop()
+            self.loop.add_reader(self.sock.fileno(), self._on_readable)
+        except Exception:
+            self.sock.close()
+            self.sock = None
+            raise
+        if DEBUG_MODE:
+            print(f"Captura passiva ARP/DHCP iniciada na interface {self.interface}")
+
+    def _on_readable(self):
+        # Drenar todos os quadros disponíveis de uma vez
+        while True:
             try:
-                if is_windows():
-                    cmd = ['arp', '-a', str(ip)]
-                else:
-                    cmd = ['arp', '-n', str(ip)]
-                
-                if DEBUG_MODE:
-                    print(f"Executando comando para obter MAC: {' '.join(cmd)}")
-                    
-                process = await asyncio.create_subprocess_exec(
-                    *cmd,
-                    stdout=asyncio.subprocess.PIPE,
-                    stderr=asyncio.subprocess.PIPE
-                )
+                frame = self.sock.recv(65535)
+            except (BlockingIOError, InterruptedError):
+                return
+            except Exception as e:
+                log_error("Erro na captura passiva", e)
+                return
+            entry = process_passive_frame(frame, self.inventory)
+            if DEBUG_MODE and entry:
+                print(f"Avistamento passivo: {entry['ip']} ({entry['mac_address']}) via {entry['source']}")
+
+    def stop(self):
+        if self.sock is not None:
+            if self.loop is not None:
+                self.loop.remove_reader(self.sock.fileno())
+            self.sock.close()
+            self.sock = None
+
+def start_passive_discovery():
+    """Inicia a captura passiva de cada perfil de rede e/ou o replay de pcap conforme a configuração"""
+    if PASSIVE_PCAP_REPLAY:
+        try:
+            replay_pcap(PASSIVE_PCAP_REPLAY, inventory)
+        except Exception as e:
+            log_error(f"Erro ao reproduzir o arquivo pcap {PASSIVE_PCAP_REPLAY}", e)
+    for profile in network_profiles.values():
+        if not profile.passive_interface or profile.passive_listener is not None:
+            continue
+        listener = PassiveListener(profile.passive_interface, profile.inventory)
+        try:
+            listener.start()
+            profile.passive_listener = listener
+        except PermissionError as e:
+            log_error("Sem permissão para captura passiva (requer root ou CAP_NET_RAW)", e)
+        except Exception as e:
+            log_error(f"Erro ao iniciar a captura passiva em {profile.passive_interface}", e)
+
+# Leases do dnsmasq: "<vencimento> <MAC> <IP> <hostname|*> <client-id|*>" (vencimento 0 = sem prazo)
+def parse_dnsmasq_leases(text):
+    leases = []
+    for line in text.splitlines():
+        fields = line.split()
+        if len(fields) < 4 or fields[0] == "duid":
+            continue
+        try:
+            ip = str(ipaddress.ip_address(fields[2]))
+            expires = int(fields[0])
+        except ValueError:
+            continue
+        leases.append({
+            "ip": ip,
+            "mac_address": fields[1].lower() if ARP_MAC_PATTERN.fullmatch(fields[1]) else None,  # IPv6: IAID no lugar do MAC
+            "hostname": None if fields[3] == "*" else fields[3],
+            "expires": expires or None,
+            "active": True
+        })
+    return leases
+
+ISC_LEASE_PATTERN = re.compile(r'^lease\s+(\S+)\s*\{(.*?)^\}', re.M | re.S)
+ISC_TIME_PATTERN = re.compile(r'(?:\d\s+)?(\d{4})/(\d{1,2})/(\d{1,2})\s+(\d{1,2}):(\d{2}):(\d{2})')
+ISC_ACTIVE_STATES = ("active", "abandoned")  # abandoned: o servidor achou o IP em uso por outro dispositivo
+
+def _isc_time(value):
+    """Horário do dhcpd.leases (UTC, "W AAAA/MM/DD HH:MM:SS" ou "epoch N"); None para "never\""""
+    value = value.strip()
+    if value.startswith("epoch"):
+        return float(value.split()[1])
+    match = ISC_TIME_PATTERN.match(value)
+    return calendar.timegm(tuple(int(part) for part in match.groups()) + (0, 0, 0)) if match else None
+
+# Blocos "lease <IP> { ... }" do dhcpd.leases do ISC, na ordem do arquivo (um bloco posterior substitui o anterior)
+def parse_isc_leases(text):
+    leases = []
+    for match in ISC_LEASE_PATTERN.finditer(text):
+        try:
+            ip = str(ipaddress.ip_address(match.group(1)))
+        except ValueError:
+            continue
+        lease = {"ip": ip, "mac_address": None, "hostname": None, "expires": None, "active": True}
+        for statement in match.group(2).split(';'):
+            statement = statement.strip()
+            if statement.startswith("ends "):
+                lease["expires"] = _isc_time(statement[5:])
+            elif statement.startswith("binding state "):
+                lease["active"] = statement[14:].strip() in ISC_ACTIVE_STATES
+            elif statement.startswith("hardware ethernet "):
+                lease["mac_address"] = statement[18:].strip().lower()
+            elif statement.startswith("client-hostname "):
+                lease["hostname"] = statement[16:].strip().strip('"')
+        leases.append(lease)
+    return leases
+
+# Arquivo de leases DHCP acompanhado de forma incremental
+class LeaseFileSource:
+    """Arquivo de leases acompanhado pela assinatura (inode, tamanho, mtime). O dnsmasq reescreve o arquivo
+    no mesmo inode (com os leases novos no início), então ele é relido inteiro a cada mudança. O
+    dhcpd.leases do ISC é um diário só de acréscimos: dele só o trecho novo (registros completos) é
+    interpretado, e ele só é relido inteiro quando é substituído (compactação) ou truncado. Numa
+    releitura, as atribuições que sumiram do arquivo são removidas"""
+    source = "lease"
+
+    def __init__(self, path):
+        self.path = path
+        self.signature = None
+        self.inode = None
+        self.offset = 0
+        self.kind = None    # "dnsmasq" ou "isc", detectado pelo conteúdo
+
+    def poll(self, profile):
+        """Aplica ao inventário do perfil o que mudou no arquivo; retorna quantos leases foram lidos"""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return 0
+        signature = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        if signature == self.signature:
+            return 0
+        self.signature = signature
+        reload = self.kind != "isc" or stat.st_ino != self.inode or stat.st_size < self.offset
+        start = 0 if reload else self.offset
+        with open(self.path, 'rb') as handle:
+            handle.seek(start)
+            data = handle.read()
+        if reload:
+            self.kind = "isc" if re.search(rb'^lease\s', data, re.M) or b'authoring-byte-order' in data else "dnsmasq"
+
+        # Só registros completos; um registro pela metade é lido de novo na próxima vez
+        if self.kind == "isc":
+            cut = data.rfind(b'\n}\n') + 3 if b'\n}\n' in data else 0
+        else:
+            cut = data.rfind(b'\n') + 1
+        text = data[:cut].decode('utf-8', 'replace')
+        self.inode = stat.st_ino
+        self.offset = start + cut
+        leases = parse_isc_leases(text) if self.kind == "isc" else parse_dnsmasq_leases(text)
+        leases = [lease for lease in leases if profile.allows(ipaddress.ip_address(lease["ip"]))]
+
+        target_inventory = profile.inventory
+        if reload:
+            # Arquivo inteiro: o último bloco de cada IP é o que vale
+            latest = {lease["ip"]: lease for lease in leases}
+            target_inventory.replace_assignments(self.path, self.source, [lease for lease in latest.values() if lease["active"]])
+        else:
+            for lease in leases:
+                if lease["active"]:
+                    target_inventory.assign(lease["ip"], self.source, self.path, lease["expires"], lease["mac_address"], lease["hostname"])
+                else:
+                    target_inventory.unassign(lease["ip"], self.path)
+        if DEBUG_MODE and leases:
+            print(f"{len(leases)} leases lidos de {self.path} ({'arquivo inteiro' if reload else 'trecho novo'})")
+        return len(leases)
+
+# Datas de validade aceitas nas planilhas (além de timestamp Unix)
+IPAM_DATE_FORMATS = ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d', '%d/%m/%Y %H:%M', '%d/%m/%Y')
+
+def parse_expiry(value):
+    value = (value or "").strip()
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    for date_format in IPAM_DATE_FORMATS:
+        try:
+            return time.mktime(time.strptime(value, date_format))
+        except ValueError:
+            continue
+    raise ValueError(f"Data de validade inválida: {value}")
+
+# Planilha CSV do IPAM, importada inteira sempre que o arquivo muda
+class IpamCsvSource:
+    """Colunas reconhecidas pelo cabeçalho (sem diferenciar maiúsculas): IP (obrigatória), MAC, hostname,
+    validade e status. Linhas com status "livre" não contam como atribuídas"""
+    source = "ipam"
+    COLUMNS = {
+        "ip": ("ip", "ip_address", "endereco", "endereço", "address"),
+        "mac_address": ("mac", "mac_address", "endereco_mac"),
+        "hostname": ("hostname", "host", "nome", "name"),
+        "expires": ("expires", "validade", "expira", "vencimento"),
+        "status": ("status", "estado", "situacao", "situação"),
+    }
+    FREE_STATUS = ("livre", "free", "disponivel", "disponível", "available", "vago")
+
+    def __init__(self, path):
+        self.path = path
+        self.signature = None
+
+    def poll(self, profile):
+        """Reimporta a planilha se ela mudou; retorna quantos IPs foram importados"""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return 0
+        signature = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        if signature == self.signature:
+            return 0
+        self.signature = signature
+
+        with open(self.path, newline='', encoding='utf-8-sig') as handle:
+            sample = handle.read(4096)
+            handle.seek(0)
+            try:
+                dialect = csv.Sniffer().sniff(sample, delimiters=',;\t')
+            except csv.Error:
+                dialect = csv.excel
+            reader = csv.DictReader(handle, dialect=dialect)
+            columns = {}
+            for header in reader.fieldnames or ():
+                for field, names in self.COLUMNS.items():
+                    if header.strip().lower() in names:
+                        columns.setdefault(field, header)
+            if "ip" not in columns:
+                log_error(f"Planilha {self.path} sem coluna de IP (cabeçalho: {', '.join(reader.fieldnames or ())})")
+                return 0
+
+            entries = []
+            invalid = 0
+            for row in reader:
+                value = lambda field: (row.get(columns[field]) or "").strip() if field in columns else ""
+                if value("status").lower() in self.FREE_STATUS:
+                    continue
+                try:
+                    ip = ipaddress.ip_address(value("ip"))
+                    expires = parse_expiry(value("expires"))
+                except ValueError:
+                    invalid += 1
+                    continue
+                if profile.allows(ip):
+                    entries.append({
+                        "ip": str(ip),
+                        "mac_address": value("mac_address").lower() or None,
+                        "hostname": value("hostname") or None,
+                        "expires": expires
+                    })
+        profile.inventory.replace_assignments(self.path, self.source, entries)
+        if DEBUG_MODE:
+            print(f"{len(entries)} IPs importados de {self.path}" + (f" ({invalid} linhas inválidas ignoradas)" if invalid else ""))
+        return len(entries)
+
+def parse_assignment_sources(lease_files=(), ipam_files=()):
+    """Fontes de um perfil a partir de listas de caminhos (ou strings separadas por vírgula)"""
+    if isinstance(lease_files, str):
+        lease_files = lease_files.split(',')
+    if isinstance(ipam_files, str):
+        ipam_files = ipam_files.split(',')
+    return ([LeaseFileSource(path.strip()) for path in lease_files if path.strip()] +
+            [IpamCsvSource(path.strip()) for path in ipam_files if path.strip()])
+
+assignment_task = None
+
+async def assignment_sources_loop():
+    """Verifica periodicamente os arquivos de lease e as planilhas de todos os perfis"""
+    while True:
+        for profile in network_profiles.values():
+            for source in profile.assignment_sources:
+                try:
+                    source.poll(profile)
+                except Exception as e:
+                    log_error(f"Erro ao ler {source.path}", e)
+        await asyncio.sleep(ASSIGNMENT_POLL_INTERVAL)
+
+def start_assignment_sources():
+    global assignment_task
+    if assignment_task is None and any(profile.assignment_sources for profile in network_profiles.values()):
+        assignment_task = asyncio.ensure_future(assignment_sources_loop())
+
+# Constantes do netlink (linux/rtnetlink.h, linux/neighbour.h)
+NETLINK_ROUTE = 0
+RTM_NEWNEIGH = 28
+RTM_DELNEIGH = 29
+RTM_GETNEIGH = 30
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+NLM_F_REQUEST = 0x001
+NLM_F_DUMP = 0x300
+RTMGRP_NEIGH = 0x4
+NDA_DST = 1
+NDA_LLADDR = 2
+
+# Estados NUD de uma entrada da tabela de vizinhos
+NUD_STATES = {
+    0x00: "NONE",
+    0x01: "INCOMPLETE",
+    0x02: "REACHABLE",
+    0x04: "STALE",
+    0x08: "DELAY",
+    0x10: "PROBE",
+    0x20: "FAILED",
+    0x40: "NOARP",
+    0x80: "PERMANENT",
+}
+
+# Estados que NÃO indicam um dispositivo presente
+NUD_ABSENT_STATES = ("NONE", "INCOMPLETE", "FAILED")
+
+# Decodifica uma mensagem RTM_NEWNEIGH/RTM_DELNEIGH
+def parse_neighbor_message(data, offset, length):
+    """Retorna um dicionário com ip, mac_address, state e ifindex, ou None"""
+    family, _, _, ifindex, state, _flags, _type = struct.unpack_from('BBHiHBB', data, offset)
+    if family not in (socket.AF_INET, socket.AF_INET6):
+        return None
+    entry = {
+        "ip": None,
+        "mac_address": None,
+        "state": NUD_STATES.get(state, hex(state)),
+        "ifindex": ifindex
+    }
+    pos = offset + 12
+    end = offset + length
+    while pos + 4 <= end:
+        rta_len, rta_type = struct.unpack_from('HH', data, pos)
+        if rta_len < 4:
+            break
+        value = data[pos + 4:pos + rta_len]
+        if rta_type == NDA_DST:
+            entry["ip"] = socket.inet_ntop(family, value)
+        elif rta_type == NDA_LLADDR and len(value) == 6:
+            entry["mac_address"] = format_mac(value)
+        pos += (rta_len + 3) & ~3
+    if entry["ip"] is None:
+        return None
+    return entry
+
+# Tabela de vizinhos do kernel (ARP/NDP) lida e atualizada via netlink
+class NeighborTable:
+    """Cópia em memória da tabela de vizinhos do kernel, atualizada por eventos netlink (ou relida
+    periodicamente, se a assinatura dos eventos não for possível)"""
+    def __init__(self):
+        self.entries = {}
+        self.loaded = 0.0
+        self.event_sock = None
+        self.loop = None
+        self.seq = 0
+
+    def dump(self):
+        """Lê a tabela de vizinhos inteira com uma única requisição RTM_GETNEIGH"""
+        sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_ROUTE)
+        try:
+            sock.bind((0, 0))
+            self.seq += 1
+            # nlmsghdr (16 bytes) + ndmsg (12 bytes), família AF_UNSPEC = IPv4 e IPv6
+            request = struct.pack('IHHII', 28, RTM_GETNEIGH, NLM_F_REQUEST | NLM_F_DUMP, self.seq, 0)
+            request += struct.pack('BBHiHBB', socket.AF_UNSPEC, 0, 0, 0, 0, 0, 0)
+            sock.send(request)
+
+            entries = {}
+            done = False
+            while not done:
+                data = sock.recv(65536)
+                for msg_type, offset, length in iter_netlink_messages(data):
+                    if msg_type == NLMSG_DONE:
+                        done = True
+                        break
+                    if msg_type == NLMSG_ERROR:
+                        errno_value = -struct.unpack_from('i', data, offset)[0]
+                        raise OSError(errno_value, "Erro netlink ao ler a tabela de vizinhos")
+                    if msg_type == RTM_NEWNEIGH:
+                        entry = parse_neighbor_message(data, offset, length)
+                        if entry:
+                            entries[entry["ip"]] = entry
+            self.entries = entries
+            self.loaded = time.time()
+        finally:
+            sock.close()
+
+        if DEBUG_MODE:
+            print(f"Tabela de vizinhos carregada via netlink: {len(self.entries)} entradas")
+        return self.entries
+
+    def current(self):
+        """Entradas atuais; sem a assinatura de eventos, a tabela é relida quando passa de ARP_SNAPSHOT_TTL"""
+        if self.event_sock is None and time.time() - self.loaded >= ARP_SNAPSHOT_TTL:
+            try:
+                self.dump()
+            except Exception as e:
+                # Mantém a última cópia; a próxima consulta tenta de novo
+                log_error("Erro ao reler a tabela de vizinhos", e)
+                self.loaded = time.time()
+        return self.entries
+
+    def subscribe(self, loop=None):
+        """Assina RTM_NEWNEIGH/RTM_DELNEIGH para manter a tabela atualizada sem polling"""
+        if self.event_sock is not None:
+            return
+        sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_ROUTE)
+        try:
+            sock.bind((0, RTMGRP_NEIGH))
+            sock.setblocking(False)
+            self.loop = loop or asyncio.get_event_loop()
+            self.loop.add_reader(sock.fileno(), self._on_event)
+        except Exception:
+            sock.close()
+            raise
+        self.event_sock = sock
+
+    def _on_event(self):
+        while True:
+            try:
+                data = self.event_sock.recv(65536)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                # ENOBUFS: perdemos eventos, então relemos a tabela inteira
+                log_error("Eventos netlink perdidos, recarregando tabela de vizinhos", e)
+                try:
+                    self.dump()
+                except Exception as dump_error:
+                    log_error("Erro ao recarregar tabela de vizinhos", dump_error)
+                return
+            for msg_type, offset, length in iter_netlink_messages(data):
+                if msg_type not in (RTM_NEWNEIGH, RTM_DELNEIGH):
+                    continue
+                # Uma mensagem malformada não pode derrubar o leitor de eventos
+                try:
+                    entry = parse_neighbor_message(data, offset, length)
+                except Exception as e:
+                    log_error("Mensagem netlink de vizinho inválida ignorada", e)
+                    continue
+                if not entry:
+                    continue
+                if msg_type == RTM_NEWNEIGH:
+                    self.entries[entry["ip"]] = entry
+                else:
+                    self.entries.pop(entry["ip"], None)
+
+    def lookup(self, ip):
+        """Retorna a entrada de um IP (qualquer estado) ou None"""
+        return self.entries.get(str(ip))
+
+    def is_present(self, ip):
+        """True se o IP tem entrada válida (ignora INCOMPLETE/FAILED)"""
+        entry = self.entries.get(str(ip))
+        return entry is not None and entry["state"] not in NUD_ABSENT_STATES
+
+    def close(self):
+        if self.event_sock is not None:
+            if self.loop is not None:
+                self.loop.remove_reader(self.event_sock.fileno())
+            self.event_sock.close()
+            self.event_sock = None
+
+# Percorre as mensagens de um buffer netlink
+def iter_netlink_messages(data):
+    """Gera (tipo, offset do payload, tamanho do payload) para cada nlmsghdr do buffer"""
+    pos = 0
+    while pos + 16 <= len(data):
+        msg_len, msg_type, _flags, _seq, _pid = struct.unpack_from('IHHII', data, pos)
+        if msg_len < 16:
+            break
+        yield msg_type, pos + 16, msg_len - 16
+        pos += (msg_len + 3) & ~3
+
+# Tabela de vizinhos global (None = ainda não carregada, False = netlink indisponível)
+neighbor_table = None
+
+def get_neighbor_table():
+    """Carrega a tabela via netlink na primeira chamada; retorna None se indisponível (ex: Windows)"""
+    global neighbor_table
+    if neighbor_table is None:
+        if not hasattr(socket, 'AF_NETLINK'):
+            neighbor_table = False
+        else:
+            table = NeighborTable()
+            try:
+                table.dump()
+                try:
+                    table.subscribe()
+                except Exception as e:
+                    log_error(f"Não foi possível assinar eventos de vizinhos (a tabela será relida a cada {ARP_SNAPSHOT_TTL:g} s)", e)
+                neighbor_table = table
+            except Exception as e:
+                log_error("Netlink indisponível, usando o comando arp", e)
+                neighbor_table = False
+    return neighbor_table or None
+
+# Índice compacto de fabricantes (OUI IEEE) em arquivo binário mapeado em memória
+#
+# Formato do arquivo (little-endian):
+#   cabeçalho: b'OUI1', u16 versão, u16 número de seções
+#   seções:    u8 bits do prefixo, 3 bytes de preenchimento, u32 registros, u32 offset
+#              registros ordenados pelo prefixo: (u32|u64 prefixo, u32 id do fabricante)
+#   nomes:     u32 quantidade, u32 offsets[quantidade + 1], bytes UTF-8
+OUI_MAGIC = b'OUI1'
+OUI_SECTION_BITS = (36, 28, 24)  # MA-S, MA-M, MA-L (do prefixo mais longo para o mais curto)
+
+class OUIIndex:
+    """Busca de fabricante por MAC com busca binária direto no arquivo mapeado (sem parse na inicialização)"""
+    def __init__(self, path):
+        import mmap
+        self.file = open(path, 'rb')
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, _version, section_count = struct.unpack_from('<4sHH', self.data, 0)
+        if magic != OUI_MAGIC:
+            raise ValueError(f"Arquivo OUI inválido: {path}")
+        self.sections = []
+        pos = 8
+        for _ in range(section_count):
+            bits, count, offset = struct.unpack_from('<BxxxII', self.data, pos)
+            record = struct.Struct('<II' if bits <= 32 else '<QI')
+            self.sections.append((bits, count, offset, record))
+            pos += 12
+        # Seções do prefixo mais longo para o mais curto (MA-S vence MA-L)
+        self.sections.sort(key=lambda s: -s[0])
+        self.names_offset = pos + sum(s[1] * s[3].size for s in self.sections)
+        self.vendor_count = struct.unpack_from('<I', self.data, self.names_offset)[0]
+        self.name_cache = {}
+
+    def _vendor_name(self, vendor_id):
+        name = self.name_cache.get(vendor_id)
+        if name is None:
+            table = self.names_offset + 4
+            start, end = struct.unpack_from('<II', self.data, table + vendor_id * 4)
+            blob = table + (self.vendor_count + 1) * 4
+            name = self.data[blob + start:blob + end].decode('utf-8', errors='replace')
+            self.name_cache[vendor_id] = name
+        return name
+
+    def lookup(self, mac):
+        """Retorna o nome do fabricante de um MAC (str ou inteiro de 48 bits) ou None"""
+        if isinstance(mac, str):
+            mac = int(re.sub(r'[^0-9A-Fa-f]', '', mac), 16)
+        data = self.data
+        for bits, count, offset, record in self.sections:
+            key = mac >> (48 - bits)
+            size = record.size
+            lo, hi = 0, count
+            while lo < hi:
+                mid = (lo + hi) // 2
+                prefix, vendor_id = record.unpack_from(data, offset + mid * size)
+                if prefix < key:
+                    lo = mid + 1
+                elif prefix > key:
+                    hi = mid
+                else:
+                    return self._vendor_name(vendor_id)
+        return None
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+# Gera o arquivo binário a partir dos CSVs do IEEE (oui.csv, mam.csv, oas.csv)
+def build_oui_index(csv_paths, output_path):
+    """Compila os registros MA-L/MA-M/MA-S do IEEE no formato binário ordenado. Retorna a quantidade de prefixos"""
+    sections = {bits: {} for bits in OUI_SECTION_BITS}
+    vendor_ids = {}
+    vendor_names = []
+    for csv_path in csv_paths:
+        with open(csv_path, newline='', encoding='utf-8', errors='replace') as f:
+            for row in csv.DictReader(f):
+                assignment = (row.get('Assignment') or '').strip()
+                name = (row.get('Organization Name') or '').strip()
+                bits = len(assignment) * 4
+                if bits not in sections or not name:
+                    continue
+                if name not in vendor_ids:
+                    vendor_ids[name] = len(vendor_names)
+                    vendor_names.append(name)
+                sections[bits][int(assignment, 16)] = vendor_ids[name]
+
+    header = struct.pack('<4sHH', OUI_MAGIC, 1, len(sections))
+    offset = len(header) + 12 * len(sections)
+    section_headers = b''
+    section_data = b''
+    for bits in OUI_SECTION_BITS:
+        records = sorted(sections[bits].items())
+        record = struct.Struct('<II' if bits <= 32 else '<QI')
+        section_headers += struct.pack('<BxxxII', bits, len(records), offset)
+        section_data += b''.join(record.pack(prefix, vendor_id) for prefix, vendor_id in records)
+        offset += len(records) * record.size
+
+    encoded = [name.encode('utf-8') for name in vendor_names]
+    name_offsets = [0]
+    for name in encoded:
+        name_offsets.append(name_offsets[-1] + len(name))
+    names = struct.pack('<I', len(encoded)) + struct.pack(f'<{len(name_offsets)}I', *name_offsets) + b''.join(encoded)
+
+    # Escrita atômica para não corromper o índice em uso
+    tmp_path = output_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(header + section_headers + section_data + names)
+    os.replace(tmp_path, output_path)
+    return sum(len(s) for s in sections.values())
+
+# Índice OUI global (None = ainda não carregado, False = arquivo ausente)
+oui_index = None
+
+def lookup_vendor(mac):
+    """Retorna o fabricante de um MAC usando o índice OUI local, ou None"""
+    global oui_index
+    if not mac:
+        return None
+    try:
+        first_octet = int(re.sub(r'[^0-9A-Fa-f]', '', mac)[:2], 16)
+    except ValueError:
+        return None
+    # MACs administrados localmente (ex: aleatórios de celulares) não têm fabricante
+    if first_octet & 0x02:
+        return "MAC administrado localmente (aleatório)"
+    if oui_index is None:
+        try:
+            oui_index = OUIIndex(OUI_DB_PATH)
+        except FileNotFoundError:
+            if DEBUG_MODE:
+                print(f"Índice OUI não encontrado em {OUI_DB_PATH}, fabricantes não serão exibidos")
+            oui_index = False
+        except Exception as e:
+            log_error(f"Erro ao abrir o índice OUI {OUI_DB_PATH}", e)
+            oui_index = False
+    if not oui_index:
+        return None
+    return oui_index.lookup(mac)
+
+# Cliente SNMP mínimo (v2c) para ler a tabela ARP dos roteadores com GETBULK
+SNMP_GET_BULK = 0xA5
+SNMP_RESPONSE = 0xA2
+SNMP_END_OF_MIB_VIEW = 0x82
+SNMP_NO_SUCH = (0x80, 0x81)  # noSuchObject, noSuchInstance
+
+IP_NET_TO_MEDIA_PHYS_ADDRESS = (1, 3, 6, 1, 2, 1, 4, 22, 1, 2)     # ipNetToMediaTable (só IPv4)
+IP_NET_TO_PHYSICAL_PHYS_ADDRESS = (1, 3, 6, 1, 2, 1, 4, 35, 1, 4)  # ipNetToPhysicalTable (IPv4 e IPv6)
+
+def _ber_tlv(tag, payload):
+    length = len(payload)
+    if length < 0x80:
+        return bytes([tag, length]) + payload
+    size = (length.bit_length() + 7) // 8
+    return bytes([tag, 0x80 | size]) + length.to_bytes(size, 'big') + payload
+
+def _ber_int(value):
+    return _ber_tlv(0x02, value.to_bytes(value.bit_length() // 8 + 1, 'big', signed=True))
+
+def _ber_oid(oid):
+    payload = bytearray([oid[0] * 40 + oid[1]])
+    for arc in oid[2:]:
+        chunk = [arc & 0x7F]
+        arc >>= 7
+        while arc:
+            chunk.append(0x80 | (arc & 0x7F))
+            arc >>= 7
+        payload.extend(reversed(chunk))
+    return _ber_tlv(0x06, bytes(payload))
+
+def _ber_read(data, offset):
+    """Lê um TLV a partir de offset. Retorna (tag, valor, próximo offset)"""
+    if offset + 2 > len(data):
+        raise ValueError("Pacote SNMP truncado")
+    tag, length = data[offset], data[offset + 1]
+    offset += 2
+    if length & 0x80:
+        size = length & 0x7F
+        length = int.from_bytes(data[offset:offset + size], 'big')
+        offset += size
+    if offset + length > len(data):
+        raise ValueError("Pacote SNMP truncado")
+    return tag, data[offset:offset + length], offset + length
+
+def _ber_decode_oid(payload):
+    first = payload[0]
+    oid = [min(first // 40, 2), first - 40 * min(first // 40, 2)]
+    arc = 0
+    for byte in payload[1:]:
+        arc = arc << 7 | (byte & 0x7F)
+        if not byte & 0x80:
+            oid.append(arc)
+            arc = 0
+    return tuple(oid)
+
+def snmp_encode_getbulk(community, request_id, oid, max_repetitions=SNMP_MAX_REPETITIONS):
+    """Monta um GetBulkRequest v2c com uma única variável"""
+    varbind = _ber_tlv(0x30, _ber_oid(oid) + b'\x05\x00')
+    pdu = _ber_tlv(SNMP_GET_BULK, _ber_int(request_id) + _ber_int(0) + _ber_int(max_repetitions) + _ber_tlv(0x30, varbind))
+    return _ber_tlv(0x30, _ber_int(1) + _ber_tlv(0x04, community.encode()) + pdu)
+
+def snmp_decode_response(data):
+    """Retorna (request-id, error-status, [(oid, tag, valor)]) de uma resposta v2c. Gera ValueError se inválida"""
+    tag, message, _ = _ber_read(data, 0)
+    if tag != 0x30:
+        raise ValueError("Resposta SNMP inválida")
+    _, _, offset = _ber_read(message, 0)           # versão
+    _, _, offset = _ber_read(message, offset)      # community
+    tag, pdu, _ = _ber_read(message, offset)
+    if tag != SNMP_RESPONSE:
+        raise ValueError(f"PDU SNMP inesperado: {tag:#x}")
+    _, raw_id, offset = _ber_read(pdu, 0)
+    _, raw_status, offset = _ber_read(pdu, offset)
+    _, _, offset = _ber_read(pdu, offset)          # error-index
+    _, varbinds_raw, _ = _ber_read(pdu, offset)
+    varbinds = []
+    offset = 0
+    while offset < len(varbinds_raw):
+        _, varbind, offset = _ber_read(varbinds_raw, offset)
+        _, raw_oid, value_offset = _ber_read(varbind, 0)
+        value_tag, value, _ = _ber_read(varbind, value_offset)
+        varbinds.append((_ber_decode_oid(raw_oid), value_tag, bytes(value)))
+    return int.from_bytes(raw_id, 'big', signed=True), int.from_bytes(raw_status, 'big'), varbinds
+
+class SnmpClientProtocol(asyncio.DatagramProtocol):
+    """Associa as respostas UDP às requisições pendentes pelo request-id"""
+    def __init__(self):
+        self.transport = None
+        self.waiters = {}
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        try:
+            request_id, status, varbinds = snmp_decode_response(data)
+        except (ValueError, IndexError):
+            return
+        waiter = self.waiters.pop(request_id, None)
+        if waiter is not None and not waiter.done():
+            waiter.set_result((status, varbinds))
+
+    def error_received(self, exc):
+        for waiter in self.waiters.values():
+            if not waiter.done():
+                waiter.set_exception(exc)
+        self.waiters.clear()
+
+    async def request(self, request_id, packet):
+        # UDP: reenvia após o timeout, até SNMP_RETRIES vezes
+        for attempt in range(SNMP_RETRIES + 1):
+            waiter = asyncio.get_running_loop().create_future()
+            self.waiters[request_id] = waiter
+            self.transport.sendto(packet)
+            try:
+                return await asyncio.wait_for(waiter, SNMP_TIMEOUT)
+            except asyncio.TimeoutError:
+                self.waiters.pop(request_id, None)
+        raise TimeoutError("sem resposta SNMP")
+
+async def snmp_walk_v2c(host, port, community, base_oid):
+    """Percorre a subárvore base_oid com GETBULK. Retorna [(oid, tag, valor)]"""
+    loop = asyncio.get_running_loop()
+    transport, protocol = await loop.create_datagram_endpoint(SnmpClientProtocol, remote_addr=(host, port))
+    try:
+        rows = []
+        current = tuple(base_oid)
+        while True:
+            request_id = int.from_bytes(os.urandom(3), 'big')
+            status, varbinds = await protocol.request(request_id, snmp_encode_getbulk(community, request_id, current))
+            if status:
+                raise RuntimeError(f"agente SNMP respondeu com erro {status}")
+            finished = not varbinds
+            for oid, tag, value in varbinds:
+                # Fim da subárvore, fim da MIB ou agente que não avança (evita laço infinito)
+                if oid[:len(base_oid)] != tuple(base_oid) or tag == SNMP_END_OF_MIB_VIEW or oid <= current:
+                    finished = True
+                    break
+                if tag not in SNMP_NO_SUCH:
+                    rows.append((oid, tag, value))
+                current = oid
+            if finished:
+                return rows
+    finally:
+        transport.close()
+
+async def snmp_walk_v3(host, port, base_oid):
+    """Mesmo que snmp_walk_v2c, com SNMPv3 (usuário/SHA/AES) via pysnmp, se instalado"""
+    try:
+        from pysnmp.hlapi.v3arch.asyncio import (
+            SnmpEngine, UsmUserData, UdpTransportTarget, ContextData, ObjectType, ObjectIdentity,
+            bulk_walk_cmd, usmHMACSHAAuthProtocol, usmAesCfb128Protocol, usmNoAuthProtocol, usmNoPrivProtocol
+        )
+    except ImportError:
+        raise RuntimeError("SNMPv3 requer o pacote pysnmp (pip install pysnmp)")
+    engine = SnmpEngine()
+    user = UsmUserData(
+        SNMP_V3_USER,
+        authKey=SNMP_V3_AUTH_KEY or None,
+        privKey=SNMP_V3_PRIV_KEY or None,
+        authProtocol=usmHMACSHAAuthProtocol if SNMP_V3_AUTH_KEY else usmNoAuthProtocol,
+        privProtocol=usmAesCfb128Protocol if SNMP_V3_PRIV_KEY else usmNoPrivProtocol
+    )
+    target = await UdpTransportTarget.create((host, port), timeout=SNMP_TIMEOUT, retries=SNMP_RETRIES)
+    rows = []
+    try:
+        async for error_indication, error_status, _, var_binds in bulk_walk_cmd(
+            engine, user, target, ContextData(), 0, SNMP_MAX_REPETITIONS,
+            ObjectType(ObjectIdentity('.'.join(map(str, base_oid)))), lexicographicMode=False
+        ):
+            if error_indication or error_status:
+                raise RuntimeError(f"agente SNMP respondeu com erro {error_indication or error_status.prettyPrint()}")
+            for name, value in var_binds:
+                rows.append((tuple(name), 0x04, bytes(value.asOctets()) if hasattr(value, 'asOctets') else b''))
+    finally:
+        engine.close_dispatcher()
+    return rows
+
+def parse_router_arp(rows, base_oid):
+    """Converte as linhas de ipNetToMediaPhysAddress/ipNetToPhysicalPhysAddress em entradas
+    no mesmo formato da tabela netlink (IP -> ip, mac_address, state, ifindex)"""
+    entries = {}
+    for oid, tag, value in rows:
+        index = oid[len(base_oid):]
+        try:
+            if base_oid == IP_NET_TO_MEDIA_PHYS_ADDRESS:
+                # ifIndex.a.b.c.d
+                ifindex, address = index[0], ipaddress.IPv4Address(bytes(index[1:5]))
+            else:
+                # ifIndex.tipo.tamanho.endereço (tipo 1 = IPv4, 2 = IPv6; tipos com zona são ignorados)
+                ifindex, kind, length = index[0], index[1], index[2]
+                if kind not in (1, 2) or length not in (4, 16):
+                    continue
+                address = ipaddress.ip_address(bytes(index[3:3 + length]))
+        except (ValueError, IndexError):
+            continue
+        # Entradas incompletas vêm sem MAC (ou com MAC zerado)
+        if len(value) != 6 or not any(value):
+            continue
+        entries[str(address)] = {
+            "ip": str(address),
+            "mac_address": format_mac(value),
+            "state": "REACHABLE",
+            "ifindex": ifindex
+        }
+    return entries
+
+# Converte a lista de roteadores ("host", "host:porta", "[ipv6]:porta" ou "gateway") em (host, porta)
+def parse_snmp_routers(routers, gateway=""):
+    if isinstance(routers, str):
+        routers = routers.split(',')
+    parsed = []
+    for router in routers:
+        host, port = router.strip(), 161
+        if host.startswith('['):
+            host, _, rest = host[1:].partition(']')
+            port = int(rest[1:]) if rest.startswith(':') else 161
+        elif host.count(':') == 1:
+            host, _, port = host.partition(':')
+            port = int(port)
+        if host == "gateway":
+            host = gateway
+        if host:
+            parsed.append((host, port))
+    return parsed
+
+class RouterArpCache:
+    """Tabela ARP dos roteadores de um perfil, lida por SNMP e reaproveitada por SNMP_CACHE_TTL segundos.
+    Se um roteador não responder, a última tabela lida dele continua valendo"""
+    def __init__(self, routers, community=SNMP_COMMUNITY):
+        self.routers = routers
+        self.community = community
+        self.tables = {}       # (host, porta) -> {ip: entrada}
+        self.table = {}
+        self.fetched = None
+        self.lock = None
+
+    async def fetch(self, host, port):
+        if SNMP_VERSION == '3':
+            walk = lambda oid: snmp_walk_v3(host, port, oid)
+        else:
+            walk = lambda oid: snmp_walk_v2c(host, port, self.community, oid)
+        # ipNetToPhysicalTable é a tabela atual; roteadores antigos só têm ipNetToMediaTable
+        table = parse_router_arp(await walk(IP_NET_TO_PHYSICAL_PHYS_ADDRESS), IP_NET_TO_PHYSICAL_PHYS_ADDRESS)
+        if not table:
+            table = parse_router_arp(await walk(IP_NET_TO_MEDIA_PHYS_ADDRESS), IP_NET_TO_MEDIA_PHYS_ADDRESS)
+        return table
+
+    async def get(self):
+        if not self.routers:
+            return {}
+        if self.fetched is not None and time.monotonic() - self.fetched < SNMP_CACHE_TTL:
+            return self.table
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+        # Chamadas simultâneas aguardam e reaproveitam a mesma leitura
+        async with self.lock:
+            if self.fetched is not None and time.monotonic() - self.fetched < SNMP_CACHE_TTL:
+                return self.table
+            results = await asyncio.gather(*[self.fetch(host, port) for host, port in self.routers], return_exceptions=True)
+            for router, result in zip(self.routers, results):
+                if isinstance(result, Exception):
+                    log_error(f"Erro ao ler a tabela ARP de {router[0]}:{router[1]} por SNMP", result)
+                    continue
+                self.tables[router] = result
+                if DEBUG_MODE:
+                    print(f"Tabela ARP de {router[0]}:{router[1]} lida por SNMP: {len(result)} entradas")
+            merged = {}
+            for table in self.tables.values():
+                merged.update(table)
+            self.table = merged
+            self.fetched = time.monotonic()
+        return self.table
+
+async def read_router_arp_table():
+    """Tabela ARP dos roteadores do perfil ativo ({} se não houver roteadores configurados)"""
+    return await current_profile().router_arp.get()
+
+# Backends de varredura em lote: um único processo externo para a faixa inteira
+class ScanBackend(abc.ABC):
+    """Executa uma ferramenta externa sobre uma faixa e interpreta a saída linha a linha"""
+    name = None
+    binary = None
+    ok_returncodes = (0,)
+
+    def available(self):
+        return shutil.which(self.binary) is not None
+
+    @abc.abstractmethod
+    def command(self, targets):
+        """Monta a linha de comando para uma lista de alvos (uma rede CIDR ou IPs individuais)"""
+
+    @abc.abstractmethod
+    def feed(self, line):
+        """Interpreta uma linha da saída e retorna uma lista de (ip, mac) de hosts ativos"""
+
+
+class FpingBackend(ScanBackend):
+    name = "fping"
+    binary = "fping"
+    # fping retorna 1 quando algum host não respondeu
+    ok_returncodes = (0, 1)
+
+    def command(self, targets):
+        cmd = ['fping', '-a', '-q', '-r', '1', '-t', '500']
+        # -g gera a lista a partir de uma rede CIDR
+        if len(targets) == 1 and '/' in targets[0]:
+            cmd.append('-g')
+        return cmd + targets
+
+    def feed(self, line):
+        line = line.strip()
+        if ARP_IP_PATTERN.fullmatch(line):
+            return [(line, None)]
+        return []
+
+
+class NmapBackend(ScanBackend):
+    name = "nmap"
+    binary = "nmap"
+
+    def __init__(self):
+        self.parser = XMLPullParser(events=('end',))
+
+    def command(self, targets):
+        return ['nmap', '-sn', '-n', '-oX', '-'] + targets
+
+    def feed(self, line):
+        self.parser.feed(line)
+        found = []
+        for _event, element in self.parser.read_events():
+            if element.tag != 'host':
+                continue
+            status = element.find('status')
+            if status is not None and status.get('state') == 'up':
+                ip = mac = None
+                for address in element.findall('address'):
+                    if address.get('addrtype') == 'ipv4':
+                        ip = address.get('addr')
+                    elif address.get('addrtype') == 'mac':
+                        mac = address.get('addr').lower()
+                if ip:
+                    found.append((ip, mac))
+            # Liberar memória dos hosts já processados
+            element.clear()
+        return found
+
+
+class ArpScanBackend(ScanBackend):
+    name = "arp-scan"
+    binary = "arp-scan"
+
+    def available(self):
+        # arp-scan precisa de socket raw (root)
+        return super().available() and hasattr(os, 'geteuid') and os.geteuid() == 0
+
+    def command(self, targets):
+        cmd = ['arp-scan', '--quiet', '--plain']
+        # Interface do perfil da varredura; a global só quando o perfil não define uma
+        interface = current_profile().passive_interface or PASSIVE_INTERFACE
+        if interface:
+            cmd += ['--interface', interface]
+        return cmd + targets
+
+    def feed(self, line):
+        parts = line.split('\t')
+        if len(parts) >= 2 and ARP_IP_PATTERN.fullmatch(parts[0].strip()):
+            return [(parts[0].strip(), parts[1].strip().lower())]
+        return []
+
+
+SCAN_BACKENDS = {
+    "fping": FpingBackend,
+    "nmap": NmapBackend,
+    "arp-scan": ArpScanBackend,
+}
+
+# Classe do backend escolhido na primeira varredura (None = ainda não detectado, False = nenhum disponível)
+scan_backend = None
+
+def get_scan_backend():
+    """Retorna uma nova instância do backend configurado em SCAN_BACKEND (ou do primeiro disponível em 'auto'), ou None.
+    Só a escolha fica em cache: cada execução tem o próprio estado (ex: o parser XML do nmap)"""
+    global scan_backend
+    if scan_backend is None:
+        scan_backend = False
+        choice = SCAN_BACKEND.lower()
+        names = [] if choice in ("", "none", "nenhum") else list(SCAN_BACKENDS) if choice == "auto" else [choice]
+        for name in names:
+            backend_class = SCAN_BACKENDS.get(name)
+            if backend_class is None:
+                log_error(f"Backend de varredura desconhecido: {name}")
+                continue
+            if backend_class().available():
+                scan_backend = backend_class
+                if DEBUG_MODE:
+                    print(f"Backend de varredura em lote: {name}")
+                break
+    return scan_backend() if scan_backend else None
+
+# Executa o backend e consome a saída à medida que ela chega
+async def run_scan_backend(backend, targets, on_progress=None):
+    """Retorna {ip: mac ou None} dos hosts ativos entre os alvos. Gera RuntimeError se a ferramenta falhar"""
+    cmd = backend.command(targets)
+    if DEBUG_MODE:
+        print(f"Executando varredura em lote: {' '.join(cmd)}")
+
+    process = await asyncio.create_subprocess_exec(
+        *cmd,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE
+    )
+    stderr_task = asyncio.ensure_future(process.stderr.read())
+
+    alive = {}
+    last_progress = time.time()
+
+    async def consume():
+        nonlocal last_progress
+        async for raw_line in process.stdout:
+            for ip, mac in backend.feed(raw_line.decode('utf-8', errors='ignore')):
+                alive[ip] = mac
+            if on_progress and time.time() - last_progress >= 2.0:
+                last_progress = time.time()
+                await on_progress(len(alive))
+        await process.wait()
+
+    try:
+        await asyncio.wait_for(consume(), timeout=SCAN_BACKEND_TIMEOUT)
+    except asyncio.TimeoutError:
+        process.kill()
+        raise RuntimeError(f"{backend.name} excedeu {SCAN_BACKEND_TIMEOUT}s")
+    finally:
+        stderr = await stderr_task
+
+    if process.returncode not in backend.ok_returncodes:
+        raise RuntimeError(f"{backend.name} terminou com código {process.returncode}: {stderr.decode('utf-8', errors='ignore').strip()}")
+    return alive
+
+async def scan_with_backend(network, on_progress=None, hosts=None):
+    """Varre a rede (ou só os hosts informados) com um backend em lote.
+    Retorna {ip: livre?} como is_ip_available, ou None se indisponível/falhou"""
+    backend = get_scan_backend()
+    if backend is None:
+        return None
+    targets = [str(ip) for ip in hosts] if hosts is not None else [str(network)]
+    try:
+        alive = await run_scan_backend(backend, targets, on_progress)
+    except Exception as e:
+        log_error(f"Falha na varredura com {backend.name}, usando verificação IP a IP", e)
+        return None
+
+    # Registrar os hosts ativos no inventário
+    target_inventory = current_profile().inventory
+    for ip, mac in alive.items():
+        target_inventory.record_sighting(ip, mac=mac, source=backend.name)
+
+    # Hosts que não responderam ainda contam como ocupados se estiverem na tabela ARP
+    arp_table = await read_arp_table()
+    store = get_inventory_store()
+    results = {}
+    for ip in (hosts if hosts is not None else network.hosts()):
+        ip_str = str(ip)
+        arp_entry = arp_table.get(ip_str)
+        in_arp = arp_entry is not None and arp_entry["state"] not in NUD_ABSENT_STATES
+        results[ip_str] = ip_str not in alive and not in_arp
+        if store and results[ip_str]:
+            store.record(ip_str, True, source=backend.name)
+
+    if DEBUG_MODE:
+        print(f"Varredura com {backend.name}: {len(alive)} hosts ativos em {network}")
+    return results
+
+# Histórico de presença: intervalos [início, fim] (segundos do dia) codificados em varint (zigzag + delta)
+def encode_presence_chunk(intervals, is_open):
+    values = [1 if is_open else 0, len(intervals)]
+    previous = 0
+    for start, end in intervals:
+        values += [start - previous, end - start]
+        previous = end
+    raw = bytearray()
+    for value in values:
+        value = value << 1 if value >= 0 else (-value << 1) - 1  # zigzag
+        while value >= 0x80:
+            raw.append(value & 0x7F | 0x80)
+            value >>= 7
+        raw.append(value)
+    return bytes(raw)
+
+def decode_presence_chunk(blob):
+    """Retorna ([[início, fim], ...], intervalo aberto?)"""
+    # Linhas antigas eram comprimidas com zlib (começam com 0x78; as novas com 0x00 ou 0x02)
+    if blob[:1] == b'\x78':
+        blob = zlib.decompress(blob)
+    values = []
+    value = shift = 0
+    for byte in blob:
+        value |= (byte & 0x7F) << shift
+        shift += 7
+        if not byte & 0x80:
+            values.append(value >> 1 if not value & 1 else -((value + 1) >> 1))
+            value = shift = 0
+    intervals = []
+    previous = 0
+    for index in range(values[1]):
+        start = previous + values[2 + index * 2]
+        previous = start + values[3 + index * 2]
+        intervals.append([start, previous])
+    return intervals, bool(values[0])
+
+# Inventário persistente em SQLite
+class InventoryStore:
+    """Guarda o último resultado de cada IP em SQLite (modo WAL), com gravações agrupadas em lotes"""
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS hosts (
+            ip TEXT PRIMARY KEY,
+            ip_int INTEGER,
+            status TEXT NOT NULL,
+            mac_address TEXT,
+            hostname TEXT,
+            source TEXT,
+            last_checked REAL NOT NULL,
+            last_seen REAL
+        );
+        CREATE INDEX IF NOT EXISTS hosts_ip_int ON hosts (ip_int);
+        CREATE INDEX IF NOT EXISTS hosts_last_seen ON hosts (last_seen);
+        CREATE TABLE IF NOT EXISTS subscribers (
+            user_id INTEGER PRIMARY KEY
+        );
+        CREATE TABLE IF NOT EXISTS presence (
+            ip TEXT NOT NULL,
+            day INTEGER NOT NULL,
+            ip_int INTEGER,
+            intervals BLOB NOT NULL,
+            PRIMARY KEY (ip, day)
+        );
+        CREATE INDEX IF NOT EXISTS presence_ip_int ON presence (ip_int, day);
+        CREATE TABLE IF NOT EXISTS reservations (
+            ip TEXT PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            user_name TEXT,
+            created REAL NOT NULL,
+            expires REAL,
+            confirmed INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE TABLE IF NOT EXISTS scan_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            network TEXT NOT NULL,
+            user_id INTEGER,
+            max_age REAL,
+            created REAL NOT NULL,
+            updated REAL NOT NULL,
+            done BLOB,
+            free BLOB,
+            errors INTEGER NOT NULL DEFAULT 0
+        );
+    """
+    MAX_PENDING = 10000  # Resultados guardados para regravar enquanto o banco falha
+    UPSERT_PRESENCE = """
+        INSERT INTO presence (ip, day, ip_int, intervals) VALUES (?, ?, ?, ?)
+        ON CONFLICT (ip, day) DO UPDATE SET intervals = excluded.intervals
+    """
+    UPSERT = """
+        INSERT INTO hosts (ip, ip_int, status, mac_address, hostname, source, last_checked, last_seen)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (ip) DO UPDATE SET
+            status = CASE WHEN excluded.last_checked >= hosts.last_checked THEN excluded.status ELSE hosts.status END,
+            source = CASE WHEN excluded.last_checked >= hosts.last_checked THEN excluded.source ELSE hosts.source END,
+            mac_address = COALESCE(excluded.mac_address, hosts.mac_address),
+            hostname = COALESCE(excluded.hostname, hosts.hostname),
+            last_checked = MAX(hosts.last_checked, excluded.last_checked),
+            last_seen = CASE
+                WHEN excluded.last_seen IS NULL THEN hosts.last_seen
+                WHEN hosts.last_seen IS NULL THEN excluded.last_seen
+                ELSE MAX(hosts.last_seen, excluded.last_seen)
+            END
+    """
+
+    def __init__(self, path):
+        # isolation_level=None: transações controladas manualmente (BEGIN/COMMIT por lote)
+        self.conn = sqlite3.connect(path, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(self.SCHEMA)
+        self.pending = []
+        self.flush_handle = None
+        self.failures = 0   # Falhas seguidas de gravação (enquanto houver, só o timer tenta de novo)
+        # Incrementado a cada lote gravado (usado pelos caches da API)
+        self.generation = 0
+        # Histórico do dia em memória: (ip, dia) -> [intervalos, aberto?, ip_int, alterado?]
+        self.presence = {}
+        self.pruned_day = None
+
+    def record(self, ip, is_free, mac=None, hostname=None, source="sonda", timestamp=None):
+        """Enfileira o resultado de um IP; a gravação acontece em lote logo em seguida"""
+        ip = ipaddress.ip_address(ip)
+        now = timestamp if timestamp is not None else time.time()
+        self.pending.append((
+            str(ip),
+            int(ip) if ip.version == 4 else None,
+            "livre" if is_free else "em_uso",
+            mac,
+            hostname,
+            source,
+            now,
+            None if is_free else now
+        ))
+        if HISTORY_DAYS:
+            self.observe_presence(str(ip), int(ip) if ip.version == 4 else None, not is_free, now)
+        if len(self.pending) >= STORE_BATCH_SIZE and not self.failures:
+            self.flush()
+        elif self.flush_handle is None:
+            # Agrupar as gravações do próximo segundo em uma única transação
+            try:
+                self.flush_handle = asyncio.get_running_loop().call_later(1.0, self.flush)
+            except RuntimeError:
+                self.flush()
+
+    def flush(self):
+        """Grava todos os resultados pendentes em uma única transação"""
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        if not self.pending:
+            return
+        batch, self.pending = self.pending, []
+        chunks = [(key, chunk) for key, chunk in self.presence.items() if chunk[3]]
+        try:
+            self.conn.execute("BEGIN")
+            self.conn.executemany(self.UPSERT, batch)
+            self.conn.executemany(self.UPSERT_PRESENCE, [
+                (ip, day, chunk[2], encode_presence_chunk(chunk[0], chunk[1])) for (ip, day), chunk in chunks
+            ])
+            self.conn.execute("COMMIT")
+            self.generation += 1
+            self.failures = 0
+            for _, chunk in chunks:
+                chunk[3] = False
+        except Exception as e:
+            # A falha pode ter acontecido antes do BEGIN ou o SQLite pode já ter desfeito a transação
+            if self.conn.in_transaction:
+                self.conn.execute("ROLLBACK")
+            # O lote volta para a fila (o UPSERT pode ser repetido); acima do limite, os mais antigos são descartados
+            self.pending = batch + self.pending
+            self.failures += 1
+            dropped = max(0, len(self.pending) - self.MAX_PENDING)
+            del self.pending[:dropped]
+            detail = f"{dropped} resultados antigos descartados" if dropped else "nova tentativa em 5 s"
+            log_error(f"Erro ao gravar {len(batch)} resultados no inventário ({detail})", e)
+            try:
+                self.flush_handle = asyncio.get_running_loop().call_later(5.0, self.flush)
+            except RuntimeError:
+                pass
+        self._prune_presence()
+
+    def observe_presence(self, ip, ip_int, up, timestamp):
+        """Acrescenta uma observação ao histórico do IP: "em uso" estende o intervalo aberto ou abre um novo"""
+        day, second = divmod(int(timestamp), 86400)
+        key = (ip, day)
+        chunk = self.presence.get(key)
+        if chunk is None:
+            row = self.conn.execute("SELECT intervals FROM presence WHERE ip = ? AND day = ?", key).fetchone()
+            intervals, is_open = decode_presence_chunk(row[0]) if row else ([], False)
+            chunk = self.presence[key] = [intervals, is_open, ip_int, False]
+        intervals = chunk[0]
+        if up:
+            last = intervals[-1] if intervals else None
+            if last and chunk[1] and last[1] < second <= last[1] + HISTORY_MERGE_GAP:
+                last[1] = second
+            elif not any(start <= second <= end for start, end in intervals):
+                # Observação fora de ordem (ex: replay de pcap) entra na posição certa
+                bisect.insort(intervals, [second, second])
+            chunk[1] = intervals[-1][1] == second
+        else:
+            chunk[1] = False
+        chunk[3] = True
+
+    def _prune_presence(self):
+        today = int(time.time() // 86400)
+        # Em memória só o dia atual (e nada além do limite)
+        if len(self.presence) > HISTORY_CACHE_MAX or any(day != today for _, day in self.presence):
+            self.presence = {key: chunk for key, chunk in self.presence.items() if chunk[3] or key[1] == today}
+            if len(self.presence) > HISTORY_CACHE_MAX:
+                self.presence = {key: chunk for key, chunk in self.presence.items() if chunk[3]}
+        # Dias fora da janela são apagados uma vez por dia
+        if self.pruned_day != today:
+            self.pruned_day = today
+            try:
+                self.conn.execute("DELETE FROM presence WHERE day < ?", (today - HISTORY_DAYS,))
+            except Exception as e:
+                log_error("Erro ao apagar o histórico antigo", e)
+
+    def presence_summary(self, target, days=None):
+        """Resumo da presença de um IP, de uma lista de IPs ou de uma rede nos últimos `days` dias:
+        {ip: {"last_seen": horário ou None, "days_seen": dias (número do dia) em que esteve ativo,
+        "days_observed": dias com alguma observação}}. Só IPs com observações aparecem"""
+        self.flush()
+        since = int(time.time() // 86400) - (days or HISTORY_DAYS) + 1
+        if isinstance(target, (ipaddress.IPv4Network, ipaddress.IPv6Network)):
+            if target.version == 4:
+                rows = self.conn.execute(
+                    "SELECT ip, day, intervals FROM presence WHERE ip_int BETWEEN ? AND ? AND day >= ?",
+                    (int(target.network_address), int(target.broadcast_address), since)
+                ).fetchall()
+            else:
+                rows = [row for row in self.conn.execute(
+                    "SELECT ip, day, intervals FROM presence WHERE ip_int IS NULL AND day >= ?", (since,)
+                ) if ipaddress.ip_address(row["ip"]) in target]
+        else:
+            ips = [str(target)] if isinstance(target, (str, ipaddress.IPv4Address, ipaddress.IPv6Address)) else [str(ip) for ip in target]
+            rows = []
+            for start in range(0, len(ips), 500):
+                part = ips[start:start + 500]
+                rows += self.conn.execute(
+                    f"SELECT ip, day, intervals FROM presence WHERE ip IN ({','.join('?' * len(part))}) AND day >= ?",
+                    (*part, since)
+                ).fetchall()
+
+        summary = {}
+        for row in rows:
+            entry = summary.setdefault(row["ip"], {"last_seen": None, "days_seen": set(), "days_observed": 0})
+            entry["days_observed"] += 1
+            intervals, _ = decode_presence_chunk(row["intervals"])
+            if intervals:
+                entry["days_seen"].add(row["day"])
+                last = row["day"] * 86400 + intervals[-1][1]
+                entry["last_seen"] = max(entry["last_seen"] or 0, last)
+        return summary
+
+    def get(self, ip):
+        """Retorna o registro de um IP (dicionário) ou None"""
+        self.flush()
+        row = self.conn.execute("SELECT * FROM hosts WHERE ip = ?", (str(ip),)).fetchone()
+        return dict(row) if row else None
+
+    def all_hosts(self):
+        """Retorna todos os registros em ordem de IP"""
+        self.flush()
+        return [dict(row) for row in self.conn.execute("SELECT * FROM hosts ORDER BY ip_int, ip")]
+
+    def query_network(self, network):
+        """Retorna {ip: registro} de todos os IPs conhecidos dentro da rede"""
+        self.flush()
+        rows = self.conn.execute(
+            "SELECT * FROM hosts WHERE ip_int BETWEEN ? AND ?",
+            (int(network.network_address), int(network.broadcast_address))
+        ).fetchall()
+        return {row["ip"]: dict(row) for row in rows}
+
+    @staticmethod
+    def is_fresh(row, max_age=None, now=None):
+        """Um registro é recente se o host foi visto ativo há pouco ou se foi verificado dentro de max_age segundos"""
+        now = now if now is not None else time.time()
+        if row["status"] == "em_uso" and row["last_seen"] and now - row["last_seen"] <= STORE_ALIVE_TTL:
+            return True
+        return max_age is not None and now - row["last_checked"] <= max_age
+
+    def fresh_result(self, ip, max_age=None):
+        """Retorna (livre?, registro) se houver resultado recente para o IP, senão None"""
+        row = self.get(ip)
+        if row and self.is_fresh(row, max_age):
+            return row["status"] == "livre", row
+        return None
+
+    def fresh_results(self, network, max_age=None):
+        """Retorna {ip: livre?} dos IPs da rede com resultado recente"""
+        now = time.time()
+        return {
+            ip: row["status"] == "livre"
+            for ip, row in self.query_network(network).items()
+            if self.is_fresh(row, max_age, now)
+        }
+
+    def load_subscribers(self):
+        return {row["user_id"] for row in self.conn.execute("SELECT user_id FROM subscribers")}
+
+    def add_subscriber(self, user_id):
+        self.conn.execute("INSERT OR IGNORE INTO subscribers (user_id) VALUES (?)", (user_id,))
+
+    def remove_subscriber(self, user_id):
+        self.conn.execute("DELETE FROM subscribers WHERE user_id = ?", (user_id,))
+
+    def load_reservations(self):
+        return [dict(row) for row in self.conn.execute("SELECT * FROM reservations")]
+
+    def save_reservations(self, reservations):
+        """Grava (ou substitui) várias reservas em uma única transação"""
+        self.conn.execute("BEGIN")
+        try:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO reservations (ip, user_id, user_name, created, expires, confirmed) VALUES (?, ?, ?, ?, ?, ?)",
+                [(r.ip, r.user_id, r.user_name, r.created, r.expires, int(r.confirmed)) for r in reservations]
+            )
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+
+    def delete_reservations(self, ips):
+        self.conn.execute("BEGIN")
+        try:
+            self.conn.executemany("DELETE FROM reservations WHERE ip = ?", [(ip,) for ip in ips])
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+
+    def create_scan_job(self, network, user_id, max_age=None):
+        """Registra uma varredura em andamento e retorna o id"""
+        now = time.time()
+        cursor = self.conn.execute(
+            "INSERT INTO scan_jobs (network, user_id, max_age, created, updated) VALUES (?, ?, ?, ?, ?)",
+            (str(network), user_id, max_age, now, now)
+        )
+        return cursor.lastrowid
+
+    def save_scan_job(self, job_id, done, free, errors):
+        # Os resultados já enviados ao inventário vão junto, para o progresso nunca estar à frente deles
+        self.flush()
+        self.conn.execute(
+            "UPDATE scan_jobs SET done = ?, free = ?, errors = ?, updated = ? WHERE id = ?",
+            (done, free, errors, time.time(), job_id)
+        )
+
+    def delete_scan_job(self, job_id):
+        self.conn.execute("DELETE FROM scan_jobs WHERE id = ?", (job_id,))
+
+    def pending_scan_jobs(self):
+        """Varreduras que não terminaram (interrompidas por um reinício)"""
+        return [dict(row) for row in self.conn.execute("SELECT * FROM scan_jobs ORDER BY id")]
+
+    def close(self):
+        self.flush()
+        self.conn.close()
+
+# Abre um inventário persistente; False se o caminho estiver vazio ou a abertura falhar
+def open_inventory_store(path):
+    if not path:
+        return False
+    try:
+        store = InventoryStore(path)
+        if DEBUG_MODE:
+            print(f"Inventário persistente aberto em {path}")
+        return store
+    except Exception as e:
+        log_error(f"Erro ao abrir o inventário {path}", e)
+        return False
+
+def get_inventory_store():
+    """Inventário persistente do perfil de rede ativo (aberto na primeira chamada), ou None se desativado"""
+    return current_profile().get_store()
+
+# Descreve há quanto tempo um registro do inventário foi verificado
+def format_age(timestamp):
+    age = max(0, int(time.time() - timestamp))
+    if age < 60:
+        return f"{age}s"
+    if age < 3600:
+        return f"{age // 60} min"
+    if age < 86400:
+        return f"{age // 3600}h{(age % 3600) // 60:02d}"
+    return f"{age // 86400}d{(age % 86400) // 3600:02d}h"
+
+# Reserva de um IP entregue a um usuário
+class Reservation:
+    __slots__ = ("ip", "user_id", "user_name", "created", "expires", "confirmed")
+
+    def __init__(self, ip, user_id, user_name=None, created=None, expires=None, confirmed=False):
+        self.ip = ip
+        self.user_id = user_id
+        self.user_name = user_name
+        self.created = created if created is not None else time.time()
+        self.expires = expires          # None = sem prazo
+        self.confirmed = bool(confirmed)
+
+# Reservas ativas de um perfil, persistidas no inventário
+class ReservationLedger:
+    """IP -> Reservation, com um índice de bitmaps por bloco de 256 endereços (verificar um IP é um
+    teste de bit; listar uma faixa percorre só os blocos dela) e um heap de vencimentos para expirar
+    as reservas sem varrer todas. Verificar e reservar acontecem sem nenhum await no meio, então duas
+    tarefas nunca recebem o mesmo IP"""
+    def __init__(self, store=None):
+        self.store = store
+        self.entries = {}      # IP -> Reservation
+        self.blocks = {}       # (versão, IP >> 8) -> bitmap dos IPs reservados no bloco
+        self.expiry = []       # heap (vencimento, IP); entradas obsoletas são descartadas ao sair
+        self.generation = 0    # Incrementado a cada mudança (usado pelos caches da API)
+        if store:
+            now = time.time()
+            try:
+                for row in store.load_reservations():
+                    if row["expires"] is None or row["expires"] > now:
+                        self._put(Reservation(row["ip"], row["user_id"], row["user_name"], row["created"],
+                                              row["expires"], row["confirmed"]))
+            except Exception as e:
+                log_error("Erro ao carregar as reservas de IPs", e)
+
+    @staticmethod
+    def _block(ip):
+        ip = ipaddress.ip_address(ip)
+        value = int(ip)
+        return (ip.version, value >> 8), 1 << (value & 0xFF)
+
+    def _put(self, reservation):
+        self.entries[reservation.ip] = reservation
+        key, bit = self._block(reservation.ip)
+        self.blocks[key] = self.blocks.get(key, 0) | bit
+        if reservation.expires is not None:
+            heapq.heappush(self.expiry, (reservation.expires, reservation.ip))
+
+    def _drop(self, ip):
+        del self.entries[ip]
+        key, bit = self._block(ip)
+        bits = self.blocks.get(key, 0) & ~bit
+        if bits:
+            self.blocks[key] = bits
+        else:
+            self.blocks.pop(key, None)
+
+    def _persist(self, saved=(), deleted=()):
+        self.generation += 1
+        if not self.store:
+            return
+        try:
+            if saved:
+                self.store.save_reservations(saved)
+            if deleted:
+                self.store.delete_reservations(deleted)
+        except Exception as e:
+            log_error("Erro ao gravar as reservas de IPs", e)
+
+    def expire(self, now=None):
+        """Remove as reservas vencidas"""
+        now = now if now is not None else time.time()
+        expired = []
+        while self.expiry and self.expiry[0][0] <= now:
+            _, ip = heapq.heappop(self.expiry)
+            reservation = self.entries.get(ip)
+            # O heap pode ter vencimentos antigos de reservas renovadas ou confirmadas
+            if reservation and reservation.expires is not None and reservation.expires <= now:
+                self._drop(ip)
+                expired.append(ip)
+        if expired:
+            if DEBUG_MODE:
+                print(f"{len(expired)} reservas de IPs expiraram")
+            self._persist(deleted=expired)
+
+    def holder(self, ip):
+        """Reserva ativa do IP, ou None"""
+        key, bit = self._block(ip)
+        if not self.blocks.get(key, 0) & bit:
+            return None
+        self.expire()
+        return self.entries.get(str(ipaddress.ip_address(ip)))
+
+    def is_reserved(self, ip, user_id=None):
+        """True se o IP estiver reservado para outra pessoa que não `user_id`"""
+        reservation = self.holder(ip)
+        return reservation is not None and reservation.user_id != user_id
+
+    def claim(self, ips, user, ttl=None):
+        """Reserva para o usuário os IPs que não estão reservados para outra pessoa e retorna esses IPs.
+        Reservas do próprio usuário são renovadas (as confirmadas ficam como estão)"""
+        self.expire()
+        now = time.time()
+        expires = now + (ttl or RESERVATION_TTL)
+        granted, saved = [], []
+        for ip in ips:
+            ip = str(ipaddress.ip_address(ip))
+            reservation = self.entries.get(ip)
+            if reservation is None:
+                reservation = Reservation(ip, user.id, str(user), now, expires)
+                self._put(reservation)
+                saved.append(reservation)
+            elif reservation.user_id != user.id:
+                continue
+            elif not reservation.confirmed:
+                reservation.expires = expires
+                heapq.heappush(self.expiry, (expires, ip))
+                saved.append(reservation)
+            granted.append(ip)
+        if saved:
+            self._persist(saved=saved)
+        return granted
+
+    def confirm(self, ips, user):
+        """Confirma reservas do usuário (ou reserva e confirma IPs sem reserva); retorna os IPs confirmados"""
+        self.expire()
+        now = time.time()
+        expires = now + RESERVATION_CONFIRM_TTL if RESERVATION_CONFIRM_TTL else None
+        confirmed = []
+        for ip in ips:
+            ip = str(ipaddress.ip_address(ip))
+            reservation = self.entries.get(ip)
+            if reservation is None:
+                reservation = Reservation(ip, user.id, str(user), now)
+                self._put(reservation)
+            elif reservation.user_id != user.id:
+                continue
+            reservation.confirmed = True
+            reservation.expires = expires
+            if expires is not None:
+                heapq.heappush(self.expiry, (expires, ip))
+            confirmed.append(reservation)
+        if confirmed:
+            self._persist(saved=confirmed)
+        return [reservation.ip for reservation in confirmed]
+
+    def release(self, user, ips=None):
+        """Libera reservas do usuário (todas, se `ips` for None); retorna os IPs liberados"""
+        self.expire()
+        if ips is None:
+            released = [ip for ip, reservation in self.entries.items() if reservation.user_id == user.id]
+        else:
+            released = []
+            for ip in ips:
+                ip = str(ipaddress.ip_address(ip))
+                reservation = self.entries.get(ip)
+                if reservation is not None and reservation.user_id == user.id:
+                    released.append(ip)
+        for ip in released:
+            self._drop(ip)
+        if released:
+            self._persist(deleted=released)
+        return released
+
+    def in_network(self, network):
+        """Reservas ativas dentro da rede, em ordem de IP"""
+        self.expire()
+        first, last = int(network.network_address), int(network.broadcast_address)
+        address_class = ipaddress.IPv4Address if network.version == 4 else ipaddress.IPv6Address
+        # Percorrer os blocos da faixa ou os blocos ocupados, o que for menor
+        if (last >> 8) - (first >> 8) < len(self.blocks):
+            keys = [(network.version, block) for block in range(first >> 8, (last >> 8) + 1)]
+        else:
+            keys = sorted(key for key in self.blocks if key[0] == network.version and first >> 8 <= key[1] <= last >> 8)
+        found = []
+        for key in keys:
+            bits = self.blocks.get(key, 0)
+            while bits:
+                low = bits & -bits
+                bits ^= low
+                value = (key[1] << 8) | (low.bit_length() - 1)
+                if first <= value <= last:
+                    found.append(self.entries[str(address_class(value))])
+        return found
+
+    def of_user(self, user_id):
+        """Reservas ativas do usuário, em ordem de IP"""
+        self.expire()
+        return sorted((r for r in self.entries.values() if r.user_id == user_id), key=lambda r: ipaddress.ip_address(r.ip))
+
+def get_reservation_ledger():
+    """Reservas do perfil de rede ativo, ou None se desativadas (RESERVATION_TTL=0)"""
+    return current_profile().get_reservations() if RESERVATION_TTL else None
+
+# Tira de uma lista de IPs livres os que estão reservados para outras pessoas
+def unreserved_ips(user, ips):
+    """Retorna (IPs que o usuário pode usar, quantos foram omitidos por estarem reservados para outros).
+    Não reserva nada: uma varredura só mostra a rede, quem reserva é o `!next_free` ou o `!confirm_ip`"""
+    ledger = get_reservation_ledger()
+    if not ledger:
+        return list(ips), 0
+    visible = [ip for ip in ips if not ledger.is_reserved(ip, user.id)]
+    return visible, len(ips) - len(visible)
+
+# Descreve uma reserva
+def format_reservation(reservation, own=False):
+    owner = "você" if own else (reservation.user_name or str(reservation.user_id))
+    status = "confirmado" if reservation.confirmed else "reservado"
+    if reservation.expires is None:
+        return f"🔖 {reservation.ip}: {status} para {owner} (sem prazo)"
+    when = time.strftime('%d/%m/%Y %H:%M', time.localtime(reservation.expires))
+    return f"🔖 {reservation.ip}: {status} para {owner} até {when}"
+
+def format_reservation_note(granted, skipped, claimed=True):
+    """`claimed` indica se os IPs listados foram reservados (busca) ou só mostrados (varredura)"""
+    lines = []
+    if skipped:
+        lines.append(f"🔒 {skipped} IPs livres foram omitidos por estarem reservados para outras pessoas.")
+    if granted and RESERVATION_TTL:
+        if claimed:
+            lines.append(f"🔖 Os IPs acima ficam reservados para você por {max(1, RESERVATION_TTL // 60)} min. "
+                         "Use `!confirm_ip <ip>` para ficar com um deles e `!release_ip <ip | all>` para liberar os outros.")
+        else:
+            lines.append("🔖 A varredura não reserva IPs. Use `!confirm_ip <ip>` para reservar os que você for usar.")
+    return '\n'.join(lines)
+
+# Balde de fichas para limitar sondagens (1 ficha = 1 IP sondado)
+class TokenBucket:
+    """Enche `rate` fichas por segundo até `capacity` (a rajada máxima); as fichas só são calculadas quando consultadas"""
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def wait_time(self, amount, now):
+        """Segundos até haver `amount` fichas (0 = já há). Pedidos maiores que a rajada esperam o balde cheio"""
+        self.refill(now)
+        missing = min(amount, self.capacity) - self.tokens
+        return missing / self.rate if missing > 0 else 0
+
+    def consume(self, amount):
+        # Pode ficar negativo em pedidos maiores que a rajada: o excesso é pago com espera nos próximos
+        self.tokens -= amount
+
+    def refund(self, amount):
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+# Cotas de sondagem por usuário e por servidor
+class ProbeQuotas:
+    """Um balde por usuário e um por servidor; um comando só roda se os dois tiverem fichas"""
+    MAX_BUCKETS = 10000
+
+    def __init__(self, user_rate, user_burst, guild_rate, guild_burst):
+        self.limits = {"usuario": (user_rate, user_burst), "servidor": (guild_rate, guild_burst)}
+        self.buckets = {}
+
+    def _buckets(self, user_id, guild_id):
+        keys = [("usuario", user_id)]
+        if guild_id is not None:
+            keys.append(("servidor", guild_id))
+        result = []
+        for key in keys:
+            rate, burst = self.limits[key[0]]
+            if rate <= 0:
+                continue  # Taxa 0 = sem limite
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                if len(self.buckets) >= self.MAX_BUCKETS:
+                    self._prune()
+                bucket = self.buckets[key] = TokenBucket(rate, burst)
+            result.append((key[0], bucket))
+        return result
+
+    def _prune(self):
+        # Baldes cheios não guardam informação: podem ser recriados quando necessário
+        now = time.monotonic()
+        for key, bucket in list(self.buckets.items()):
+            bucket.refill(now)
+            if bucket.tokens >= bucket.capacity:
+                del self.buckets[key]
+
+    def charge(self, user_id, guild_id, cost):
+        """Cobra o custo dos dois baldes. Retorna (0, None) se cobrado, ou (segundos de espera, "usuario"/"servidor")"""
+        now = time.monotonic()
+        buckets = self._buckets(user_id, guild_id)
+        for kind, bucket in buckets:
+            wait = bucket.wait_time(cost, now)
+            if wait > 0:
+                return wait, kind
+        for _, bucket in buckets:
+            bucket.consume(cost)
+        return 0, None
+
+    def refund(self, user_id, guild_id, amount):
+        """Devolve fichas cobradas a mais (estimativa maior que as sondagens feitas)"""
+        if amount > 0:
+            for _, bucket in self._buckets(user_id, guild_id):
+                bucket.refund(amount)
+
+# Perfil de rede: configuração e estado de um site (um servidor ou canal do Discord)
+class NetworkProfile:
+    """Redes permitidas, gateway, sondas e limites de um site, com inventário e caches próprios"""
+    PROBES = ("arp", "ping", "tcp", "lote")
+
+    def __init__(self, name, networks=(), gateway="", probes=PROBES, scan_batch_size=25,
+                 concurrency=BULK_DETAILS_CONCURRENCY, max_hosts=BULK_DETAILS_MAX_HOSTS,
+                 notify_channel_id=0, passive_interface="", db_path=None, snapshot_path=None,
+                 user_rate=USER_PROBE_RATE, user_burst=USER_PROBE_BURST,
+                 guild_rate=GUILD_PROBE_RATE, guild_burst=GUILD_PROBE_BURST,
+                 snmp_routers=(), snmp_community=SNMP_COMMUNITY, dhcp_lease_files=(), ipam_csv_files=()):
+        self.name = name
+        self.networks = [ipaddress.ip_network(net, strict=False) for net in networks if net]
+        self.gateway = gateway
+        unknown = set(probes) - set(self.PROBES)
+        if unknown:
+            raise ValueError(f"Sondas desconhecidas: {', '.join(sorted(unknown))} (use {', '.join(self.PROBES)})")
+        self.probes = frozenset(probes)
+        self.scan_batch_size = max(1, int(scan_batch_size))
+        self.concurrency = max(1, int(concurrency))
+        self.max_hosts = max(1, int(max_hosts))
+        self.notify_channel_id = int(notify_channel_id or 0)
+        self.passive_interface = passive_interface
+        self.db_path = db_path if db_path is not None else self._derived_path(INVENTORY_DB_PATH)
+        self.snapshot_path = snapshot_path if snapshot_path is not None else self._derived_path(WARM_SNAPSHOT_PATH)
+
+        # Estado isolado: nada é compartilhado entre perfis (as redes de sites diferentes podem se sobrepor)
+        self.inventory = NetworkInventory(persist=True, profile=self)
+        self.store = None              # None = ainda não aberto, False = desativado ou indisponível
+        self.delta_subscribers = None
+        self.sweep_snapshots = {}      # rede -> última SweepSnapshot
+        self.warm_sweeps = {}          # rede -> bitmap ainda no snapshot mapeado
+        self.warm_snapshot = None
+        self.hostname_cache = {}       # IP -> (hostname ou None, horário da consulta)
+        self.rtt_estimates = {}        # IP -> (RTT médio em ms, horário da última medição)
+        self.fingerprints = {}         # (IP, porta) -> (descrição do serviço ou None, horário da leitura)
+        self.passive_listener = None
+        self.quotas = ProbeQuotas(float(user_rate), int(user_burst), float(guild_rate), int(guild_burst))
+        self.router_arp = RouterArpCache(parse_snmp_routers(snmp_routers, gateway), snmp_community)
+        self.reservations = None       # ReservationLedger, carregado do inventário no primeiro uso
+        self.assignment_sources = parse_assignment_sources(dhcp_lease_files, ipam_csv_files)
+
+    def _derived_path(self, base):
+        """nettracker.db -> nettracker-<perfil>.db (o perfil padrão usa o caminho configurado)"""
+        if not base or self.name == DEFAULT_PROFILE_NAME:
+            return base
+        root, ext = os.path.splitext(base)
+        return f"{root}-{self.name}{ext}"
+
+    @classmethod
+    def from_dict(cls, entry, **defaults):
+        """Cria o perfil a partir de uma entrada do PROFILES_FILE"""
+        options = dict(defaults)
+        for key, option in (("networks", "networks"), ("gateway", "gateway"), ("probes", "probes"),
+                            ("scan_batch_size", "scan_batch_size"), ("concurrency", "concurrency"),
+                            ("max_hosts", "max_hosts"), ("notify_channel_id", "notify_channel_id"),
+                            ("passive_interface", "passive_interface"), ("inventory_db", "db_path"),
+                            ("snapshot", "snapshot_path"), ("user_rate", "user_rate"),
+                            ("user_burst", "user_burst"), ("guild_rate", "guild_rate"),
+                            ("guild_burst", "guild_burst"), ("snmp_routers", "snmp_routers"),
+                            ("snmp_community", "snmp_community"), ("dhcp_lease_files", "dhcp_lease_files"),
+                            ("ipam_csv_files", "ipam_csv_files")):
+            if key in entry:
+                options[option] = entry[key]
+        return cls(entry["name"], **options)
+
+    @property
+    def default_network(self):
+        return str(self.networks[0]) if self.networks else ""
+
+    def allows(self, target):
+        """True se o IP ou a rede estiver dentro das redes do perfil (perfil sem redes aceita tudo)"""
+        if not self.networks:
+            return True
+        if isinstance(target, (ipaddress.IPv4Network, ipaddress.IPv6Network)):
+            return any(target.version == net.version and target.subnet_of(net) for net in self.networks)
+        return any(target in net for net in self.networks)
+
+    def subnets(self):
+        """/24 da rede principal, na ordem usada pelos números de sub-rede dos menus"""
+        if not self.networks:
+            return []
+        network = self.networks[0]
+        if network.version == 4 and network.prefixlen < 24:
+            return list(network.subnets(new_prefix=24))
+        return [network]
+
+    def get_store(self):
+        if self.store is None:
+            self.store = open_inventory_store(self.db_path)
+        return self.store or None
+
+    def get_reservations(self):
+        if self.reservations is None:
+            self.reservations = ReservationLedger(self.get_store())
+        return self.reservations
+
+    def previous_sweep(self, key):
+        """Retorna a última varredura da rede, decodificando o bitmap do snapshot só na primeira vez"""
+        snapshot = self.sweep_snapshots.get(key)
+        if snapshot is None and key in self.warm_sweeps:
+            taken, bitmap, macs = self.warm_sweeps.pop(key)
+            snapshot = SweepSnapshot.from_bitmap(ipaddress.ip_network(key), taken, bitmap, macs)
+            self.sweep_snapshots[key] = snapshot
+        return snapshot
+
+    def close(self):
+        if self.store:
+            self.store.close()
+        self.store = None
+
+# Opções do perfil padrão vindas das variáveis globais (a entrada "padrao" do PROFILES_FILE só as sobrescreve)
+def default_profile_options():
+    return {
+        "networks": [DEFAULT_NETWORK],
+        "gateway": DEFAULT_GATEWAY,
+        "notify_channel_id": NOTIFY_CHANNEL_ID,
+        "passive_interface": PASSIVE_INTERFACE,
+        "snmp_routers": SNMP_ROUTERS,
+        "dhcp_lease_files": DHCP_LEASE_FILES,
+        "ipam_csv_files": IPAM_CSV_FILES,
+    }
+
+# Perfil padrão, configurado pelas variáveis globais (DEFAULT_NETWORK, PASSIVE_INTERFACE, NOTIFY_CHANNEL_ID...)
+default_profile = NetworkProfile(DEFAULT_PROFILE_NAME, **default_profile_options())
+
+# Inventário do perfil padrão (alimenta também o replay de pcap)
+inventory = default_profile.inventory
+
+# Perfis por nome e mapeamento servidor/canal -> perfil (canal tem prioridade sobre servidor)
+network_profiles = {DEFAULT_PROFILE_NAME: default_profile}
+guild_profiles = {}
+channel_profiles = {}
+
+# Perfil da tarefa atual. Cada comando/interação roda em sua própria tarefa asyncio,
+# então o perfil escolhido vale para ela e para as tarefas que ela criar, sem afetar as outras
+active_profile = contextvars.ContextVar('active_profile', default=None)
+
+def current_profile():
+    return active_profile.get() or default_profile
+
+def profile_for(guild=None, channel=None):
+    """Perfil do canal (ou do canal pai, em tópicos), senão do servidor, senão o padrão"""
+    if channel is not None:
+        for channel_id in (getattr(channel, 'id', None), getattr(channel, 'parent_id', None)):
+            if channel_id in channel_profiles:
+                return channel_profiles[channel_id]
+    if guild is not None and guild.id in guild_profiles:
+        return guild_profiles[guild.id]
+    return default_profile
+
+def use_profile(guild=None, channel=None):
+    """Ativa o perfil do servidor/canal para a tarefa atual e o retorna"""
+    profile = profile_for(guild, channel)
+    active_profile.set(profile)
+    return profile
+
+def load_network_profiles(path=None):
+    """Carrega os perfis do PROFILES_FILE. Formato:
+    [{"name": "sp", "guild_id": 123, "channels": [456], "networks": ["10.1.0.0/22"], "gateway": "10.1.0.1",
+      "probes": ["arp", "ping"], "concurrency": 16, "max_hosts": 512, "notify_channel_id": 789}]
+    Uma entrada com name "padrao" ajusta o perfil padrão"""
+    global default_profile, inventory
+    path = path or PROFILES_FILE
+    if not path or not os.path.exists(path):
+        return network_profiles
+    try:
+        with open(path, encoding='utf-8') as f:
+            entries = json.load(f)
+    except Exception as e:
+        log_error(f"Erro ao ler os perfis de rede de {path}", e)
+        return network_profiles
+
+    for entry in entries:
+        try:
+            if entry["name"] == DEFAULT_PROFILE_NAME:
+                profile = NetworkProfile.from_dict(entry, **default_profile_options())
+                default_profile = profile
+                inventory = profile.inventory
+            else:
+                profile = NetworkProfile.from_dict(entry)
+        except Exception as e:
+            log_error(f"Perfil de rede inválido: {entry}", e)
+            continue
+        network_profiles[profile.name] = profile
+        if entry.get("guild_id"):
+            guild_profiles[int(entry["guild_id"])] = profile
+        for channel_id in entry.get("channels", []):
+            channel_profiles[int(channel_id)] = profile
+
+    if DEBUG_MODE:
+        for profile in network_profiles.values():
+            nets = ', '.join(str(net) for net in profile.networks) or "qualquer rede"
+            print(f"Perfil de rede '{profile.name}': {nets} (sondas: {', '.join(sorted(profile.probes))})")
+    return network_profiles
+
+# Recusa alvos fora das redes do perfil ativo
+def ensure_profile_allows(target):
+    """Gera PermissionError se o IP/rede não pertencer às redes permitidas do perfil ativo"""
+    profile = current_profile()
+    if not profile.allows(target):
+        nets = ', '.join(str(net) for net in profile.networks)
+        raise PermissionError(f"{target} está fora das redes permitidas neste servidor ({nets})")
+
+# Cota de sondagens esgotada
+class ProbeQuotaExceeded(Exception):
+    def __init__(self, retry_after, kind):
+        self.retry_after = max(1, int(retry_after + 0.999))
+        self.kind = kind
+        owner = "sua cota" if kind == "usuario" else "a cota deste servidor"
+        super().__init__(f"⏳ Limite de sondagens atingido ({owner}). Tente novamente em {self.retry_after}s.")
+
+def charge_probes(user, guild, cost):
+    """Cobra antecipadamente `cost` sondagens das cotas do usuário e do servidor (perfil ativo).
+    Gera ProbeQuotaExceeded se não houver saldo"""
+    if cost <= 0:
+        return
+    wait, kind = current_profile().quotas.charge(user.id, guild.id if guild else None, cost)
+    if wait:
+        if DEBUG_MODE:
+            print(f"Cota de {kind} esgotada para {user} ({cost} sondagens, espera de {wait:.0f}s)")
+        raise ProbeQuotaExceeded(wait, kind)
+
+def refund_probes(user, guild, amount):
+    current_profile().quotas.refund(user.id, guild.id if guild else None, amount)
+
+# Sondagens estimadas de uma varredura: os IPs sem resultado recente no inventário
+def estimate_scan_cost(network, max_age=None):
+    store = get_inventory_store()
+    known = len(store.fresh_results(network, max_age)) if store else 0
+    return max(0, network.num_addresses - 2 - known) if network.prefixlen < 31 else network.num_addresses
+
+# Aviso temporário no canal (ou por DM quando não há mensagem original), pela fila de saída
+async def send_notice(user, original_message, text):
+    if original_message:
+        schedule_delete(await queue_send(original_message.channel, text, PRIORITY_RESULT))
+    else:
+        await queue_send(user, text, PRIORITY_RESULT)
+
+# Resultados de uma varredura em colunas
+class ScanResultSet:
+    """Um host por posição em arrays paralelos (deslocamento do IP na rede, estado, evidências, RTT),
+    na ordem dos IPs. MACs ficam num dicionário esparso. Os filtros percorrem as colunas com
+    map/compress, sem criar um objeto por host"""
+    NO_RTT = -1.0
+
+    def __init__(self, network):
+        self.network = network
+        self.base = int(network.network_address)
+        self.offsets = array.array('I')
+        self.states = array.array('B')
+        self.evidence = array.array('H')
+        self.rtts = array.array('f')
+        self.macs = {}         # posição -> MAC (bytes)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def add(self, ip, state, evidence=0, rtt=None, mac=None):
+        """Acrescenta um host (em ordem crescente de IP)"""
+        position = len(self.offsets)
+        self.offsets.append(int(ipaddress.ip_address(ip)) - self.base)
+        self.states.append(state)
+        self.evidence.append(evidence)
+        self.rtts.append(self.NO_RTT if rtt is None else rtt)
+        if mac:
+            self.macs[position] = mac
+        return position
+
+    def add_record(self, record):
+        return self.add(record.address, record.state, record.evidence, record.rtt, record.mac)
+
+    def address(self, position):
+        return str(ipaddress.ip_address(self.base + self.offsets[position]))
+
+    def addresses(self, positions):
+        return [self.address(position) for position in positions]
+
+    def record(self, position):
+        rtt = self.rtts[position]
+        return HostRecord(self.address(position), HostState(self.states[position]), self.evidence[position],
+                          None if rtt == self.NO_RTT else rtt, self.macs.get(position))
+
+    def select(self, states=None, all_of=0, any_of=0, none_of=0):
+        """Posições que atendem a todos os critérios: estado em `states` e evidências com todos os bits
+        de all_of, algum de any_of e nenhum de none_of"""
+        selectors = []
+        if states is not None:
+            selectors.append(map(frozenset(int(state) for state in states).__contains__, self.states))
+        if all_of:
+            selectors.append(map(all_of.__eq__, map(all_of.__and__, self.evidence)))
+        if any_of:
+            selectors.append(map(bool, map(any_of.__and__, self.evidence)))
+        if none_of:
+            selectors.append(map(operator.not_, map(none_of.__and__, self.evidence)))
+        positions = range(len(self.offsets))
+        if not selectors:
+            return array.array('I', positions)
+        combined = functools.reduce(lambda left, right: map(operator.and_, left, right), selectors)
+        return array.array('I', itertools.compress(positions, combined))
+
+    def free(self):
+        return self.select(states=(HostState.LIVRE,))
+
+    def occupied(self):
+        return self.select(states=OCCUPIED_STATES)
+
+    def unknown(self):
+        return self.select(states=(HostState.DESCONHECIDO,))
+
+    def ping_only(self):
+        """Respondem a ping mas a nenhuma porta TCP"""
+        return self.select(all_of=EVIDENCE_PING, none_of=EVIDENCE_TCP | EVIDENCE_TCP_REFUSED)
+
+    def refused(self):
+        """Recusaram conexão TCP: o host existe mesmo sem serviço aberto"""
+        return self.select(all_of=EVIDENCE_TCP_REFUSED)
+
+    def bitmap(self, positions):
+        """Inteiro com o bit de cada deslocamento das posições (formato das SweepSnapshot)"""
+        bits = bytearray((self.network.num_addresses + 7) // 8)
+        for position in positions:
+            offset = self.offsets[position]
+            bits[offset >> 3] |= 1 << (offset & 7)
+        return int.from_bytes(bits, 'little')
+
+    def items(self):
+        """Pares (ip, livre?) na ordem dos IPs"""
+        free = int(HostState.LIVRE)
+        for position, state in enumerate(self.states):
+            yield self.address(position), state == free
+
+# Quantidade de bits 1 de cada byte (bytearray.translate + sum conta os bits de um bitmap inteiro)
+BYTE_BIT_COUNTS = bytes(bin(value).count('1') for value in range(256))
+
+# Progresso de uma varredura longa, para retomá-la depois de um reinício
+class ScanCheckpoint:
+    """Bitmaps (pelo deslocamento do IP na rede) dos IPs já verificados e dos livres entre eles.
+    Gravado no inventário do perfil no máximo a cada SCAN_CHECKPOINT_INTERVAL segundos"""
+    def __init__(self, store, job_id, network, user_id=None, max_age=None, done=b'', free=b'', errors=0, updated=None):
+        self.store = store
+        self.job_id = job_id
+        self.network = network
+        self.user_id = user_id
+        self.max_age = max_age
+        # Alterados no lugar a cada IP; só viram bytes ao gravar
+        size = (network.num_addresses + 7) // 8
+        self.done = bytearray(size)
+        self.free = bytearray(size)
+        self.done[:len(done)] = done[:size]
+        self.free[:len(free)] = free[:size]
+        self.completed = sum(self.done.translate(BYTE_BIT_COUNTS))
+        self.errors = errors
+        self.updated = updated if updated is not None else time.time()
+        self.saved_at = time.monotonic()
+        self.dirty = False
+
+    @classmethod
+    def start(cls, network, user, max_age=None):
+        """Registra a varredura no inventário do perfil ativo; None se não houver inventário persistente"""
+        store = get_inventory_store()
+        if not store:
+            return None
+        try:
+            job_id = store.create_scan_job(network, user.id if user else None, max_age)
+        except Exception as e:
+            log_error(f"Erro ao registrar a varredura de {network}", e)
+            return None
+        return cls(store, job_id, network, user.id if user else None, max_age)
+
+    @classmethod
+    def from_row(cls, store, row):
+        return cls(
+            store, row["id"], ipaddress.ip_network(row["network"]), row["user_id"], row["max_age"],
+            row["done"] or b'', row["free"] or b'',
+            row["errors"], row["updated"]
+        )
+
+    def update(self, results):
+        """Marca os IPs verificados ({ip: livre?}) e grava se o intervalo já passou"""
+        base = int(self.network.network_address)
+        done, free = self.done, self.free
+        for ip, is_free in results.items():
+            offset = int(ipaddress.ip_address(ip)) - base
+            index, bit = offset >> 3, 1 << (offset & 7)
+            if not done[index] & bit:
+                done[index] |= bit
+                self.completed += 1
+            if is_free:
+                free[index] |= bit
+            else:
+                free[index] &= ~bit & 0xFF
+        self.dirty = True
+        if time.monotonic() - self.saved_at >= SCAN_CHECKPOINT_INTERVAL:
+            self.save()
+
+    def results(self):
+        """Retorna {ip: livre?} dos IPs verificados antes da interrupção"""
+        base = int(self.network.network_address)
+        results = {}
+        for index, byte in enumerate(self.done):
+            if not byte:
+                continue
+            for offset in range(8):
+                if byte & (1 << offset):
+                    ip = str(ipaddress.ip_address(base + (index << 3) + offset))
+                    results[ip] = bool(self.free[index] & (1 << offset))
+        return results
+
+    def save(self):
+        if not self.dirty:
+            return
+        try:
+            self.store.save_scan_job(self.job_id, bytes(self.done), bytes(self.free), self.errors)
+            self.dirty = False
+        except Exception as e:
+            log_error(f"Erro ao gravar o progresso da varredura de {self.network}", e)
+        self.saved_at = time.monotonic()
+
+    def finish(self):
+        """Varredura concluída (ou abandonada): não há mais o que retomar"""
+        try:
+            self.store.delete_scan_job(self.job_id)
+        except Exception as e:
+            log_error(f"Erro ao remover a varredura {self.job_id}", e)
+
+# Varre uma rede combinando inventário persistente, backend em lote e verificação IP a IP
+async def run_subnet_scan(network, on_progress=None, on_error=None, max_age=None, checkpoint=None):
+    """Retorna (ScanResultSet, lista de erros). max_age em segundos aceita resultados do inventário.
+    Com checkpoint, o progresso é gravado durante a varredura e os IPs já verificados nele não são sondados de novo"""
+    hosts = list(network.hosts())
+    errors = []
+    
+    # IPs com resultado recente no inventário não são sondados de novo
+    store = get_inventory_store()
+    known = store.fresh_results(network, max_age) if store else {}
+    if checkpoint is not None:
+        # Retomada: os IPs verificados antes da interrupção valem como resultado desta varredura
+        known.update(checkpoint.results())
+    
+    # IPs na tabela ARP dos roteadores (SNMP) estão em uso: uma leitura substitui as sondas da sub-rede roteada
+    profile = current_profile()
+    router_hits = {}
+    if "arp" in profile.probes and profile.router_arp.routers:
+        router_table = await read_router_arp_table()
+        for ip in hosts:
+            entry = router_table.get(str(ip))
+            if entry and str(ip) not in known:
+                profile.inventory.record_sighting(str(ip), mac=entry["mac_address"], source="snmp")
+                router_hits[str(ip)] = _mac_bytes(entry["mac_address"])
+        known.update(dict.fromkeys(router_hits, False))
+        if DEBUG_MODE and router_hits:
+            print(f"Varredura de {network}: {len(router_hits)} IPs em uso pela tabela ARP dos roteadores")
+    
+    # IPs com lease DHCP ou documentados no IPAM estão em uso, mesmo que o inventário os tenha visto livres
+    assigned_hits = {}
+    if profile.inventory.assignments:
+        now = time.time()
+        for ip in hosts:
+            assigned = profile.inventory.assignment(ip, now)
+            if assigned and str(ip) not in router_hits:
+                assigned_hits[str(ip)] = assigned
+        known.update(dict.fromkeys(assigned_hits, False))
+        if DEBUG_MODE and assigned_hits:
+            print(f"Varredura de {network}: {len(assigned_hits)} IPs atribuídos por leases DHCP/IPAM")
+    to_probe = [ip for ip in hosts if str(ip) not in known]
+    
+    if DEBUG_MODE:
+        print(f"Varredura de {network}: {len(known)} IPs do inventário, {len(to_probe)} para sondar")
+    
+    if known and to_probe and on_progress:
+        await on_progress(f"{len(known)} IPs respondidos pelo inventário, verificando os outros {len(to_probe)}...")
+    
+    probed = {}      # Varredura em lote: {ip: livre?}
+    records = {}     # Verificação IP a IP: {ip: HostRecord}
+    try:
+        # Tentar primeiro a varredura em lote (um único processo fping/nmap/arp-scan)
+        if to_probe and "lote" in profile.probes and get_scan_backend() is not None:
+            alive_before = 0
+            
+            async def backend_progress(alive_count):
+                if on_progress:
+                    await on_progress(f"{alive_before + alive_count} hosts ativos encontrados até agora...")
+            
+            if checkpoint is None:
+                backend_results = await scan_with_backend(network, backend_progress, to_probe if len(to_probe) < len(hosts) else None)
+                if backend_results is not None:
+                    probed = backend_results
+            else:
+                # Em partes, gravando o progresso entre elas; se o backend falhar, o restante segue IP a IP
+                for start in range(0, len(to_probe), SCAN_CHECKPOINT_CHUNK):
+                    backend_results = await scan_with_backend(network, backend_progress, to_probe[start:start + SCAN_CHECKPOINT_CHUNK])
+                    if backend_results is None:
+                        break
+                    probed.update(backend_results)
+                    checkpoint.update(backend_results)
+                    alive_before += sum(1 for is_free in backend_results.values() if not is_free)
+        
+        remaining = [ip for ip in to_probe if str(ip) not in probed]  # Sem backend, ou o que ele não cobriu
+        if remaining:
+            # Sem backend disponível: verificação IP a IP em lotes
+            batch_size = profile.scan_batch_size  # IPs verificados por vez (25 por padrão, para não sobrecarregar)
+            total_batches = (len(remaining) + batch_size - 1) // batch_size
+            free_count = sum(1 for is_free in known.values() if is_free) + sum(1 for is_free in probed.values() if is_free)
+            
+            for batch_num in range(total_batches):
+                start_idx = batch_num * batch_size
+                end_idx = min((batch_num + 1) * batch_size, len(remaining))
                 
-                stdout, stderr = await process.communicate()
-                output = stdout.decode('utf-8', errors='ignore')
+                # IPs a serem verificados neste lote
+                batch_ips = remaining[start_idx:end_idx]
                 
-                if DEBUG_MODE and stderr:
-                    err_output = stderr.decode('utf-8', errors='ignore')
-                    print(f"Erro ao obter MAC: {err_output}")
+                # Executar as verificações do lote simultaneamente
+                try:
+                    batch_records = await asyncio.gather(*[probe_host(ip) for ip in batch_ips])
+                    for record in batch_records:
+                        records[record.address] = record
+                    free_count += sum(record.is_free for record in batch_records)
+                    if checkpoint is not None:
+                        checkpoint.update({record.address: record.is_free for record in batch_records})
+                    
+                    if on_progress:
+                        progress = min(100, int(end_idx / len(remaining) * 100))
+                        await on_progress(f"{progress}% concluído... ({free_count} IPs livres encontrados até agora)")
+                except Exception as e:
+                    error_msg = f"Erro ao verificar lote {batch_num+1}/{total_batches}: {str(e)}"
+                    errors.append(error_msg)
+                    log_error(error_msg, e)
+                    if checkpoint is not None:
+                        checkpoint.errors += 1
+                    if on_error:
+                        await on_error(f"⚠️ Erro ao verificar alguns IPs no lote {batch_num+1}/{total_batches}. Continuando...")
                 
-                # Extrair o endereço MAC
-                mac_match = re.search(r'([0-9A-Fa-f]{2}[:-][0-9A-Fa-f]{2}[:-][0-9A-Fa-f]{2}[:-][0-9A-Fa-f]{2}[:-][0-9A-Fa-f]{2}[:-][0-9A-Fa-f]{2})', output)
-                if mac_match:
-                    details["mac_address"] = mac_match.group(1)
-                    if DEBUG_MODE:
-                        print(f"MAC obtido: {details['mac_address']}")
-            except Exception as e:
-                log_error(f"Erro ao obter MAC para {ip}", e)
+                # Pequena pausa entre os lotes para não sobrecarregar
+                await asyncio.sleep(1.0)
+    except asyncio.CancelledError:
+        # Bot encerrando: gravar o que já foi feito para retomar depois
+        if checkpoint is not None:
+            checkpoint.save()
+        raise
+    except Exception:
+        if checkpoint is not None:
+            checkpoint.finish()
+        raise
+    
+    if store:
+        store.flush()
+    if checkpoint is not None:
+        checkpoint.finish()
+    
+    # IPs sem resultado ficam como desconhecidos (não contam como livres)
+    results = ScanResultSet(network)
+    for ip in hosts:
+        ip_str = str(ip)
+        if ip_str in records:
+            results.add_record(records[ip_str])
+        elif ip_str in router_hits:
+            results.add(ip, HostState.EM_USO, EVIDENCE_SNMP, mac=router_hits[ip_str])
+        elif ip_str in assigned_hits:
+            assigned = assigned_hits[ip_str]
+            results.add(ip, HostState.ATRIBUIDO, assignment_evidence(assigned), mac=_mac_bytes(assigned["mac_address"]))
+        elif ip_str in known:
+            results.add(ip, HostState.LIVRE if known[ip_str] else HostState.EM_USO, EVIDENCE_INVENTORY)
+        elif ip_str in probed:
+            results.add(ip, HostState.LIVRE if probed[ip_str] else HostState.EM_USO, EVIDENCE_BACKEND)
+        else:
+            results.add(ip, HostState.DESCONHECIDO)
+    
+    # Notificar apenas o que mudou desde a varredura anterior
+    await publish_sweep(network, results)
+    return results, errors
+
+# Fotografia de uma varredura completa: bitmap de ocupação + MACs, indexados pelo deslocamento do IP na rede
+class SweepSnapshot:
+    """Estado de uma rede ao fim de uma varredura, comparável com a varredura anterior em uma única passada"""
+    def __init__(self, network, results, macs=None, previous=None):
+        self.network = network
+        self.taken = time.time()
+        base = int(network.network_address)
+        occupied = results.bitmap(results.occupied())
+        if previous is not None:
+            # Sem resultado nesta varredura: mantém o estado anterior para não gerar mudança falsa
+            occupied |= results.bitmap(results.unknown()) & previous.occupied
+        self.occupied = occupied
+        self.macs = {}
+        for ip, mac in (macs or {}).items():
+            offset = int(ipaddress.ip_address(ip)) - base
+            if mac and occupied >> offset & 1:
+                self.macs[offset] = mac.lower().replace('-', ':')
+
+    @classmethod
+    def from_bitmap(cls, network, taken, bitmap, macs):
+        """Recria uma fotografia a partir do bitmap (bytes little-endian) gravado no snapshot"""
+        snapshot = cls.__new__(cls)
+        snapshot.network = network
+        snapshot.taken = taken
+        snapshot.occupied = int.from_bytes(bitmap, 'little')
+        snapshot.macs = dict(macs)
+        return snapshot
+
+    def occupied_addresses(self):
+        """IPs ocupados nesta varredura, em ordem"""
+        base = int(self.network.network_address)
+        bits = self.occupied
+        addresses = []
+        while bits:
+            lowest = bits & -bits
+            bits ^= lowest
+            addresses.append(ipaddress.ip_address(base + lowest.bit_length() - 1))
+        return addresses
+
+    def diff(self, previous):
+        """Retorna a lista de mudanças (tipo, ip, MAC anterior, MAC atual) em ordem de IP"""
+        base = int(self.network.network_address)
+        # Bits que mudaram de estado (livre <-> ocupado)
+        candidates = self.occupied ^ previous.occupied
+        # Hosts ocupados nas duas varreduras com MAC diferente
+        for offset, mac in self.macs.items():
+            old_mac = previous.macs.get(offset)
+            if old_mac and old_mac != mac and previous.occupied >> offset & 1:
+                candidates |= 1 << offset
+
+        changes = []
+        while candidates:
+            lowest = candidates & -candidates
+            offset = lowest.bit_length() - 1
+            candidates ^= lowest
+            ip = str(ipaddress.ip_address(base + offset))
+            was_used = previous.occupied >> offset & 1
+            is_used = self.occupied >> offset & 1
+            old_mac = previous.macs.get(offset)
+            new_mac = self.macs.get(offset)
+            if is_used and not was_used:
+                changes.append(("apareceu", ip, None, new_mac))
+            elif was_used and not is_used:
+                changes.append(("sumiu", ip, old_mac, None))
+            else:
+                changes.append(("mac_alterado", ip, old_mac, new_mac))
+        return changes
+
+# Usuários do perfil ativo que recebem as mudanças por DM (carregados do inventário persistente)
+def get_delta_subscribers():
+    profile = current_profile()
+    if profile.delta_subscribers is None:
+        store = profile.get_store()
+        profile.delta_subscribers = store.load_subscribers() if store else set()
+    return profile.delta_subscribers
+
+# Formata a lista de mudanças de uma rede
+def format_sweep_changes(changes, names=None):
+    names = names or {}
+    lines = []
+    for kind, ip, old_mac, new_mac in changes:
+        if kind == "apareceu":
+            line = f"🟢 Novo dispositivo: {ip}"
+            if names.get(ip):
+                line += f" [{names[ip]}]"
+            if new_mac:
+                vendor = lookup_vendor(new_mac)
+                line += f" ({new_mac}{', ' + vendor if vendor else ''})"
+        elif kind == "sumiu":
+            line = f"🔴 Saiu da rede: {ip}"
+            if old_mac:
+                line += f" ({old_mac})"
+        else:
+            line = f"🔁 MAC alterado: {ip} ({old_mac} → {new_mac})"
+        lines.append(line)
+    return '\n'.join(lines)
+
+async def publish_sweep(network, results):
+    """Compara a varredura (ScanResultSet) com a anterior e envia apenas as mudanças ao canal/assinantes configurados"""
+    try:
+        profile = current_profile()
+        # MACs dos hosts ocupados: os obtidos pelas sondas, senão as fontes já disponíveis em memória
+        arp_table = await read_arp_table()
+        macs = {}
+        for position in results.occupied():
+            ip = results.address(position)
+            if position in results.macs:
+                macs[ip] = format_mac(results.macs[position])
+                continue
+            entry = arp_table.get(ip)
+            if entry and entry["mac_address"] and entry["state"] not in NUD_ABSENT_STATES:
+                macs[ip] = entry["mac_address"]
+            else:
+                seen = profile.inventory.get(ip)
+                if seen and seen["mac_address"]:
+                    macs[ip] = seen["mac_address"]
+
+        key = str(network)
+        previous = get_previous_sweep(key)
+        snapshot = SweepSnapshot(network, results, macs, previous)
+        profile.sweep_snapshots[key] = snapshot
+        if previous is None:
+            if DEBUG_MODE:
+                print(f"Primeira varredura de {key}: fotografia base registrada")
+            return []
+
+        changes = snapshot.diff(previous)
+        if not changes:
+            return changes
+        if DEBUG_MODE:
+            print(f"{len(changes)} mudanças detectadas em {key}")
+
+        # Nomes dos dispositivos novos em uma única rodada de descoberta, sem consultas IP a IP
+        appeared = [ip for kind, ip, _, _ in changes if kind == "apareceu"]
+        names = {}
+        if appeared:
+            await discover_names(appeared)
+            names = {ip: profile.hostname_cache[ip][0] for ip in appeared if ip in profile.hostname_cache}
         
-        return details
+        title = f"Mudanças na rede {key}"
+        text = format_sweep_changes(changes, names)
+        if profile.notify_channel_id:
+            channel = bot.get_channel(profile.notify_channel_id)
+            if channel is not None:
+                await send_dm_results(channel, title, text, priority=PRIORITY_NORMAL)
+            else:
+                log_error(f"Canal de notificação {profile.notify_channel_id} não encontrado")
+        for user_id in list(get_delta_subscribers()):
+            user = bot.get_user(user_id)
+            if user is not None:
+                await send_dm_results(user, title, text, priority=PRIORITY_NORMAL)
+        return changes
+    except Exception as e:
+        log_error(f"Erro ao comparar varredura de {network}", e)
+        return []
+
+# Retoma uma varredura interrompida por um reinício e avisa quem a pediu
+async def resume_scan_job(profile, store, row):
+    active_profile.set(profile)
+    checkpoint = ScanCheckpoint.from_row(store, row)
+    network = checkpoint.network
+    if time.time() - checkpoint.updated > SCAN_JOB_MAX_AGE or checkpoint.user_id is None:
+        if DEBUG_MODE:
+            print(f"Varredura interrompida de {network} descartada (antiga demais ou sem solicitante)")
+        checkpoint.finish()
+        return
+    try:
+        user = bot.get_user(checkpoint.user_id) or await bot.fetch_user(checkpoint.user_id)
+    except Exception as e:
+        log_error(f"Usuário {checkpoint.user_id} da varredura de {network} não encontrado", e)
+        checkpoint.finish()
+        return
+
+    total = network.num_addresses - 2 if network.prefixlen < 31 else network.num_addresses
+    if DEBUG_MODE:
+        print(f"Retomando varredura de {network} para {user} ({checkpoint.completed}/{total} IPs já verificados)")
+    queue_send(user, f"🔁 O bot foi reiniciado durante o escaneamento da rede {network}. Retomando de onde parou ({checkpoint.completed}/{total} IPs já verificados)...")
+    try:
+        # As sondagens já foram cobradas no pedido original: a retomada não cobra de novo
+        results, errors = await run_subnet_scan(network, max_age=checkpoint.max_age, checkpoint=checkpoint)
+    except Exception as e:
+        log_error(f"Erro ao retomar a varredura de {network}", e)
+        queue_send(user, f"❌ Erro ao retomar o escaneamento da rede {network}: {str(e)}")
+        return
+
+    free_ips, reserved_skipped = unreserved_ips(user, results.addresses(results.free()))
+    if not free_ips:
+        queue_send(user, f"❌ Nenhum IP livre encontrado na rede {network}" + (f" ({reserved_skipped} livres, mas reservados para outras pessoas)" if reserved_skipped else ""), PRIORITY_RESULT)
+        return
+    free_ips_text = '\n'.join(free_ips)
+    if errors or checkpoint.errors:
+        free_ips_text += "\n\n⚠️ ATENÇÃO: Ocorreram alguns erros durante a verificação que podem afetar a precisão dos resultados."
+        free_ips_text += "\nSempre confirme manualmente antes de usar um IP."
+    note = format_reservation_note(free_ips, reserved_skipped, claimed=False)
+    if note:
+        free_ips_text += f"\n\n{note}"
+    await send_dm_results(user, f"IPs livres na sub-rede {network}", free_ips_text)
+
+def resume_scan_jobs():
+    """Agenda a retomada das varreduras que não terminaram na execução anterior, em todos os perfis"""
+    for profile in network_profiles.values():
+        store = profile.get_store()
+        if not store:
+            continue
+        try:
+            rows = store.pending_scan_jobs()
+        except Exception as e:
+            log_error(f"Erro ao ler as varreduras pendentes do perfil {profile.name}", e)
+            continue
+        for row in rows:
+            asyncio.ensure_future(resume_scan_job(profile, store, row))
+
+# Expressão cron de 5 campos (minuto hora dia mês dia-da-semana)
+class CronExpression:
+    """Suporta *, listas (1,2), faixas (1-5) e passos (*/15, 0-30/5); domingo = 0 ou 7"""
+    FIELDS = (("minuto", 0, 59), ("hora", 0, 23), ("dia", 1, 31), ("mês", 1, 12), ("dia da semana", 0, 7))
+
+    def __init__(self, expression):
+        self.expression = expression.strip()
+        parts = self.expression.split()
+        if len(parts) != 5:
+            raise ValueError(f"Expressão cron deve ter 5 campos: '{expression}'")
+        values = [self._parse_field(part, *field) for part, field in zip(parts, self.FIELDS)]
+        self.minutes, self.hours, self.days, self.months, weekdays = values
+        # 7 também é domingo; convertido para a numeração do Python (segunda = 0)
+        self.weekdays = {(d - 1) % 7 for d in weekdays}
+        # Campo irrestrito é o que cobre todos os valores (*, */1, 1-31, 0-6...), não só o texto '*'
+        self.any_day = self.days == set(range(1, 32))
+        self.any_weekday = self.weekdays == set(range(7))
+
+    @staticmethod
+    def _parse_field(text, name, low, high):
+        result = set()
+        for item in text.split(','):
+            step = 1
+            if '/' in item:
+                item, step_text = item.split('/', 1)
+                step = int(step_text)
+                if step <= 0:
+                    raise ValueError(f"Passo inválido no campo {name}: {text}")
+            if item == '*':
+                start, end = low, high
+            elif '-' in item:
+                start, end = (int(v) for v in item.split('-', 1))
+            else:
+                start = int(item)
+                end = high if step > 1 else start
+            if start < low or end > high or start > end:
+                raise ValueError(f"Valor fora do intervalo {low}-{high} no campo {name}: {text}")
+            result.update(range(start, end + 1, step))
+        return result
+
+    def _day_matches(self, moment):
+        day_ok = moment.day in self.days
+        weekday_ok = moment.weekday() in self.weekdays
+        # Como no cron tradicional: se os dois campos forem restritos, basta um deles coincidir
+        if self.any_day:
+            return weekday_ok
+        if self.any_weekday:
+            return day_ok
+        return day_ok or weekday_ok
+
+    def next_after(self, moment):
+        """Retorna o próximo datetime (com minuto exato) estritamente depois de moment"""
+        candidate = moment.replace(second=0, microsecond=0) + datetime.timedelta(minutes=1)
+        limit = candidate + datetime.timedelta(days=366 * 5)
+        while candidate < limit:
+            if candidate.month not in self.months:
+                year = candidate.year + (candidate.month == 12)
+                month = candidate.month % 12 + 1
+                candidate = candidate.replace(year=year, month=month, day=1, hour=0, minute=0)
+                continue
+            if not self._day_matches(candidate):
+                candidate = candidate.replace(hour=0, minute=0) + datetime.timedelta(days=1)
+                continue
+            if candidate.hour not in self.hours:
+                candidate = candidate.replace(minute=0) + datetime.timedelta(hours=1)
+                continue
+            if candidate.minute not in self.minutes:
+                candidate += datetime.timedelta(minutes=1)
+                continue
+            return candidate
+        raise ValueError(f"A expressão cron '{self.expression}' nunca é executada")
+
+# Varredura agendada de uma faixa nomeada
+class ScanSchedule:
+    def __init__(self, name, cron, network_range, profile=DEFAULT_PROFILE_NAME):
+        self.name = name
+        self.cron = CronExpression(cron)
+        self.network = ipaddress.ip_network(network_range, strict=False)
+        # Perfil de rede cujo inventário e notificações recebem os resultados
+        self.profile = profile
+        self.next_run = None
+        self.running = False
+
+    def to_dict(self):
+        return {"name": self.name, "cron": self.cron.expression, "range": str(self.network), "profile": self.profile}
+
+    def schedule_next(self):
+        """Calcula a próxima execução (timestamp) com um atraso aleatório para as varreduras não começarem juntas"""
+        base = self.cron.next_after(datetime.datetime.now()).timestamp()
+        self.next_run = base + random.uniform(0, SCHEDULE_JITTER)
+        return self.next_run
+
+    def parts(self):
+        """Divide a faixa em /24 para espalhar a carga ao longo do intervalo"""
+        if self.network.version == 4 and self.network.prefixlen < 24:
+            return list(self.network.subnets(new_prefix=24))
+        return [self.network]
+
+# Agendamentos ativos por nome
+scan_schedules = {}
+scan_scheduler_task = None
+
+def load_scan_schedules():
+    """Carrega os agendamentos do arquivo SCHEDULE_FILE e da variável SCAN_SCHEDULE (nome|cron|faixa; ...)"""
+    entries = []
+    if SCHEDULE_FILE and os.path.exists(SCHEDULE_FILE):
+        try:
+            with open(SCHEDULE_FILE, encoding='utf-8') as f:
+                entries.extend(json.load(f))
+        except Exception as e:
+            log_error(f"Erro ao ler os agendamentos de {SCHEDULE_FILE}", e)
+    for item in SCAN_SCHEDULE.split(';'):
+        if item.strip():
+            fields = [field.strip() for field in item.split('|')]
+            if len(fields) == 3:
+                entries.append({"name": fields[0], "cron": fields[1], "range": fields[2]})
+            else:
+                log_error(f"Agendamento inválido em SCAN_SCHEDULE: '{item}' (use nome|cron|faixa)")
+    for entry in entries:
+        try:
+            scan_schedules[entry["name"]] = ScanSchedule(entry["name"], entry["cron"], entry["range"], entry.get("profile", DEFAULT_PROFILE_NAME))
+        except Exception as e:
+            log_error(f"Agendamento inválido: {entry}", e)
+    return scan_schedules
+
+def save_scan_schedules():
+    """Grava os agendamentos atuais em SCHEDULE_FILE (escrita atômica)"""
+    if not SCHEDULE_FILE:
+        return
+    tmp_path = SCHEDULE_FILE + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump([schedule.to_dict() for schedule in scan_schedules.values()], f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, SCHEDULE_FILE)
+
+async def run_scheduled_scan(schedule):
+    """Executa uma varredura agendada, espalhando as /24 da faixa pela janela SCHEDULE_SPREAD (ou até a próxima execução, se vier antes)"""
+    schedule.running = True
+    try:
+        profile = network_profiles.get(schedule.profile)
+        if profile is None:
+            raise ValueError(f"Perfil de rede '{schedule.profile}' não existe")
+        # A tarefa tem seu próprio contexto: o perfil vale só para esta varredura
+        active_profile.set(profile)
+        parts = schedule.parts()
+        started = time.time()
+        # Intervalo até a próxima execução (limitado a SCHEDULE_SPREAD), dividido igualmente entre as partes
+        interval = min(max(0.0, schedule.schedule_next() - started), SCHEDULE_SPREAD)
+        gap = interval / len(parts)
+        for index, part in enumerate(parts):
+            delay = started + index * gap - time.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if DEBUG_MODE:
+                print(f"Agendamento '{schedule.name}': varrendo {part} ({index + 1}/{len(parts)})")
+            await run_subnet_scan(part)
+    except Exception as e:
+        log_error(f"Erro na varredura agendada '{schedule.name}'", e)
+    finally:
+        schedule.running = False
+
+async def scan_scheduler_loop():
+    """Dispara as varreduras agendadas na hora certa, pulando as que ainda estão em execução"""
+    for schedule in scan_schedules.values():
+        schedule.schedule_next()
+    while True:
+        now = time.time()
+        for schedule in list(scan_schedules.values()):
+            if schedule.next_run is None:
+                schedule.schedule_next()
+            if schedule.next_run > now:
+                continue
+            if schedule.running:
+                # A execução anterior ainda não terminou: esta é descartada
+                log_error(f"Agendamento '{schedule.name}' ainda em execução, pulando esta rodada")
+                schedule.schedule_next()
+                continue
+            # run_scheduled_scan calcula a próxima execução ao começar
+            asyncio.ensure_future(run_scheduled_scan(schedule))
+        next_due = min((s.next_run for s in scan_schedules.values() if s.next_run), default=now + 60)
+        await asyncio.sleep(min(60.0, max(1.0, next_due - time.time())))
+
+def start_scan_scheduler():
+    global scan_scheduler_task
+    if scan_scheduler_task is None:
+        load_scan_schedules()
+        scan_scheduler_task = asyncio.ensure_future(scan_scheduler_loop())
+        if DEBUG_MODE:
+            print(f"Agendador de varreduras iniciado com {len(scan_schedules)} agendamentos")
+
+# API HTTP/JSON somente leitura do inventário (asyncio puro, sem dependências extras)
+class InventoryAPI:
+    """Serve o inventário em memória/SQLite como JSON, com ETag e gzip. Nunca dispara sondagens"""
+    MAX_CACHE_ENTRIES = 256
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.server = None
+        # caminho -> (versão dos dados, etag, corpo, corpo gzip)
+        self.cache = {}
+        # perfil -> (instante, versões do banco e do inventário) amostradas
+        self.samples = {}
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, self.host, self.port)
+        if DEBUG_MODE:
+            print(f"API de inventário ouvindo em http://{self.host}:{self.port}/")
+
+    def data_version(self):
+        """Versão dos dados do perfil ativo. O tráfego passivo muda o inventário o tempo todo (quase sempre só o
+        last_seen), então as versões do banco e do inventário são amostradas no máximo a cada API_CACHE_SECONDS;
+        mudanças nas reservas invalidam o cache na hora"""
+        profile = current_profile()
+        store = profile.get_store()
+        ledger = profile.reservations
+        now = time.monotonic()
+        sample = self.samples.get(profile.name)
+        if sample is None or now - sample[0] >= API_CACHE_SECONDS:
+            if store:
+                # Resultados ainda no lote pendente entram na amostra
+                store.flush()
+            sample = self.samples[profile.name] = (now, store.generation if store else 0, profile.inventory.generation)
+        return sample[1:] + (ledger.generation if ledger else 0,)
+
+    def build_payload(self, path):
+        """Retorna (status HTTP, objeto JSON) para o caminho pedido"""
+        store = get_inventory_store()
+        inventory = current_profile().inventory
+        parts = [part for part in path.split('/') if part]
+
+        if not parts or parts == ["health"]:
+            return 200, {"status": "ok", "persistente": bool(store), "gerado_em": time.time()}
+
+        if parts == ["inventory"]:
+            hosts = store.all_hosts() if store else list(inventory.hosts.values())
+            return 200, {"hosts": hosts, "total": len(hosts), "gerado_em": time.time()}
+
+        if parts[0] == "free" and len(parts) in (2, 3):
+            try:
+                network = ipaddress.ip_network('/'.join(parts[1:]), strict=False)
+            except ValueError:
+                return 400, {"erro": "Rede inválida. Use /free/<rede>/<prefixo>, ex: /free/10.0.1.0/24"}
+            if network.num_addresses > 65536:
+                return 400, {"erro": "Rede grande demais (máximo /16)"}
+            known = store.query_network(network) if store else {
+                ip: {"status": "em_uso"} for ip in inventory.hosts
+                if ipaddress.ip_address(ip) in network
+            }
+            ledger = get_reservation_ledger()
+            reserved = ledger.in_network(network) if ledger else []
+            reserved_ips = {reservation.ip for reservation in reserved}
+            free = [ip for ip, row in known.items() if row["status"] == "livre" and ip not in reserved_ips]
+            used = [ip for ip, row in known.items() if row["status"] != "livre"]
+            free.sort(key=ipaddress.ip_address)
+            used.sort(key=ipaddress.ip_address)
+            total = max(network.num_addresses - 2, 1) if network.prefixlen < 31 else network.num_addresses
+            return 200, {
+                "network": str(network),
+                "free": free,
+                "used": used,
+                "reserved": [
+                    {"ip": r.ip, "user": r.user_name, "expires": r.expires, "confirmed": r.confirmed}
+                    for r in reserved
+                ],
+                "unknown": total - len(known),
+                "gerado_em": time.time()
+            }
+
+        if parts[0] == "ip" and len(parts) == 2:
+            try:
+                ip = ipaddress.ip_address(parts[1])
+            except ValueError:
+                return 400, {"erro": "IP inválido"}
+            row = store.get(ip) if store else None
+            seen = inventory.get(ip)
+            if row is None and seen is None:
+                return 404, {"ip": str(ip), "status": "desconhecido"}
+            result = dict(row) if row else {"ip": str(ip), "status": "em_uso"}
+            if seen:
+                result["passivo"] = seen
+            return 200, result
+
+        return 404, {"erro": "Caminho não encontrado", "caminhos": ["/health", "/inventory", "/free/<rede>/<prefixo>", "/ip/<ip>"]}
+
+    def render(self, path):
+        """Retorna (status, etag, corpo, corpo gzip) usando o cache enquanto os dados não mudarem"""
+        version = self.data_version()
+        # Cada perfil de rede tem suas próprias entradas no cache
+        cache_key = (current_profile().name, path)
+        cached = self.cache.get(cache_key)
+        if cached and cached[0] == version:
+            return cached[1:]
+        status, payload = self.build_payload(path)
+        # O horário de geração muda a cada chamada e ficaria fora do ETag
+        body = json.dumps(payload, ensure_ascii=False, default=str).encode('utf-8')
+        stable = dict(payload) if isinstance(payload, dict) else payload
+        if isinstance(stable, dict):
+            stable.pop("gerado_em", None)
+        etag = '"' + hashlib.sha1(json.dumps(stable, sort_keys=True, default=str).encode('utf-8')).hexdigest()[:20] + '"'
+        rendered = (status, etag, body, gzip.compress(body, 6))
+        if len(self.cache) >= self.MAX_CACHE_ENTRIES:
+            self.cache.clear()
+        self.cache[cache_key] = (version,) + rendered
+        return rendered
+
+    async def handle(self, reader, writer):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=10)
+            headers = {}
+            while True:
+                line = await asyncio.wait_for(reader.readline(), timeout=10)
+                if not line or line in (b'\r\n', b'\n'):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+
+            parts = request_line.decode('latin-1').split()
+            if len(parts) < 2:
+                return
+            method, target = parts[0], parts[1]
+            path, _, query = target.partition('?')
+
+            # ?profile=<nome> escolhe o perfil de rede (padrão se omitido)
+            profile_name = parse_qs(query).get('profile', [DEFAULT_PROFILE_NAME])[0]
+            profile = network_profiles.get(profile_name)
+            if profile is None:
+                await self.respond(writer, 404, b'{"erro": "Perfil de rede desconhecido"}')
+                return
+            active_profile.set(profile)
+
+            if method not in ("GET", "HEAD"):
+                await self.respond(writer, 405, b'{"erro": "Somente leitura (GET/HEAD)"}', extra={"Allow": "GET, HEAD"})
+                return
+
+            status, etag, body, gzip_body = self.render(path)
+            if status == 200 and etag in [tag.strip() for tag in headers.get('if-none-match', '').split(',')]:
+                await self.respond(writer, 304, b'', extra={"ETag": etag})
+                return
+
+            extra = {"ETag": etag, "Vary": "Accept-Encoding", "Cache-Control": "no-cache"}
+            if 'gzip' in headers.get('accept-encoding', ''):
+                body = gzip_body
+                extra["Content-Encoding"] = "gzip"
+            await self.respond(writer, status, body, extra=extra, head_only=(method == "HEAD"))
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        except Exception as e:
+            log_error("Erro ao responder requisição da API", e)
+            try:
+                await self.respond(writer, 500, b'{"erro": "Erro interno"}')
+            except Exception:
+                pass
+        finally:
+            writer.close()
+
+    async def respond(self, writer, status, body, extra=None, head_only=False):
+        reasons = {200: "OK", 304: "Not Modified", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 500: "Internal Server Error"}
+        lines = [f"HTTP/1.1 {status} {reasons.get(status, 'OK')}"]
+        headers = {"Content-Type": "application/json; charset=utf-8", "Content-Length": str(len(body)), "Connection": "close"}
+        headers.update(extra or {})
+        lines += [f"{name}: {value}" for name, value in headers.items()]
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+        if not head_only and status != 304:
+            writer.write(body)
+        await writer.drain()
+
+    def close(self):
+        if self.server is not None:
+            self.server.close()
+            self.server = None
+
+# Servidor da API (criado no on_ready se API_PORT estiver definido)
+inventory_api = None
+
+async def start_inventory_api():
+    global inventory_api
+    if API_PORT and inventory_api is None:
+        api = InventoryAPI(API_HOST, API_PORT)
+        try:
+            await api.start()
+            inventory_api = api
+        except Exception as e:
+            log_error(f"Erro ao iniciar a API de inventário em {API_HOST}:{API_PORT}", e)
+
+# Snapshot binário do estado em memória para reinícios rápidos
+#
+# Formato (little-endian): cabeçalho b'NTWS', u16 versão, u16 reservado, f64 criação, u32 seções;
+# diretório: u8 tipo, 3 bytes de preenchimento, u32 offset, u32 tamanho por seção.
+# Strings: u16 tamanho + UTF-8. MACs: 6 bytes (zeros = desconhecido)
+WARM_MAGIC = b'NTWS'
+WARM_SECTION_SWEEPS = 1
+WARM_SECTION_SIGHTINGS = 2
+WARM_SECTION_HOSTNAMES = 3
+WARM_SECTION_RTT = 4
+
+def _pack_str(text):
+    data = (text or '').encode('utf-8')[:65535]
+    return struct.pack('<H', len(data)) + data
+
+def _pack_mac(mac):
+    if not mac:
+        return b'\x00' * 6
+    return bytes.fromhex(re.sub(r'[^0-9A-Fa-f]', '', mac))[:6].ljust(6, b'\x00')
+
+def _unpack_mac(raw):
+    return format_mac(raw) if raw != b'\x00' * 6 else None
+
+class WarmSnapshotReader:
+    """Lê o snapshot mapeado em memória; cada seção só é decodificada quando pedida"""
+    def __init__(self, path):
+        import mmap
+        self.file = open(path, 'rb')
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, _version, _reserved, self.created, count = struct.unpack_from('<4sHHdI', self.data, 0)
+        if magic != WARM_MAGIC:
+            raise ValueError(f"Snapshot inválido: {path}")
+        self.sections = {}
+        self.views = []        # memoryviews entregues por sweeps(); o mmap só fecha depois de liberá-las
+        for index in range(count):
+            kind, offset, length = struct.unpack_from('<BxxxII', self.data, 20 + index * 12)
+            self.sections[kind] = (offset, length)
+
+    def _str(self, pos):
+        length = struct.unpack_from('<H', self.data, pos)[0]
+        return self.data[pos + 2:pos + 2 + length].decode('utf-8', errors='replace'), pos + 2 + length
+
+    def _records(self, kind):
+        if kind not in self.sections:
+            return 0, None
+        offset, _length = self.sections[kind]
+        return struct.unpack_from('<I', self.data, offset)[0], offset + 4
+
+    def sweeps(self):
+        """Retorna {rede: (horário, memoryview do bitmap, {offset: mac})} sem copiar os bitmaps.
+        As memoryviews valem até close()"""
+        result = {}
+        count, pos = self._records(WARM_SECTION_SWEEPS)
+        view = memoryview(self.data)
+        self.views.append(view)
+        for _ in range(count):
+            network, pos = self._str(pos)
+            taken, size = struct.unpack_from('<dI', self.data, pos)
+            pos += 12
+            bitmap = view[pos:pos + size]
+            self.views.append(bitmap)
+            pos += size
+            mac_count = struct.unpack_from('<I', self.data, pos)[0]
+            pos += 4
+            macs = {}
+            for _ in range(mac_count):
+                offset, raw = struct.unpack_from('<I6s', self.data, pos)
+                macs[offset] = format_mac(raw)
+                pos += 10
+            result[network] = (taken, bitmap, macs)
+        return result
+
+    def sightings(self):
+        count, pos = self._records(WARM_SECTION_SIGHTINGS)
+        for _ in range(count):
+            ip, pos = self._str(pos)
+            mac = _unpack_mac(self.data[pos:pos + 6])
+            hostname, pos = self._str(pos + 6)
+            source, pos = self._str(pos)
+            first_seen, last_seen = struct.unpack_from('<dd', self.data, pos)
+            pos += 16
+            yield ip, mac, hostname or None, source, first_seen, last_seen
+
+    def hostnames(self):
+        count, pos = self._records(WARM_SECTION_HOSTNAMES)
+        for _ in range(count):
+            ip, pos = self._str(pos)
+            hostname, pos = self._str(pos)
+            stamp = struct.unpack_from('<d', self.data, pos)[0]
+            pos += 8
+            yield ip, hostname or None, stamp
+
+    def rtts(self):
+        count, pos = self._records(WARM_SECTION_RTT)
+        for _ in range(count):
+            ip, pos = self._str(pos)
+            rtt, stamp = struct.unpack_from('<fd', self.data, pos)
+            pos += 12
+            yield ip, rtt, stamp
+
+    def close(self):
+        # Com alguma memoryview ainda viva, mmap.close() gera BufferError
+        for view in reversed(self.views):
+            view.release()
+        self.views.clear()
+        self.data.close()
+        self.file.close()
+
+def get_previous_sweep(key):
+    """Retorna a última varredura da rede no perfil ativo"""
+    return current_profile().previous_sweep(key)
+
+def load_warm_snapshot(profile=None):
+    """Carrega o snapshot do perfil (se existir) e devolve quantos registros foram restaurados"""
+    profile = profile or current_profile()
+    path = profile.snapshot_path
+    if not path or not os.path.exists(path):
+        return 0
+    started = time.time()
+    try:
+        reader = WarmSnapshotReader(path)
+    except Exception as e:
+        log_error(f"Erro ao abrir o snapshot {path}", e)
+        return 0
+    profile.warm_snapshot = reader
+    now = time.time()
+    restored = 0
+
+    # Bitmaps ficam no arquivo mapeado até a próxima varredura da rede precisar deles
+    profile.warm_sweeps.update(reader.sweeps())
+    restored += len(profile.warm_sweeps)
+
+    for ip, mac, hostname, source, first_seen, last_seen in reader.sightings():
+        # Avistamentos antigos demais são descartados; os demais envelhecem normalmente (last_seen)
+        if now - last_seen > WARM_MAX_AGE:
+            continue
+        entry = profile.inventory.record_sighting(ip, mac=mac, hostname=hostname, source=source, timestamp=last_seen, persist=False)
+        entry["first_seen"] = min(entry["first_seen"], first_seen)
+        restored += 1
+
+    for ip, hostname, stamp in reader.hostnames():
+        if now - stamp <= (HOSTNAME_CACHE_TTL if hostname else HOSTNAME_NEGATIVE_TTL):
+            profile.hostname_cache.setdefault(ip, (hostname, stamp))
+            restored += 1
+
+    for ip, rtt, stamp in reader.rtts():
+        if now - stamp <= WARM_MAX_AGE:
+            profile.rtt_estimates.setdefault(ip, (rtt, stamp))
+            restored += 1
+
+    if DEBUG_MODE:
+        age = format_age(reader.created)
+        print(f"Snapshot {path} (de {age} atrás) carregado em {time.time() - started:.3f}s: {restored} registros")
+    return restored
+
+def save_warm_snapshot(profile=None):
+    """Grava o estado em memória do perfil de forma atômica (arquivo temporário + rename)"""
+    profile = profile or current_profile()
+    path = profile.snapshot_path
+    if not path:
+        return False
+
+    # Decodificar o que ainda está no snapshot antigo antes de substituí-lo
+    for key in list(profile.warm_sweeps):
+        profile.previous_sweep(key)
+    if profile.warm_snapshot is not None:
+        profile.warm_snapshot.close()
+        profile.warm_snapshot = None
+
+    sections = []
+
+    data = [struct.pack('<I', len(profile.sweep_snapshots))]
+    for key, snapshot in profile.sweep_snapshots.items():
+        bitmap = snapshot.occupied.to_bytes((snapshot.occupied.bit_length() + 7) // 8, 'little')
+        data.append(_pack_str(key) + struct.pack('<dI', snapshot.taken, len(bitmap)) + bitmap)
+        data.append(struct.pack('<I', len(snapshot.macs)))
+        data.extend(struct.pack('<I6s', offset, _pack_mac(mac)) for offset, mac in snapshot.macs.items())
+    sections.append((WARM_SECTION_SWEEPS, b''.join(data)))
+
+    data = [struct.pack('<I', len(profile.inventory.hosts))]
+    for entry in profile.inventory.hosts.values():
+        data.append(
+            _pack_str(entry["ip"]) + _pack_mac(entry["mac_address"]) + _pack_str(entry["hostname"])
+            + _pack_str(entry["source"]) + struct.pack('<dd', entry["first_seen"], entry["last_seen"])
+        )
+    sections.append((WARM_SECTION_SIGHTINGS, b''.join(data)))
+
+    data = [struct.pack('<I', len(profile.hostname_cache))]
+    data.extend(_pack_str(ip) + _pack_str(hostname) + struct.pack('<d', stamp) for ip, (hostname, stamp) in profile.hostname_cache.items())
+    sections.append((WARM_SECTION_HOSTNAMES, b''.join(data)))
+
+    data = [struct.pack('<I', len(profile.rtt_estimates))]
+    data.extend(_pack_str(ip) + struct.pack('<fd', rtt, stamp) for ip, (rtt, stamp) in profile.rtt_estimates.items())
+    sections.append((WARM_SECTION_RTT, b''.join(data)))
+
+    header = struct.pack('<4sHHdI', WARM_MAGIC, 1, 0, time.time(), len(sections))
+    offset = len(header) + 12 * len(sections)
+    directory = b''
+    for kind, payload in sections:
+        directory += struct.pack('<BxxxII', kind, offset, len(payload))
+        offset += len(payload)
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(header + directory + b''.join(payload for _, payload in sections))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    if DEBUG_MODE:
+        print(f"Snapshot gravado em {path} ({offset} bytes)")
+    return True
+
+def save_warm_snapshots():
+    """Grava o snapshot de cada perfil de rede"""
+    for profile in network_profiles.values():
+        try:
+            save_warm_snapshot(profile)
+        except Exception as e:
+            log_error(f"Erro ao gravar o snapshot do perfil {profile.name}", e)
+
+def warm_state_signature():
+    return tuple(
+        (p.inventory.generation, len(p.hostname_cache), len(p.rtt_estimates), tuple(s.taken for s in p.sweep_snapshots.values()))
+        for p in network_profiles.values()
+    )
+
+warm_snapshot_task = None
+
+async def warm_snapshot_loop():
+    """Grava o snapshot periodicamente, apenas quando o estado mudou"""
+    last_signature = warm_state_signature()
+    while True:
+        await asyncio.sleep(WARM_SNAPSHOT_INTERVAL)
+        signature = warm_state_signature()
+        if signature != last_signature:
+            save_warm_snapshots()
+            last_signature = signature
+
+def start_warm_snapshots():
+    global warm_snapshot_task
+    if WARM_SNAPSHOT_PATH and warm_snapshot_task is None:
+        warm_snapshot_task = asyncio.ensure_future(warm_snapshot_loop())
+
+# Fila única de saída para o Discord: envios, edições e exclusões
+PRIORITY_RESULT = 0     # Resultados finais para o usuário
+PRIORITY_NORMAL = 1     # Avisos, notificações e limpeza
+PRIORITY_PROGRESS = 2   # Progresso de varreduras (só a última atualização importa)
+
+class OutboundJob:
+    def __init__(self, action, target, route, priority, content=None, kwargs=None, messages=None, merge=None):
+        self.action = action
+        self.target = target
+        self.route = route
+        self.priority = priority
+        self.content = content
+        self.kwargs = kwargs or {}
+        self.messages = list(messages or [])
+        self.merge = merge
+        self.futures = []
+        self.seq = 0
+        self.done = 0      # Exclusões já feitas
+        self.bulk = True   # False depois que a exclusão em lote falhar
+
+def _ignore_unretrieved(future):
+    # Chamadas "dispare e esqueça" não leem o resultado; o erro já foi registrado pela fila
+    if not future.cancelled():
+        future.exception()
+
+class OutboundQueue:
+    """Serializa as chamadas ao Discord com um balde de fichas por rota (ação + destino) e um global.
+    Envios marcados são agrupados numa só mensagem, edições pendentes da mesma mensagem são substituídas
+    pela mais nova, exclusões do mesmo canal viram delete_messages em lote, e resultados saem antes do progresso"""
+    MAX_LENGTH = 2000
+    BULK_LIMIT = 100
+    ROUTE_LIMITS = {"send": (1.0, 5), "edit": (1.0, 5), "delete": (1.0, 5)}  # 5 a cada 5 s por canal
+    GLOBAL_LIMIT = (40.0, 40)                                                   # Abaixo do limite global de 50/s
+
+    def __init__(self):
+        self.pending = []
+        self.sequence = 0
+        self.routes = {}
+        self.global_bucket = TokenBucket(*self.GLOBAL_LIMIT)
+        self.wakeup = None
+        self.task = None
+
+    @staticmethod
+    def route_of(action, target):
+        # Followups de interação são limitados pelo token; canais e usuários (DM) pelo id
+        return action, getattr(target, 'token', None) or getattr(target, 'id', None) or id(target)
+
+    def bucket(self, route):
+        bucket = self.routes.get(route)
+        if bucket is None:
+            if len(self.routes) >= 10000:
+                self.routes.clear()
+            bucket = self.routes[route] = TokenBucket(*self.ROUTE_LIMITS[route[0]])
+        return bucket
+
+    def submit(self, job):
+        future = asyncio.get_event_loop().create_future()
+        future.add_done_callback(_ignore_unretrieved)
+        target_job = self._find_mergeable(job)
+        if target_job is None:
+            job.seq = self.sequence
+            self.sequence += 1
+            self.pending.append(job)
+            target_job = job
+        elif job.action == "send" and job.merge == "append":
+            target_job.content += '\n' + job.content
+        elif job.action == "delete":
+            target_job.messages.extend(job.messages)
+        else:
+            # Edição da mesma mensagem ou progresso: vale só o conteúdo mais novo
+            target_job.content = job.content
+            target_job.kwargs = job.kwargs
+        target_job.priority = min(target_job.priority, job.priority)
+        target_job.futures.append(future)
+
+        if self.task is None or self.task.done():
+            self.wakeup = asyncio.Event()
+            self.task = asyncio.ensure_future(self.run())
+        else:
+            self.wakeup.set()
+        return future
+
+    def _find_mergeable(self, job):
+        # Só a última tarefa pendente da rota pode receber a nova, para manter a ordem das mensagens
+        for other in reversed(self.pending):
+            if other.route != job.route:
+                continue
+            if job.action == "edit":
+                if other.target is job.target:
+                    return other
+                continue
+            if job.action == "delete":
+                return other
+            if job.merge and other.merge == job.merge and other.kwargs == job.kwargs:
+                if job.merge == "replace" or len(other.content) + len(job.content) + 1 <= self.MAX_LENGTH:
+                    return other
+            return None
+        return None
+
+    async def run(self):
+        while self.pending:
+            now = time.monotonic()
+            job = None
+            wait = self.global_bucket.wait_time(1, now)
+            if wait == 0:
+                wait = None
+                for candidate in sorted(self.pending, key=lambda j: (j.priority, j.seq)):
+                    route_wait = self.bucket(candidate.route).wait_time(1, now)
+                    if route_wait == 0:
+                        job = candidate
+                        break
+                    wait = route_wait if wait is None else min(wait, route_wait)
+            if job is None:
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            self.pending.remove(job)
+            self.bucket(job.route).consume(1)
+            self.global_bucket.consume(1)
+            try:
+                result = await self.execute(job)
+            except discord.HTTPException as e:
+                if e.status == 429:
+                    # Limite atingido mesmo assim: esperar o tempo pedido e tentar de novo
+                    retry_after = getattr(e, 'retry_after', None) or 5.0
+                    bucket = self.bucket(job.route)
+                    bucket.tokens = min(bucket.tokens, 0) - retry_after * bucket.rate
+                    self.pending.append(job)
+                    continue
+                self.finish(job, error=e)
+                continue
+            except Exception as e:
+                self.finish(job, error=e)
+                continue
+            if job.action == "delete" and job.messages:
+                # Ainda há mensagens: volta para a fila na mesma posição
+                self.pending.append(job)
+                continue
+            self.finish(job, result)
+
+    async def execute(self, job):
+        if job.action == "send":
+            return await job.target.send(job.content, **job.kwargs)
+        if job.action == "edit":
+            return await job.target.edit(content=job.content, **job.kwargs)
+
+        # Exclusão em lote só existe em canais de servidor (e exige a permissão Gerenciar Mensagens)
+        if job.bulk and len(job.messages) > 1 and hasattr(job.target, 'delete_messages'):
+            chunk = job.messages[:self.BULK_LIMIT]
+            try:
+                await job.target.delete_messages(chunk)
+                del job.messages[:len(chunk)]
+                job.done += len(chunk)
+                return job.done
+            except discord.HTTPException as e:
+                if e.status == 429:
+                    raise
+                if DEBUG_MODE:
+                    print(f"Exclusão em lote indisponível ({type(e).__name__}), apagando uma a uma")
+                job.bulk = False
+        message = job.messages.pop(0)
+        try:
+            await message.delete()
+            job.done += 1
+        except discord.NotFound:
+            pass  # Já apagada pelo usuário ou por outro fluxo
+        except discord.HTTPException as e:
+            if e.status == 429:
+                job.messages.insert(0, message)
+                raise
+            # Sem permissão ou erro do Discord: registra e segue com as demais
+            log_error(f"Erro ao apagar a mensagem {getattr(message, 'id', '?')}", e)
+        return job.done
+
+    def discard(self, route, priority):
+        """Tira da fila as tarefas pendentes da rota com essa prioridade; os futures delas recebem None"""
+        for job in [job for job in self.pending if job.route == route and job.priority == priority]:
+            self.pending.remove(job)
+            self.finish(job)
+
+    def finish(self, job, result=None, error=None):
+        if error is not None:
+            log_error(f"Erro ao executar '{job.action}' no Discord", error)
+        for future in job.futures:
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+outbound = OutboundQueue()
+
+def queue_send(destination, content, priority=PRIORITY_NORMAL, merge=None, **kwargs):
+    """Enfileira um envio e retorna um future com a mensagem enviada.
+    merge="append" junta com o envio pendente ao mesmo destino; merge="replace" fica só com o mais novo"""
+    route = OutboundQueue.route_of("send", destination)
+    return outbound.submit(OutboundJob("send", destination, route, priority, content, kwargs, merge=merge))
+
+def drop_progress(destination):
+    """Descarta o progresso ainda não enviado a um destino (o resultado final já o torna obsoleto)"""
+    outbound.discard(OutboundQueue.route_of("send", destination), PRIORITY_PROGRESS)
+
+def queue_edit(message, content, priority=PRIORITY_PROGRESS, **kwargs):
+    """Enfileira uma edição; edições pendentes da mesma mensagem são substituídas"""
+    route = OutboundQueue.route_of("edit", message.channel)
+    return outbound.submit(OutboundJob("edit", message, route, priority, content, kwargs))
+
+def queue_delete(channel, messages, priority=PRIORITY_NORMAL):
+    """Enfileira a exclusão de mensagens de um canal; o future retorna quantas foram apagadas"""
+    route = OutboundQueue.route_of("delete", channel)
+    return outbound.submit(OutboundJob("delete", channel, route, priority, messages=messages))
+
+# Remoção adiada das mensagens temporárias (status, avisos e erros)
+STATUS_MESSAGE_TTL = 5  # Segundos que uma mensagem temporária fica visível
+
+class MessageCleanup:
+    """Fila única (heap por vencimento) de mensagens a apagar. Uma só tarefa dorme até o próximo
+    vencimento e entrega as vencidas, agrupadas por canal, à fila de saída"""
+    GRACE = 0.5        # Mensagens que vencem logo em seguida entram no mesmo lote
+
+    def __init__(self):
+        self.queue = []        # (vencimento, sequência, mensagem)
+        self.sequence = 0
+        self.wakeup = None
+        self.task = None
+
+    def schedule(self, message, delay=STATUS_MESSAGE_TTL):
+        """Agenda a remoção e retorna imediatamente"""
+        if message is None:
+            return
+        due = time.monotonic() + delay
+        heapq.heappush(self.queue, (due, self.sequence, message))
+        self.sequence += 1
+        if self.task is None or self.task.done():
+            self.wakeup = asyncio.Event()
+            self.task = asyncio.ensure_future(self.run())
+        elif self.queue[0][1] == self.sequence - 1:
+            # Novo vencimento mais cedo que o esperado pela tarefa: acordá-la
+            self.wakeup.set()
+
+    async def run(self):
+        while self.queue:
+            delay = self.queue[0][0] - time.monotonic()
+            if delay > 0:
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            limit = time.monotonic() + self.GRACE
+            by_channel = {}
+            while self.queue and self.queue[0][0] <= limit:
+                _, _, message = heapq.heappop(self.queue)
+                by_channel.setdefault(message.channel.id, (message.channel, []))[1].append(message)
+            # A fila de saída faz a exclusão em lote e respeita os limites de cada canal
+            for channel, messages in by_channel.values():
+                queue_delete(channel, messages)
+
+message_cleanup = MessageCleanup()
+
+def schedule_delete(message, delay=STATUS_MESSAGE_TTL):
+    """Apaga a mensagem depois de `delay` segundos sem prender o handler"""
+    message_cleanup.schedule(message, delay)
+
+# Conversas por resposta: o bot envia um prompt e o usuário responde a ele com o IP
+REPLY_SESSION_TTL = 600     # Segundos em que a resposta a um prompt ainda é aceita
+REPLY_SESSION_MAX = 2000    # Máximo de prompts lembrados (os mais antigos são descartados)
+
+class ReplySessions:
+    """Registro de prompts abertos, por (id da mensagem do prompt, id do usuário).
+    A resposta é identificada só pelo message_id da referência, sem depender do cache de mensagens"""
+    def __init__(self, ttl=REPLY_SESSION_TTL, max_size=REPLY_SESSION_MAX):
+        self.ttl = ttl
+        self.max_size = max_size
+        # Ordem de inserção = ordem de vencimento (TTL fixo): a limpeza só olha o início
+        self.sessions = OrderedDict()
+
+    def open(self, prompt_id, user_id, kind, profile=None):
+        key = (prompt_id, user_id)
+        self.sessions.pop(key, None)
+        self.sessions[key] = (time.monotonic() + self.ttl, kind, profile)
+        self._prune()
+
+    def get(self, prompt_id, user_id):
+        """Retorna (tipo, perfil) do prompt ou None se não existir ou tiver vencido"""
+        self._prune()
+        session = self.sessions.get((prompt_id, user_id))
+        return session[1:] if session else None
+
+    def _prune(self):
+        now = time.monotonic()
+        while self.sessions:
+            expires = next(iter(self.sessions.values()))[0]
+            if expires > now and len(self.sessions) <= self.max_size:
+                break
+            self.sessions.popitem(last=False)
+
+reply_sessions = ReplySessions()
+
+# Registra o prompt enviado como resposta a uma interação (ou a mensagem `prompt` já enviada, ex: por DM)
+async def open_reply_session(interaction, kind, prompt=None):
+    if prompt is None:
+        try:
+            prompt = await interaction.original_response()
+        except Exception as e:
+            log_error("Não foi possível obter a mensagem do prompt", e)
+            return
+    # A resposta usa o perfil do servidor/canal onde o menu foi aberto, mesmo vindo por DM
+    profile = use_profile(interaction.guild, interaction.channel)
+    reply_sessions.open(prompt.id, interaction.user.id, kind, profile)
+    if DEBUG_MODE:
+        print(f"Aguardando resposta de {interaction.user.name} ao prompt {prompt.id} ({kind})")
+
+# Trata a resposta do usuário conforme o tipo do prompt
+async def handle_reply(kind, message):
+    text = message.content.strip()
+    if DEBUG_MODE:
+        print(f"Resposta de {message.author.name} ao prompt {kind}: {text}")
+    
+    if kind == "check_ip":
+        await check_ip(message.author, text, message)
+    elif kind == "ip_details":
+        await ip_details(message.author, text, message)
+    elif kind == "next_free":
+        parts = text.split()
+        if parts:
+            count = int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else 5
+            await find_next_free(message.author, parts[0], count, message)
+    
+    # Tentar deletar a mensagem do usuário para manter a privacidade
+    try:
+        await message.delete()
     except Exception as e:
-        log_error(f"Erro ao obter detalhes do IP {ip}", e)
-        return {
-            "ip": str(ip),
-            "status": "erro ao verificar",
-            "mac_address": None,
-            "hostname": None,
-            "responde_ping": False
-        }
+        log_error("Erro ao deletar mensagem do usuário", e)
 
 # Enviar resultados por mensagem direta - com tratamento de erros
-async def send_dm_results(user, title, results, cmd_equivalent=""):
-    """Envia resultados por DM para o usuário"""
+async def send_dm_results(user, title, results, cmd_equivalent="", priority=PRIORITY_RESULT):
+    """Envia resultados por DM para o usuário (pela fila de saída; blocos pequenos seguidos são agrupados)"""
     try:
         if DEBUG_MODE:
             print(f"Enviando DM para {user.name} com título: {title}")
@@ -469,12 +5003,10 @@ async def send_dm_results(user, title, results, cmd_equivalent=""):
             if current_chunk:
                 chunks.append(current_chunk)
             
-            # Enviar mensagem inicial
-            await user.send(f"📋 **{title}**\n\n{cmd_equivalent}")
-            
-            # Enviar cada bloco
-            for i, chunk in enumerate(chunks):
-                await user.send(f"```\n{chunk}\n```")
+            # Enfileirar a mensagem inicial e os blocos de uma vez; a fila respeita o limite do canal
+            sends = [queue_send(user, f"📋 **{title}**\n\n{cmd_equivalent}", priority, merge="append")]
+            sends += [queue_send(user, f"```\n{chunk}\n```", priority, merge="append") for chunk in chunks]
+            await asyncio.gather(*sends)
             
             if DEBUG_MODE:
                 print(f"Enviados {len(chunks)} blocos de resultados para {user.name}")
@@ -483,7 +5015,7 @@ async def send_dm_results(user, title, results, cmd_equivalent=""):
         else:
             # Enviar tudo em uma única mensagem
             message = f"📋 **{title}**\n\n{cmd_equivalent}\n```\n{results}\n```"
-            await user.send(message)
+            await queue_send(user, message, priority, merge="append")
             
             if DEBUG_MODE:
                 print(f"Enviada única mensagem de resultados para {user.name}")
@@ -534,12 +5066,14 @@ class SimpleMenuView(View):
             ephemeral=True
         )
         
-        await interaction.user.send(
+        prompt = await interaction.user.send(
             "⏭️ **Encontrar Próximos IPs Livres**\n\n"
             "Para encontrar IPs livres a partir de um endereço, use o comando:\n"
             "`!next_free`\n\n"
-            "(O primeiro parâmetro é o IP inicial e o segundo é a quantidade de IPs a encontrar)"
+            "(O primeiro parâmetro é o IP inicial e o segundo é a quantidade de IPs a encontrar)\n"
+            "Você também pode responder a esta mensagem com o IP inicial e a quantidade."
         )
+        await open_reply_session(interaction, "next_free", prompt)
     
     @discord.ui.button(label="Detalhar IP e Hostname", style=discord.ButtonStyle.primary)
     async def ip_details_button(self, interaction, button):
@@ -548,12 +5082,14 @@ class SimpleMenuView(View):
             ephemeral=True
         )
         
-        await interaction.user.send(
+        prompt = await interaction.user.send(
             "📝 **Detalhar IP e Hostname**\n\n"
             "Para obter detalhes completos sobre um IP, use o comando:\n"
             "`!ip_details`\n\n"
-            "(Substitua o endereço pelo IP que deseja analisar)"
+            "(Substitua o endereço pelo IP que deseja analisar)\n"
+            "Você também pode responder a esta mensagem com o IP."
         )
+        await open_reply_session(interaction, "ip_details", prompt)
     
     @discord.ui.button(label="Informações da rede", style=discord.ButtonStyle.secondary)
     async def network_info_button(self, interaction, button):
@@ -616,6 +5152,7 @@ class NetworkToolsView(View):
     
     async def select_callback(self, interaction):
         """Chamado quando o usuário seleciona uma opção no menu"""
+        use_profile(interaction.guild, interaction.channel)
         try:
             if DEBUG_MODE:
                 print(f"\nUsuário {interaction.user.name} selecionou uma opção")
@@ -646,6 +5183,7 @@ class NetworkToolsView(View):
                         f"Ok, {interaction.user.mention}, digite abaixo o IP que deseja verificar:",
                         ephemeral=True
                     )
+                    await open_reply_session(interaction, "check_ip")
                 except Exception as e:
                     log_error(f"Erro ao enviar mensagem de verificação de IP", e)
                     # Tentar abordagem alternativa se falhar
@@ -666,6 +5204,7 @@ class NetworkToolsView(View):
                         f"Ok, {interaction.user.mention}, digite abaixo o IP inicial e quantidade:",
                         ephemeral=True
                     )
+                    await open_reply_session(interaction, "next_free")
                 except Exception as e:
                     log_error(f"Erro ao enviar mensagem de próximos IPs livres", e)
                     # Tentar abordagem alternativa se falhar
@@ -686,6 +5225,7 @@ class NetworkToolsView(View):
                         f"Ok, {interaction.user.mention}, digite abaixo o IP que deseja analisar em detalhes:",
                         ephemeral=True
                     )
+                    await open_reply_session(interaction, "ip_details")
                 except Exception as e:
                     log_error(f"Erro ao enviar mensagem de detalhes de IP", e)
                     # Tentar abordagem alternativa se falhar
@@ -777,81 +5317,59 @@ class SubnetInputView(View):
 
 
 # Funções de processamento para cada funcionalidade
-async def scan_subnet(interaction, subnet_number):
+async def scan_subnet(interaction, subnet_number, max_age_minutes=None):
+    profile = use_profile(interaction.guild, interaction.channel)
     try:
         if DEBUG_MODE:
             print(f"\nIniciando escaneamento da sub-rede {subnet_number}")
             
         # Converter para inteiro
         subnet = int(subnet_number)
+        subnets = profile.subnets()
         
-        # Verificar se está no intervalo válido para uma rede /22 (0-3)
-        if subnet < 0 or subnet > 3:
-            await interaction.followup.send("❌ Para uma rede /22 (255.255.252.0), o número da sub-rede deve estar entre 0 e 3.", ephemeral=True)
+        # Verificar se está no intervalo válido para a rede do perfil (0-3 em uma /22)
+        if subnet < 0 or subnet > (len(subnets) - 1 if subnets else 3):
+            await interaction.followup.send(f"❌ Para a rede {profile.default_network or '/22 (255.255.252.0)'}, o número da sub-rede deve estar entre 0 e {len(subnets) - 1 if subnets else 3}.", ephemeral=True)
             return
         
         # Construir o CIDR da sub-rede
-        network_cidr = f".{subnet}.0/24"
-        
-        # Mensagem inicial
-        await interaction.followup.send(f"🔍 Escaneando a sub-rede {network_cidr}. Isso pode levar algum tempo...", ephemeral=True)
+        network_cidr = str(subnets[subnet]) if subnets else f".{subnet}.0/24"
         
         # Verificar a rede
         network = ipaddress.ip_network(network_cidr, strict=False)
         
-        # Lista para armazenar IPs livres
-        free_ips = []
+        # Cobrar antecipadamente as sondagens estimadas (IPs sem resultado recente no inventário)
+        try:
+            charge_probes(interaction.user, interaction.guild, estimate_scan_cost(network, max_age_minutes * 60 if max_age_minutes is not None else None))
+        except ProbeQuotaExceeded as e:
+            await interaction.followup.send(str(e), ephemeral=True)
+            return
         
-        # Lista para armazenar erros de verificação
-        errors = []
+        # Mensagem inicial
+        await interaction.followup.send(f"🔍 Escaneando a sub-rede {network_cidr}. Isso pode levar algum tempo...", ephemeral=True)
         
-        # Para redes menores, vamos limitar o número de IPs verificados simultaneamente
-        batch_size = 25  # Verificar 25 IPs por vez (reduzido para não sobrecarregar)
+        # Resultados recentes do inventário + sondagem do restante
+        # Progresso e avisos vão para a fila de saída sem segurar a varredura; progresso pendente é substituído
+        async def report_progress(text):
+            queue_send(interaction.followup, f"🔍 Escaneando a sub-rede {network_cidr}: {text}", PRIORITY_PROGRESS, merge="replace", ephemeral=True)
         
-        all_ips = list(network.hosts())
-        total_batches = (len(all_ips) + batch_size - 1) // batch_size
+        async def report_error(text):
+            queue_send(interaction.followup, text, PRIORITY_NORMAL, ephemeral=True)
         
-        for batch_num in range(total_batches):
-            start_idx = batch_num * batch_size
-            end_idx = min((batch_num + 1) * batch_size, len(all_ips))
-            
-            # IPs a serem verificados neste lote
-            batch_ips = all_ips[start_idx:end_idx]
-            
-            # Tarefas para verificar os IPs do lote
-            tasks = [is_ip_available(ip) for ip in batch_ips]
-            
-            # Executar as tarefas do lote simultaneamente
-            try:
-                results = await asyncio.gather(*tasks)
-                
-                # Adicionar IPs livres à lista
-                batch_free_ips = [str(ip) for ip, is_free in zip(batch_ips, results) if is_free]
-                free_ips.extend(batch_free_ips)
-                
-                # Atualizar a mensagem de progresso
-                progress = min(100, int((end_idx) / len(all_ips) * 100))
-                await interaction.followup.send(
-                    f"🔍 Escaneando a sub-rede {network_cidr}: {progress}% concluído... ({len(free_ips)} IPs livres encontrados até agora)",
-                    ephemeral=True
-                )
-            except Exception as e:
-                error_msg = f"Erro ao verificar lote {batch_num+1}/{total_batches}: {str(e)}"
-                errors.append(error_msg)
-                log_error(error_msg, e)
-                await interaction.followup.send(
-                    f"⚠️ Erro ao verificar alguns IPs no lote {batch_num+1}/{total_batches}. Continuando...",
-                    ephemeral=True
-                )
-            
-            # Pequena pausa entre os lotes para não sobrecarregar
-            await asyncio.sleep(1.0)
+        max_age = max_age_minutes * 60 if max_age_minutes is not None else None
+        checkpoint = ScanCheckpoint.start(network, interaction.user, max_age)
+        results, errors = await run_subnet_scan(network, report_progress, report_error, max_age, checkpoint)
+        drop_progress(interaction.followup)
+        # Os IPs reservados para outras pessoas são omitidos (a varredura não reserva nada)
+        free_ips, reserved_skipped = unreserved_ips(interaction.user, results.addresses(results.free()))
         
         # Verificar se encontramos IPs livres
         if free_ips:
-            # Mensagem final no canal (apenas para o usuário)
-            await interaction.followup.send(
+            # Mensagem final no canal (apenas para o usuário); pela fila, para sair depois do progresso pendente
+            await queue_send(
+                interaction.followup,
                 f"✅ Escaneamento concluído! Encontrados {len(free_ips)} IPs livres na sub-rede {network_cidr}. Os resultados foram enviados para sua mensagem privada.",
+                PRIORITY_RESULT,
                 ephemeral=True
             )
             
@@ -860,6 +5378,9 @@ async def scan_subnet(interaction, subnet_number):
             if errors:
                 free_ips_text += "\n\n⚠️ ATENÇÃO: Ocorreram alguns erros durante a verificação que podem afetar a precisão dos resultados."
                 free_ips_text += "\nSempre confirme manualmente antes de usar um IP."
+            note = format_reservation_note(free_ips, reserved_skipped, claimed=False)
+            if note:
+                free_ips_text += f"\n\n{note}"
             
             # Enviar resultados por DM
             dm_success = await send_dm_results(
@@ -869,13 +5390,17 @@ async def scan_subnet(interaction, subnet_number):
             )
             
             if not dm_success:
-                await interaction.followup.send(
+                await queue_send(
+                    interaction.followup,
                     "⚠️ Não foi possível enviar os resultados por mensagem privada. Verifique se suas DMs estão abertas.",
+                    PRIORITY_RESULT,
                     ephemeral=True
                 )
         else:
-            await interaction.followup.send(
-                f"❌ Nenhum IP livre encontrado na sub-rede {network_cidr}",
+            await queue_send(
+                interaction.followup,
+                f"❌ Nenhum IP livre encontrado na sub-rede {network_cidr}" + (f" ({reserved_skipped} livres, mas reservados para outras pessoas)" if reserved_skipped else ""),
+                PRIORITY_RESULT,
                 ephemeral=True
             )
     
@@ -884,34 +5409,88 @@ async def scan_subnet(interaction, subnet_number):
         await interaction.followup.send("❌ O número da sub-rede deve ser um número inteiro válido.", ephemeral=True)
     except Exception as e:
         log_error(f"Erro ao escanear a sub-rede {subnet_number}", e)
-        await interaction.followup.send(f"❌ Erro ao escanear a sub-rede: {str(e)}", ephemeral=True)
+        await queue_send(interaction.followup, f"❌ Erro ao escanear a sub-rede: {str(e)}", PRIORITY_RESULT, ephemeral=True)
 
 
-async def check_ip(user, ip_address, original_message=None):
+async def check_ip(user, ip_address, original_message=None, max_age_minutes=None):
     try:
         if DEBUG_MODE:
             print(f"\nVerificando IP específico: {ip_address} para {user.name}")
             
         # Verificar se o formato do IP é válido
+        processing_msg = None
         ip = ipaddress.ip_address(ip_address)
+        ensure_profile_allows(ip)
         
         # Criar mensagem de processamento
-        processing_msg = None
         if original_message:
-            processing_msg = await original_message.channel.send(f"🔍 Verificando disponibilidade do IP {ip_address}...")
+            processing_msg = await queue_send(original_message.channel, f"🔍 Verificando disponibilidade do IP {ip_address}...", PRIORITY_PROGRESS)
         
-        # Verificar IP usando método aprimorado
-        is_free = await is_ip_available(ip)
+        # Consultar primeiro o inventário passivo (resposta sem enviar nenhum pacote)
+        seen = current_profile().inventory.recently_seen(ip, PASSIVE_MAX_AGE)
         
-        if is_free:
-            result = f"✅ O IP {ip_address} parece estar DISPONÍVEL (livre)!"
-        else:
+        # Depois os leases DHCP e a planilha do IPAM
+        assigned = current_profile().inventory.assignment(ip) if not seen else None
+        
+        # Depois o inventário persistente (host visto ativo há pouco ou verificado dentro do prazo pedido)
+        store = get_inventory_store()
+        stored = None
+        if not seen and not assigned and store:
+            stored = store.fresh_result(ip, max_age_minutes * 60 if max_age_minutes is not None else None)
+        
+        if seen:
+            age = int(time.time() - seen["last_seen"])
             result = f"❌ O IP {ip_address} parece estar EM USO (ocupado)."
+            result += f"\n\nVisto na rede há {age}s via {seen['source'].upper()}"
+            if seen["mac_address"]:
+                result += f"\nEndereço MAC: {seen['mac_address']}"
+                vendor = lookup_vendor(seen["mac_address"])
+                if vendor:
+                    result += f" ({vendor})"
+            if seen["hostname"]:
+                result += f"\nNome do host: {seen['hostname']}"
+        elif assigned:
+            result = f"❌ O IP {ip_address} está ATRIBUÍDO (em uso)."
+            origin = os.path.basename(assigned["origin"])
+            if assigned["source"] == "lease":
+                result += f"\n\nLease DHCP em {origin}"
+            else:
+                result += f"\n\nDocumentado no IPAM ({origin})"
+            if assigned["expires"] is not None:
+                result += f", válido até {time.strftime('%d/%m/%Y %H:%M', time.localtime(assigned['expires']))}"
+            if assigned["mac_address"]:
+                result += f"\nEndereço MAC: {assigned['mac_address']}"
+            if assigned["hostname"]:
+                result += f"\nNome do host: {assigned['hostname']}"
+        elif stored:
+            is_free, row = stored
+            if is_free:
+                result = f"✅ O IP {ip_address} parece estar DISPONÍVEL (livre)!"
+            else:
+                result = f"❌ O IP {ip_address} parece estar EM USO (ocupado)."
+                if row["hostname"]:
+                    result += f"\n\nNome do host: {row['hostname']}"
+            result += f"\n\n(Resultado do inventário, verificado há {format_age(row['last_checked'])} via {row['source']})"
+        else:
+            # Verificar IP usando método aprimorado (1 sondagem da cota)
+            charge_probes(user, original_message.guild if original_message else None, 1)
+            is_free = await is_ip_available(ip)
             
-            # Se estiver em uso, tentar resolver o hostname
-            hostname = await resolve_hostname(ip)
-            if hostname:
-                result += f"\n\nNome do host: {hostname}"
+            if is_free:
+                result = f"✅ O IP {ip_address} parece estar DISPONÍVEL (livre)!"
+            else:
+                result = f"❌ O IP {ip_address} parece estar EM USO (ocupado)."
+                
+                # Se estiver em uso, tentar resolver o hostname
+                hostname = await resolve_hostname(ip)
+                if hostname:
+                    result += f"\n\nNome do host: {hostname}"
+        
+        # Avisar se o IP já foi entregue a alguém
+        ledger = get_reservation_ledger()
+        reservation = ledger.holder(ip) if ledger else None
+        if reservation:
+            result += f"\n\n{format_reservation(reservation, reservation.user_id == user.id)}"
         
         # Enviar resultado por DM
         dm_sent = await send_dm_results(
@@ -922,44 +5501,44 @@ async def check_ip(user, ip_address, original_message=None):
         
         # Se a mensagem DM foi enviada e há mensagem de processamento, atualizá-la
         if dm_sent and processing_msg:
-            await processing_msg.edit(content=f"{user.mention} Verificação do IP {ip_address} concluída. Resultados enviados por mensagem privada.")
-            await asyncio.sleep(5)
-            await processing_msg.delete()
+            await queue_edit(processing_msg, f"{user.mention} Verificação do IP {ip_address} concluída. Resultados enviados por mensagem privada.", PRIORITY_RESULT)
+            schedule_delete(processing_msg)
         elif processing_msg:
-            await processing_msg.edit(content=f"❌ Não foi possível enviar mensagem privada para {user.mention}. Verifique se suas DMs estão abertas.")
-            await asyncio.sleep(5)
-            await processing_msg.delete()
+            await queue_edit(processing_msg, f"❌ Não foi possível enviar mensagem privada para {user.mention}. Verifique se suas DMs estão abertas.", PRIORITY_RESULT)
+            schedule_delete(processing_msg)
     
+    except ProbeQuotaExceeded as e:
+        if processing_msg:
+            queue_delete(processing_msg.channel, [processing_msg])
+        await send_notice(user, original_message, str(e))
     except ValueError as e:
         log_error(f"Formato de IP inválido: {ip_address}", e)
-        if original_message:
-            error_msg = await original_message.channel.send("❌ Formato de IP inválido. Use um endereço IPv4 válido")
-            await asyncio.sleep(5)
-            await error_msg.delete()
-        else:
-            await user.send("❌ Formato de IP inválido. Use um endereço IPv4 válido")
+        await send_notice(user, original_message, "❌ Formato de IP inválido. Use um endereço IPv4 ou IPv6 válido")
     except Exception as e:
         log_error(f"Erro ao verificar o IP: {ip_address}", e)
-        if original_message:
-            error_msg = await original_message.channel.send(f"❌ Erro ao verificar o IP: {str(e)}")
-            await asyncio.sleep(5)
-            await error_msg.delete()
-        else:
-            await user.send(f"❌ Erro ao verificar o IP: {str(e)}")
+        await send_notice(user, original_message, f"❌ Erro ao verificar o IP: {str(e)}")
 
 
-async def ip_details(user, ip_address, original_message=None):
+async def ip_details(user, ip_address, original_message=None, fingerprint=False):
+    # Faixas CIDR ou listas de IPs vão para o modo em massa
+    targets = ip_address.replace(',', ' ').split()
+    if len(targets) > 1 or '/' in ip_address:
+        await bulk_ip_details(user, targets, original_message, fingerprint)
+        return
+    
     try:
         if DEBUG_MODE:
             print(f"\nObtendo detalhes do IP: {ip_address} para {user.name}")
             
         # Verificar se o formato do IP é válido
         ip = ipaddress.ip_address(ip_address)
+        ensure_profile_allows(ip)
+        charge_probes(user, original_message.guild if original_message else None, 1)
         
         # Criar mensagem de processamento
         processing_msg = None
         if original_message:
-            processing_msg = await original_message.channel.send(f"🔍 Obtendo detalhes para o IP {ip_address}...")
+            processing_msg = await queue_send(original_message.channel, f"🔍 Obtendo detalhes para o IP {ip_address}...", PRIORITY_PROGRESS)
         
         # Obter detalhes completos
         details = await get_ip_details(ip)
@@ -975,11 +5554,22 @@ async def ip_details(user, ip_address, original_message=None):
             
         if details['mac_address']:
             result += f"Endereço MAC: {details['mac_address']}\n"
+            if details['vendor']:
+                result += f"Fabricante: {details['vendor']}\n"
         else:
             result += "Endereço MAC: Não encontrado\n"
             
         result += f"Responde a ping: {'Sim' if details['responde_ping'] else 'Não'}\n"
         
+        rtt = current_profile().rtt_estimates.get(details['ip'])
+        if rtt:
+            result += f"Latência média: {rtt[0]:.1f} ms\n"
+        
+        # Identificação de serviços (opcional), só para hosts em uso
+        if fingerprint and not details['status'].startswith('livre'):
+            services = await fingerprint_host(ip)
+            result += "Serviços:\n" + ('\n'.join(format_services(services, "  ")) if services else "  nenhum identificado") + "\n"
+        
         # Enviar resultado por DM
         dm_sent = await send_dm_results(
             user,
@@ -989,61 +5579,192 @@ async def ip_details(user, ip_address, original_message=None):
         
         # Se a mensagem DM foi enviada e há mensagem de processamento, atualizá-la
         if dm_sent and processing_msg:
-            await processing_msg.edit(content=f"{user.mention} Detalhes do IP {ip_address} concluídos. Resultados enviados por mensagem privada.")
-            await asyncio.sleep(5)
-            await processing_msg.delete()
+            await queue_edit(processing_msg, f"{user.mention} Detalhes do IP {ip_address} concluídos. Resultados enviados por mensagem privada.", PRIORITY_RESULT)
+            schedule_delete(processing_msg)
         elif processing_msg:
-            await processing_msg.edit(content=f"❌ Não foi possível enviar mensagem privada para {user.mention}. Verifique se suas DMs estão abertas.")
-            await asyncio.sleep(5)
-            await processing_msg.delete()
+            await queue_edit(processing_msg, f"❌ Não foi possível enviar mensagem privada para {user.mention}. Verifique se suas DMs estão abertas.", PRIORITY_RESULT)
+            schedule_delete(processing_msg)
             
     
+    except ProbeQuotaExceeded as e:
+        await send_notice(user, original_message, str(e))
     except ValueError as e:
         log_error(f"Formato de IP inválido: {ip_address}", e)
-        if original_message:
-            error_msg = await original_message.channel.send("❌ Formato de IP inválido. Use um endereço IPv4 válido")
-            await asyncio.sleep(5)
-            await error_msg.delete()
-        else:
-            await user.send("❌ Formato de IP inválido. Use um endereço IPv4 válido")
+        await send_notice(user, original_message, "❌ Formato de IP inválido. Use um endereço IPv4 ou IPv6 válido")
     except Exception as e:
         log_error(f"Erro ao obter detalhes do IP: {ip_address}", e)
-        if original_message:
-            error_msg = await original_message.channel.send(f"❌ Erro ao obter detalhes do IP: {str(e)}")
-            await asyncio.sleep(5)
-            await error_msg.delete()
+        await send_notice(user, original_message, f"❌ Erro ao obter detalhes do IP: {str(e)}")
+
+
+# Converte uma lista de IPs e/ou faixas CIDR em endereços a verificar
+def parse_ip_targets(targets, max_hosts=None):
+    """Expande IPs e redes CIDR (sem duplicatas, na ordem informada). Gera ValueError se inválido"""
+    ips = []
+    seen = set()
+    for target in targets:
+        if '/' in target:
+            candidates = ipaddress.ip_network(target, strict=False).hosts()
         else:
-            await user.send(f"❌ Erro ao obter detalhes do IP: {str(e)}")
+            candidates = [ipaddress.ip_address(target)]
+        for ip in candidates:
+            if ip not in seen:
+                seen.add(ip)
+                ips.append(ip)
+            if max_hosts is not None and len(ips) > max_hosts:
+                raise ValueError(f"Máximo de {max_hosts} IPs por consulta")
+    return ips
+
+# Formata uma linha da tabela de detalhes em massa
+def format_details_row(details, ip_width=15):
+    """ip_width: largura da coluna de IP (o maior endereço do lote; IPv6 passa dos 15 de um IPv4)"""
+    status = details['status'].split(' ')[0]
+    return (
+        f"{details['ip']:<{ip_width}} {status:<10} {'sim' if details['responde_ping'] else 'não':<4} "
+        f"{details['mac_address'] or '-':<17} {(details['vendor'] or '-')[:20]:<20} {details['hostname'] or '-'}"
+    )
+
+async def bulk_ip_details(user, targets, original_message=None, fingerprint=False):
+    """Obtém detalhes de vários IPs em paralelo (limitado) e envia a tabela por DM ao final, com o progresso no canal.
+    Com fingerprint, os serviços dos hosts em uso são identificados logo depois dos detalhes de cada um"""
+    profile = current_profile()
+    try:
+        ips = parse_ip_targets(targets, profile.max_hosts)
+        if not ips:
+            raise ValueError("Nenhum IP informado")
+        for target in targets:
+            ensure_profile_allows(ipaddress.ip_network(target, strict=False) if '/' in target else ipaddress.ip_address(target))
+    except (ValueError, PermissionError) as e:
+        log_error(f"Lista de IPs inválida: {targets}", e)
+        error_text = f"❌ Lista de IPs inválida: {str(e)}. Use IPs ou faixas CIDR (ex: 10.0.1.0/24)"
+        await send_notice(user, original_message, error_text)
+        return
+    
+    # Uma sondagem por IP, cobrada antes de começar
+    try:
+        charge_probes(user, original_message.guild if original_message else None, len(ips))
+    except ProbeQuotaExceeded as e:
+        await send_notice(user, original_message, str(e))
+        return
+    
+    try:
+        if DEBUG_MODE:
+            print(f"\nObtendo detalhes de {len(ips)} IPs para {user.name}")
+        
+        processing_msg = None
+        if original_message:
+            processing_msg = await queue_send(original_message.channel, f"🔍 Obtendo detalhes de {len(ips)} IPs...", PRIORITY_PROGRESS)
+        
+        # Nomes de toda a lista de uma vez (mDNS/NetBIOS/LLMNR); os IPs encontrados não fazem consulta individual
+        await discover_names(ips)
+        
+        # Todas as tarefas são criadas de uma vez, mas o semáforo limita quantas rodam ao mesmo tempo
+        semaphore = asyncio.Semaphore(profile.concurrency)
+        
+        async def limited_details(ip):
+            async with semaphore:
+                details = await get_ip_details(ip)
+            # Fora do semáforo dos detalhes: o limite das conexões de identificação é global
+            if fingerprint and not details['status'].startswith('livre'):
+                details['services'] = await fingerprint_host(ip)
+            return details
+        
+        tasks = [asyncio.ensure_future(limited_details(ip)) for ip in ips]
+        
+        # Linhas em ordem; o progresso no canal substitui a edição anterior ainda pendente
+        ip_width = max(len(str(ip)) for ip in ips)
+        lines = [f"{'IP':<{ip_width}} {'STATUS':<10} {'PING':<4} {'MAC':<17} {'FABRICANTE':<20} HOSTNAME"]
+        active = 0
+        try:
+            for done, task in enumerate(tasks, 1):
+                details = await task
+                if not details['status'].startswith('livre'):
+                    active += 1
+                lines.append('\n'.join([format_details_row(details, ip_width)] + format_services(details.get('services', {}), "    ")))
+                if processing_msg:
+                    queue_edit(processing_msg, f"🔍 Obtendo detalhes: {done}/{len(ips)} IPs...")
+        finally:
+            for task in tasks:
+                task.cancel()
+        
+        summary = f"{len(ips)} IPs verificados: {active} em uso, {len(ips) - active} livres"
+        dm_sent = await send_dm_results(user, f"Detalhes de {len(ips)} IPs", '\n'.join(lines))
+        if dm_sent:
+            await queue_send(user, f"✅ {summary}", PRIORITY_RESULT, merge="append")
+        
+        if dm_sent and processing_msg:
+            await queue_edit(processing_msg, f"{user.mention} Detalhes concluídos ({summary}). Resultados enviados por mensagem privada.", PRIORITY_RESULT)
+            schedule_delete(processing_msg)
+        elif processing_msg:
+            await queue_edit(processing_msg, f"❌ Não foi possível enviar mensagem privada para {user.mention}. Verifique se suas DMs estão abertas.", PRIORITY_RESULT)
+            schedule_delete(processing_msg)
+    
+    except Exception as e:
+        log_error(f"Erro ao obter detalhes em massa: {targets}", e)
+        await send_notice(user, original_message, f"❌ Erro ao obter detalhes dos IPs: {str(e)}")
 
 
-async def find_next_free(user, start_ip, count=5, original_message=None):
+async def find_next_free(user, start_ip, count=5, original_message=None, max_age_minutes=None):
+    guild = original_message.guild if original_message else None
+    charged = probed = 0
     try:
         if DEBUG_MODE:
             print(f"\nBuscando IPs livres a partir de: {start_ip}, quantidade: {count} para {user.name}")
             
         # Verificar se o formato do IP é válido
         ip = ipaddress.ip_address(start_ip)
+        ensure_profile_allows(ip)
         
         # Limitar o número de IPs a procurar
         if count > 20:
             count = 20  # Máximo de 20 IPs
         
+        # Cobrar o máximo de sondagens da busca (100); o que não for usado é devolvido no fim, mesmo com erro
+        charge_probes(user, guild, 100)
+        charged = 100
+        
         # Criar mensagem de processamento
         processing_msg = None
         if original_message:
-            processing_msg = await original_message.channel.send(f"🔍 Procurando {count} IPs livres a partir de {start_ip}...")
+            processing_msg = await queue_send(original_message.channel, f"🔍 Procurando {count} IPs livres a partir de {start_ip}...", PRIORITY_PROGRESS)
         
         # Lista para armazenar IPs livres
         free_ips = []
         checked = 0
         current_ip = ip
+        store = get_inventory_store()
+        ledger = get_reservation_ledger()
+        reserved_skipped = 0
+        max_age = max_age_minutes * 60 if max_age_minutes is not None else None
         
         # Procurar até encontrar o número solicitado de IPs livres ou verificar 100 IPs
         while len(free_ips) < count and checked < 100:
-            # Verificar IP atual usando método aprimorado
-            is_free = await is_ip_available(current_ip)
+            # Não sair das redes do perfil
+            if not current_profile().allows(current_ip):
+                break
             
-            if is_free:
+            # IPs reservados para outras pessoas nem são sondados
+            if ledger and ledger.is_reserved(current_ip, user.id):
+                reserved_skipped += 1
+                current_ip = ipaddress.ip_address(int(current_ip) + 1)
+                checked += 1
+                continue
+            
+            # IPs com lease DHCP ou documentados no IPAM estão em uso; depois o inventário quando houver
+            # resultado recente; senão, verificar com o método aprimorado
+            stored = store.fresh_result(current_ip, max_age) if store else None
+            if current_profile().inventory.assignment(current_ip):
+                is_free = False
+            elif stored:
+                is_free = stored[0]
+            else:
+                is_free = await is_ip_available(current_ip)
+                probed += 1
+            
+            # Reservar no mesmo passo em que o IP é aceito: outra busca que o tenha reservado
+            # durante a sondagem acima fica com ele
+            if is_free and ledger and not ledger.claim([current_ip], user):
+                reserved_skipped += 1
+            elif is_free:
                 free_ips.append(str(current_ip))
                 if DEBUG_MODE:
                     print(f"IP livre encontrado: {current_ip} ({len(free_ips)}/{count})")
@@ -1052,6 +5773,13 @@ async def find_next_free(user, start_ip, count=5, original_message=None):
             current_ip = ipaddress.ip_address(int(current_ip) + 1)
             checked += 1
         
+        # Sugerir primeiro os IPs há mais tempo sem uso, segundo o histórico de presença
+        result_lines = free_ips
+        if free_ips and store and HISTORY_DAYS:
+            dormancy = store.presence_summary(free_ips)
+            free_ips = rank_by_dormancy(free_ips, dormancy)
+            result_lines = [f"{free_ip:<15} {describe_dormancy(dormancy.get(free_ip))}" for free_ip in free_ips]
+        
         # Criar string de comando CMD equivalente
         subnet_part = '.'.join(str(ip).split('.')[:3])
         last_octet = str(ip).split('.')[-1]
@@ -1059,74 +5787,249 @@ async def find_next_free(user, start_ip, count=5, original_message=None):
         # Verificar se encontramos IPs livres
         if free_ips:
             # Enviar resultado por DM
+            note = format_reservation_note(free_ips if ledger else [], reserved_skipped)
             dm_sent = await send_dm_results(
                 user,
                 f"IPs livres a partir de {start_ip}",
-                '\n'.join(free_ips),
+                '\n'.join(result_lines) + (f"\n\n{note}" if note else ""),
             )
             
             # Se a mensagem DM foi enviada e há mensagem de processamento, atualizá-la
             if dm_sent and processing_msg:
-                await processing_msg.edit(content=f"{user.mention} Busca por IPs livres a partir de {start_ip} concluída. Resultados enviados por mensagem privada.")
-                await asyncio.sleep(5)
-                await processing_msg.delete()
+                await queue_edit(processing_msg, f"{user.mention} Busca por IPs livres a partir de {start_ip} concluída. Resultados enviados por mensagem privada.", PRIORITY_RESULT)
+                schedule_delete(processing_msg)
             elif processing_msg:
-                await processing_msg.edit(content=f"❌ Não foi possível enviar mensagem privada para {user.mention}. Verifique se suas DMs estão abertas.")
-                await asyncio.sleep(5)
-                await processing_msg.delete()
+                await queue_edit(processing_msg, f"❌ Não foi possível enviar mensagem privada para {user.mention}. Verifique se suas DMs estão abertas.", PRIORITY_RESULT)
+                schedule_delete(processing_msg)
         else:
+            text = f"❌ Nenhum IP livre encontrado a partir de {start_ip} (verificados {checked} IPs{f', {reserved_skipped} reservados para outras pessoas' if reserved_skipped else ''})"
             if processing_msg:
-                await processing_msg.edit(content=f"❌ Nenhum IP livre encontrado a partir de {start_ip} (verificados {checked} IPs)")
-                await asyncio.sleep(5)
-                await processing_msg.delete()
+                await queue_edit(processing_msg, text, PRIORITY_RESULT)
+                schedule_delete(processing_msg)
             else:
-                await user.send(f"❌ Nenhum IP livre encontrado a partir de {start_ip} (verificados {checked} IPs)")
+                await queue_send(user, text, PRIORITY_RESULT)
                 
     
+    except ProbeQuotaExceeded as e:
+        await send_notice(user, original_message, str(e))
     except ValueError as e:
         log_error(f"Formato de IP inválido: {start_ip}", e)
-        if original_message:
-            error_msg = await original_message.channel.send("❌ Formato de IP inválido. Use um endereço IPv4 válido0")
-            await asyncio.sleep(5)
-            await error_msg.delete()
-        else:
-            await user.send("❌ Formato de IP inválido. Use um endereço IPv4 válido")
+        await send_notice(user, original_message, "❌ Formato de IP inválido. Use um endereço IPv4 ou IPv6 válido")
     except Exception as e:
         log_error(f"Erro ao procurar IPs livres a partir de: {start_ip}", e)
+        await send_notice(user, original_message, f"❌ Erro ao procurar IPs livres: {str(e)}")
+    finally:
+        if charged:
+            refund_probes(user, guild, charged - probed)
+
+
+# Identifica os serviços dos hosts ativos: de uma faixa já varrida, só os hosts ocupados na última varredura
+async def fingerprint_targets(user, target, original_message=None):
+    profile = current_profile()
+    try:
+        network = ipaddress.ip_network(target, strict=False) if '/' in target and ' ' not in target.strip() else None
+    except ValueError:
+        network = None
+    snapshot = profile.previous_sweep(str(network)) if network else None
+    if snapshot is None:
+        # Sem varredura anterior: detalhes completos, com identificação dos hosts que estiverem em uso
+        await ip_details(user, target, original_message, fingerprint=True)
+        return
+
+    try:
+        ensure_profile_allows(network)
+        live = snapshot.occupied_addresses()
+        charge_probes(user, original_message.guild if original_message else None, len(live))
+    except (PermissionError, ProbeQuotaExceeded) as e:
+        await send_notice(user, original_message, f"❌ {str(e)}")
+        return
+    if not live:
+        await send_notice(user, original_message, f"❌ Nenhum host em uso na última varredura de {network}.")
+        return
+
+    try:
+        if original_message:
+            await send_notice(user, original_message, f"🔍 Identificando serviços de {len(live)} hosts em uso na última varredura de {network} (há {format_age(snapshot.taken)})...")
+        started = time.time()
+        all_services = await asyncio.gather(*(fingerprint_host(ip) for ip in live))
+        lines = []
+        identified = 0
+        for ip, services in zip(live, all_services):
+            identified += bool(services)
+            lines.append(f"{str(ip):<15} {'' if services else 'nenhum serviço identificado'}".rstrip())
+            lines += format_services(services, "    ")
+        summary = f"{identified} de {len(live)} hosts com serviços identificados em {time.time() - started:.1f}s"
+        dm_sent = await send_dm_results(user, f"Serviços em {network}", '\n'.join(lines) + f"\n\n✅ {summary}")
+        if original_message and not dm_sent:
+            await send_notice(user, original_message, f"❌ Não foi possível enviar mensagem privada para {user.mention}. Verifique se suas DMs estão abertas.")
+    except Exception as e:
+        log_error(f"Erro ao identificar serviços em {network}", e)
+        await send_notice(user, original_message, f"❌ Erro ao identificar serviços: {str(e)}")
+
+# Descreve a presença de um IP no histórico
+def format_presence(ip, entry):
+    if not entry:
+        return f"❔ {ip}: sem observações nos últimos {HISTORY_DAYS} dias"
+    if entry["last_seen"] is None:
+        return f"⚪ {ip}: nunca visto em {HISTORY_DAYS} dias (verificado em {entry['days_observed']} dias)"
+    today = int(time.time() // 86400)
+    recent = sum(1 for day in entry["days_seen"] if day > today - 30)
+    when = time.strftime('%d/%m/%Y %H:%M', time.localtime(entry["last_seen"]))
+    return f"🟢 {ip}: visto por último há {format_age(entry['last_seen'])} ({when}); visto em {recent} dos últimos 30 dias"
+
+# Ordena IPs livres pelo tempo sem uso: nunca vistos primeiro, depois os vistos há mais tempo
+def rank_by_dormancy(ips, summary):
+    return sorted(ips, key=lambda ip: (summary.get(ip) or {}).get("last_seen") or 0)
+
+def describe_dormancy(entry):
+    if not entry:
+        return "sem histórico"
+    if entry["last_seen"] is None:
+        return f"nunca visto em {HISTORY_DAYS} dias"
+    return f"sem uso há {format_age(entry['last_seen'])}"
+
+async def show_history(user, target, original_message=None):
+    """Envia por DM o histórico de presença de um IP ou de uma faixa CIDR (sem nenhuma sondagem)"""
+    try:
+        if '/' in target:
+            parsed = ipaddress.ip_network(target, strict=False)
+        else:
+            parsed = ipaddress.ip_address(target)
+        ensure_profile_allows(parsed)
+    except (ValueError, PermissionError) as e:
+        log_error(f"Alvo inválido para o histórico: {target}", e)
+        await send_notice(user, original_message, f"❌ Alvo inválido: {str(e)}. Use um IP ou uma faixa CIDR (ex: 10.0.2.0/24)")
+        return
+
+    store = get_inventory_store()
+    if not store or not HISTORY_DAYS:
+        await send_notice(user, original_message, "❌ Histórico indisponível: o inventário persistente ou o histórico (HISTORY_DAYS) está desativado.")
+        return
+
+    try:
+        summary = store.presence_summary(parsed)
+        if isinstance(parsed, (ipaddress.IPv4Address, ipaddress.IPv6Address)):
+            text = format_presence(str(parsed), summary.get(str(parsed)))
+        else:
+            today = int(time.time() // 86400)
+            total = parsed.num_addresses - 2 if parsed.version == 4 and parsed.prefixlen < 31 else parsed.num_addresses
+            seen = [entry for entry in summary.values() if entry["last_seen"] is not None]
+            active_today = sum(1 for entry in seen if int(entry["last_seen"] // 86400) == today)
+            recent = sum(1 for entry in seen if any(day > today - 30 for day in entry["days_seen"]))
+            lines = [
+                f"{len(seen)} de {total} IPs vistos em {HISTORY_DAYS} dias ({active_today} hoje, {recent} nos últimos 30 dias)",
+                f"{len(summary) - len(seen)} verificados e nunca vistos; {total - len(summary)} sem nenhuma observação",
+                ""
+            ]
+            limit = current_profile().max_hosts
+            ordered = sorted(summary, key=ipaddress.ip_address)
+            lines += [format_presence(ip, summary[ip]) for ip in ordered[:limit]]
+            if len(ordered) > limit:
+                lines.append(f"... e mais {len(ordered) - limit} IPs")
+            text = '\n'.join(lines)
+
+        dm_sent = await send_dm_results(user, f"Histórico de presença de {target}", text)
         if original_message:
-            error_msg = await original_message.channel.send(f"❌ Erro ao procurar IPs livres: {str(e)}")
-            await asyncio.sleep(5)
-            await error_msg.delete()
+            if dm_sent:
+                await send_notice(user, original_message, f"{user.mention} Histórico de {target} enviado por mensagem privada.")
+            else:
+                await send_notice(user, original_message, f"❌ Não foi possível enviar mensagem privada para {user.mention}. Verifique se suas DMs estão abertas.")
+    except Exception as e:
+        log_error(f"Erro ao consultar o histórico de {target}", e)
+        await send_notice(user, original_message, f"❌ Erro ao consultar o histórico: {str(e)}")
+
+# Confirma ou libera reservas de IPs do autor do comando
+async def update_reservations(ctx, action, ips):
+    ledger = get_reservation_ledger()
+    if not ledger:
+        await ctx.send("❌ As reservas de IPs estão desativadas (RESERVATION_TTL=0).")
+        return
+    if not ips:
+        await ctx.send(f"❌ Informe um ou mais IPs{' (ou all)' if action == 'release' else ''}.")
+        return
+    release_all = action == "release" and any(ip.lower() == "all" for ip in ips)
+    try:
+        targets = [] if release_all else list(dict.fromkeys(ipaddress.ip_address(ip) for ip in ips))
+        for ip in targets:
+            ensure_profile_allows(ip)
+    except (ValueError, PermissionError) as e:
+        await ctx.send(f"❌ IP inválido: {str(e)}")
+        return
+
+    try:
+        if action == "confirm":
+            done = ledger.confirm(targets, ctx.author)
+            validity = f"por {RESERVATION_CONFIRM_TTL // 86400} dias" if RESERVATION_CONFIRM_TTL >= 86400 else "sem prazo" if not RESERVATION_CONFIRM_TTL else f"por {RESERVATION_CONFIRM_TTL // 60} min"
+            message = f"✅ {len(done)} IPs confirmados para você ({validity}): {', '.join(done)}" if done else "❌ Nenhum IP confirmado."
+        else:
+            done = ledger.release(ctx.author, None if release_all else targets)
+            message = f"✅ {len(done)} reservas liberadas." if done else "❌ Nenhuma reserva sua foi encontrada."
+        refused = len(targets) - len(done)
+        if targets and refused:
+            message += f"\n⚠️ {refused} IPs {'estão reservados para outras pessoas' if action == 'confirm' else 'não estavam reservados para você'}."
+        await ctx.send(message)
+    except Exception as e:
+        log_error(f"Erro ao atualizar reservas ({action})", e)
+        await ctx.send(f"❌ Erro ao atualizar as reservas: {str(e)}")
+
+async def show_reservations(user, network_range=None, original_message=None):
+    """Envia por DM as reservas do usuário ou, com uma faixa CIDR, todas as reservas da faixa"""
+    ledger = get_reservation_ledger()
+    if not ledger:
+        await send_notice(user, original_message, "❌ As reservas de IPs estão desativadas (RESERVATION_TTL=0).")
+        return
+    try:
+        if network_range:
+            network = ipaddress.ip_network(network_range, strict=False)
+            ensure_profile_allows(network)
+            reservations = ledger.in_network(network)
+            title = f"Reservas de IPs em {network}"
         else:
-            await user.send(f"❌ Erro ao procurar IPs livres: {str(e)}")
+            reservations = ledger.of_user(user.id)
+            title = "Suas reservas de IPs"
+    except (ValueError, PermissionError) as e:
+        await send_notice(user, original_message, f"❌ Faixa inválida: {str(e)}")
+        return
 
+    if not reservations:
+        await send_notice(user, original_message, "Nenhuma reserva ativa.")
+        return
+    text = '\n'.join(format_reservation(r, r.user_id == user.id) for r in reservations)
+    dm_sent = await send_dm_results(user, title, text)
+    if original_message:
+        if dm_sent:
+            await send_notice(user, original_message, f"{user.mention} {len(reservations)} reservas enviadas por mensagem privada.")
+        else:
+            await send_notice(user, original_message, f"❌ Não foi possível enviar mensagem privada para {user.mention}. Verifique se suas DMs estão abertas.")
 
 async def show_network_info(interaction):
+    use_profile(interaction.guild, interaction.channel)
     try:
         if DEBUG_MODE:
             print(f"\nMostrando informações da rede para {interaction.user.name}")
             
-        # Obter informações da rede padrão
-        network = ipaddress.ip_network(DEFAULT_NETWORK, strict=False)
+        # Obter informações da rede do perfil deste servidor
+        profile = current_profile()
+        network = ipaddress.ip_network(profile.default_network, strict=False)
         
         # Calcular informações da rede
         info = f"""
 📊 **Informações da Rede**
 
-🌐 **Rede:** {DEFAULT_NETWORK}
-🔑 **Gateway:** {DEFAULT_GATEWAY}
+🌐 **Rede:** {', '.join(str(net) for net in profile.networks)}
+🔑 **Gateway:** {profile.gateway}
 🎭 **Máscara:** {network.netmask} (/{network.prefixlen})
 📍 **Endereço de Rede:** {network.network_address}
 📡 **Endereço de Broadcast:** {network.broadcast_address}
 🔢 **Total de Endereços:** {network.num_addresses}
 📈 **Faixa de IPs Utilizáveis:** {network.network_address + 1} até {network.broadcast_address - 1}
-🧩 **Sub-redes em /24:** {', '.join([f'{i}.0/24' for i in range(4)])}
+🧩 **Sub-redes em /24:** {', '.join(f'{i}: {net}' for i, net in enumerate(profile.subnets()))}
 
 **Comandos CMD equivalentes:**
 
 ipconfig /all                        (ver configuração de rede)
-nslookup {DEFAULT_GATEWAY}           (resolver DNS do gateway)
-tracert {DEFAULT_GATEWAY}            (traçar rota até o gateway)
+nslookup {profile.gateway}           (resolver DNS do gateway)
+tracert {profile.gateway}            (traçar rota até o gateway)
 
 """
         # Enviar informações no canal (apenas para o usuário)
@@ -1154,26 +6057,96 @@ async def clean_dm_cmd(ctx, num_messages=10):
             async for message in ctx.channel.history(limit=50):
                 if message.author == bot.user and len(messages_to_delete) < int(num_messages):
                     messages_to_delete.append(message)
-            deleted_count = 0
-            for message in messages_to_delete:
-                try:
-                    await message.delete()
-                    deleted_count += 1
-                    await asyncio.sleep(0.5)
-                except:
-                    pass
+            # A fila de saída apaga no ritmo permitido pelo Discord
+            deleted_count = await queue_delete(ctx.channel, messages_to_delete, PRIORITY_RESULT) if messages_to_delete else 0
             
             temp_msg = await ctx.send(f"✅ {deleted_count} mensagens foram removidas da nossa conversa.")
-            await asyncio.sleep(5)
-            await temp_msg.delete()
+            schedule_delete(temp_msg)
         else:
-            await ctx.send("Este comando só funciona em conversas privadas (DM).", delete_after=5)
+            schedule_delete(await ctx.send("Este comando só funciona em conversas privadas (DM)."))
     except Exception as e:
         log_error(f"Erro ao limpar o chat", e)
-        await ctx.send("❌ Não foi possível limpar o chat.", delete_after=5)
+        schedule_delete(await ctx.send("❌ Não foi possível limpar o chat."))
+
+@bot.command(name='history', help='Mostra quando um IP (ou os IPs de uma faixa CIDR) foi visto ativo pela última vez')
+async def history_cmd(ctx, target):
+    await show_history(ctx.author, target, ctx.message)
+
+@bot.command(name='subscribe', help='Recebe por DM as mudanças detectadas nas varreduras')
+async def subscribe_cmd(ctx):
+    try:
+        get_delta_subscribers().add(ctx.author.id)
+        store = get_inventory_store()
+        if store:
+            store.add_subscriber(ctx.author.id)
+        await ctx.send("🔔 Você vai receber por mensagem privada as mudanças detectadas nas varreduras (novos dispositivos, IPs que saíram e MACs alterados).")
+    except Exception as e:
+        log_error("Erro ao assinar notificações", e)
+        await ctx.send("❌ Não foi possível assinar as notificações.")
+
+@bot.command(name='unsubscribe', help='Para de receber as mudanças detectadas nas varreduras')
+async def unsubscribe_cmd(ctx):
+    try:
+        get_delta_subscribers().discard(ctx.author.id)
+        store = get_inventory_store()
+        if store:
+            store.remove_subscriber(ctx.author.id)
+        await ctx.send("🔕 Você não vai mais receber as mudanças das varreduras.")
+    except Exception as e:
+        log_error("Erro ao cancelar notificações", e)
+        await ctx.send("❌ Não foi possível cancelar as notificações.")
 
-@bot.command(name='scan_subnet', help='Verifica IPs livres em uma sub-rede')
-async def scan_subnet_cmd(ctx, subnet_number):
+@bot.command(name='confirm_ip', help='Confirma que você vai usar IPs entregues a você (a reserva deixa de expirar em minutos)')
+async def confirm_ip_cmd(ctx, *ips):
+    await update_reservations(ctx, "confirm", ips)
+
+@bot.command(name='release_ip', help='Libera IPs reservados para você: <ip> [ip...] | all')
+async def release_ip_cmd(ctx, *ips):
+    await update_reservations(ctx, "release", ips)
+
+@bot.command(name='reservations', help='Lista suas reservas de IPs (ou todas as reservas de uma faixa CIDR)')
+async def reservations_cmd(ctx, network_range=None):
+    await show_reservations(ctx.author, network_range, ctx.message)
+
+@bot.command(name='schedule', help='Gerencia varreduras agendadas: list | add <nome> <faixa> <cron> | remove <nome>')
+@commands.has_permissions(administrator=True)
+async def schedule_cmd(ctx, action="list", name=None, network_range=None, *cron_fields):
+    try:
+        if action == "list":
+            if not scan_schedules:
+                await ctx.send("📅 Nenhuma varredura agendada.")
+                return
+            lines = []
+            for schedule in scan_schedules.values():
+                status = "em execução" if schedule.running else "aguardando"
+                next_run = time.strftime('%d/%m %H:%M', time.localtime(schedule.next_run)) if schedule.next_run else "-"
+                lines.append(f"{schedule.name} [{schedule.profile}]: {schedule.network} às '{schedule.cron.expression}' (próxima: {next_run}, {status})")
+            await ctx.send("📅 **Varreduras agendadas**\n```\n" + '\n'.join(lines) + "\n```")
+        elif action == "add" and name and network_range and cron_fields:
+            profile = current_profile()
+            schedule = ScanSchedule(name, ' '.join(cron_fields), network_range, profile.name)
+            ensure_profile_allows(schedule.network)
+            schedule.schedule_next()
+            scan_schedules[name] = schedule
+            save_scan_schedules()
+            await ctx.send(f"✅ Agendamento '{name}' criado: {schedule.network} às '{schedule.cron.expression}'.")
+        elif action == "remove" and name:
+            if scan_schedules.pop(name, None):
+                save_scan_schedules()
+                await ctx.send(f"✅ Agendamento '{name}' removido.")
+            else:
+                await ctx.send(f"❌ Agendamento '{name}' não encontrado.")
+        else:
+            await ctx.send("❌ Uso: `!schedule list`, `!schedule add <nome> <faixa> <cron>` ou `!schedule remove <nome>`\n"
+                           "Exemplo: `!schedule add manha 10.0.0.0/22 0 7 * * 1-5`")
+    except (ValueError, PermissionError) as e:
+        await ctx.send(f"❌ Agendamento inválido: {str(e)}")
+    except Exception as e:
+        log_error("Erro ao gerenciar agendamentos", e)
+        await ctx.send(f"❌ Erro ao gerenciar agendamentos: {str(e)}")
+
+@bot.command(name='scan_subnet', help='Verifica IPs livres em uma sub-rede (opcional: aceitar resultados de até N minutos atrás)')
+async def scan_subnet_cmd(ctx, subnet_number, minutes=None):
     # Verificar se estamos em um DM
     is_dm = isinstance(ctx.channel, discord.DMChannel)
     
@@ -1181,72 +6154,57 @@ async def scan_subnet_cmd(ctx, subnet_number):
         # Converter para inteiro
         subnet = int(subnet_number)
         
-        # Verificar se está no intervalo válido para uma rede /22 (0-3)
-        if subnet < 0 or subnet > 3:
-            await ctx.send("❌ Para uma rede /22 (255.255.252.0), o número da sub-rede deve estar entre 0 e 3.")
+        profile = current_profile()
+        subnets = profile.subnets()
+        
+        # Verificar se está no intervalo válido para a rede do perfil (0-3 em uma /22)
+        if subnet < 0 or subnet > (len(subnets) - 1 if subnets else 3):
+            await ctx.send(f"❌ Para a rede {profile.default_network or '/22 (255.255.252.0)'}, o número da sub-rede deve estar entre 0 e {len(subnets) - 1 if subnets else 3}.")
             return
         
         # Construir o CIDR da sub-rede
-        network_cidr = f"{subnet}.0/24"
-        
-        # Mensagem inicial
-        msg = await ctx.send(f"🔍 Escaneando a sub-rede {network_cidr}. Isso pode levar algum tempo...")
+        network_cidr = str(subnets[subnet]) if subnets else f"{subnet}.0/24"
         
         # Verificar a rede
         network = ipaddress.ip_network(network_cidr, strict=False)
         
-        # Lista para armazenar IPs livres
-        free_ips = []
+        # Cobrar antecipadamente as sondagens estimadas (IPs sem resultado recente no inventário)
+        try:
+            charge_probes(ctx.author, ctx.guild, estimate_scan_cost(network, int(minutes) * 60 if minutes is not None else None))
+        except ProbeQuotaExceeded as e:
+            await ctx.send(str(e))
+            return
         
-        # Lista para armazenar erros de verificação
-        errors = []
+        # Mensagem inicial
+        msg = await ctx.send(f"🔍 Escaneando a sub-rede {network_cidr}. Isso pode levar algum tempo...")
         
-        # Para redes menores, vamos limitar o número de IPs verificados simultaneamente
-        batch_size = 25  # Verificar 25 IPs por vez (reduzido para não sobrecarregar)
+        # Resultados recentes do inventário + sondagem do restante
+        # Progresso e avisos vão para a fila de saída sem segurar a varredura; edições pendentes são substituídas
+        async def report_progress(text):
+            queue_edit(msg, f"🔍 Escaneando a sub-rede {network_cidr}: {text}")
         
-        all_ips = list(network.hosts())
-        total_batches = (len(all_ips) + batch_size - 1) // batch_size
+        async def report_error(text):
+            queue_send(ctx.channel, text, PRIORITY_NORMAL)
         
-        for batch_num in range(total_batches):
-            start_idx = batch_num * batch_size
-            end_idx = min((batch_num + 1) * batch_size, len(all_ips))
-            
-            # IPs a serem verificados neste lote
-            batch_ips = all_ips[start_idx:end_idx]
-            
-            # Tarefas para verificar os IPs do lote
-            tasks = [is_ip_available(ip) for ip in batch_ips]
-            
-            # Executar as tarefas do lote simultaneamente
-            try:
-                results = await asyncio.gather(*tasks)
-                
-                # Adicionar IPs livres à lista
-                batch_free_ips = [str(ip) for ip, is_free in zip(batch_ips, results) if is_free]
-                free_ips.extend(batch_free_ips)
-                
-                # Atualizar a mensagem de progresso
-                progress = min(100, int((end_idx) / len(all_ips) * 100))
-                await msg.edit(content=f"🔍 Escaneando a sub-rede {network_cidr}: {progress}% concluído... ({len(free_ips)} IPs livres encontrados até agora)")
-            except Exception as e:
-                error_msg = f"Erro ao verificar lote {batch_num+1}/{total_batches}: {str(e)}"
-                errors.append(error_msg)
-                log_error(error_msg, e)
-                await ctx.send(f"⚠️ Erro ao verificar alguns IPs no lote {batch_num+1}/{total_batches}. Continuando...")
-            
-            # Pequena pausa entre os lotes para não sobrecarregar
-            await asyncio.sleep(1.0)
+        max_age = int(minutes) * 60 if minutes is not None else None
+        checkpoint = ScanCheckpoint.start(network, ctx.author, max_age)
+        results, errors = await run_subnet_scan(network, report_progress, report_error, max_age, checkpoint)
+        # Os IPs reservados para outras pessoas são omitidos (a varredura não reserva nada)
+        free_ips, reserved_skipped = unreserved_ips(ctx.author, results.addresses(results.free()))
         
         # Verificar se encontramos IPs livres
         if free_ips:
             # Mensagem final no canal
-            await msg.edit(content=f"✅ Escaneamento concluído! Encontrados {len(free_ips)} IPs livres na sub-rede {network_cidr}. Os resultados foram enviados para sua mensagem privada.")
+            await queue_edit(msg, f"✅ Escaneamento concluído! Encontrados {len(free_ips)} IPs livres na sub-rede {network_cidr}. Os resultados foram enviados para sua mensagem privada.", PRIORITY_RESULT)
             
             # Adicionar mensagem sobre possíveis falsos positivos
             free_ips_text = '\n'.join(free_ips)
             if errors:
                 free_ips_text += "\n\n⚠️ ATENÇÃO: Ocorreram alguns erros durante a verificação que podem afetar a precisão dos resultados."
                 free_ips_text += "\nSempre confirme manualmente antes de usar um IP."
+            note = format_reservation_note(free_ips, reserved_skipped, claimed=False)
+            if note:
+                free_ips_text += f"\n\n{note}"
             
             # Enviar resultados por DM
             dm_success = await send_dm_results(
@@ -1258,7 +6216,7 @@ async def scan_subnet_cmd(ctx, subnet_number):
             if not dm_success:
                 await ctx.send("⚠️ Não foi possível enviar os resultados por mensagem privada. Verifique se suas DMs estão abertas.")
         else:
-            await msg.edit(content=f"❌ Nenhum IP livre encontrado na sub-rede {network_cidr}")
+            await queue_edit(msg, f"❌ Nenhum IP livre encontrado na sub-rede {network_cidr}" + (f" ({reserved_skipped} livres, mas reservados para outras pessoas)" if reserved_skipped else ""), PRIORITY_RESULT)
         
     
     except ValueError:
@@ -1266,21 +6224,60 @@ async def scan_subnet_cmd(ctx, subnet_number):
     except Exception as e:
         await ctx.send(f"❌ Erro ao escanear a sub-rede: {str(e)}")
 
-@bot.command(name='check_ip', help='Verifica se um IP específico está livre')
-async def check_ip_cmd(ctx, ip_address):
-    await check_ip(ctx.author, ip_address, ctx.message)
+@bot.command(name='check_ip', help='Verifica se um IP específico está livre (opcional: aceitar resultado de até N minutos atrás)')
+async def check_ip_cmd(ctx, ip_address, minutes=None):
+    try:
+        max_age = int(minutes) if minutes is not None else None
+    except ValueError:
+        await ctx.send("❌ Os minutos devem ser um número inteiro válido.")
+        return
+    await check_ip(ctx.author, ip_address, ctx.message, max_age)
 
-@bot.command(name='next_free', help='Encontra próximos IPs livres a partir de um endereço')
-async def next_free_cmd(ctx, start_ip, count="5"):
+@bot.command(name='next_free', help='Encontra próximos IPs livres a partir de um endereço (opcional: aceitar resultados de até N minutos atrás)')
+async def next_free_cmd(ctx, start_ip, count="5", minutes=None):
     try:
         count_num = int(count)
-        await find_next_free(ctx.author, start_ip, count_num, ctx.message)
+        max_age = int(minutes) if minutes is not None else None
+        await find_next_free(ctx.author, start_ip, count_num, ctx.message, max_age)
     except ValueError:
-        await ctx.send("❌ A quantidade deve ser um número inteiro válido.")
+        await ctx.send("❌ A quantidade e os minutos devem ser números inteiros válidos.")
+
+@bot.command(name='ip_details', help='Mostra detalhes de um IP, de uma lista de IPs ou de uma faixa CIDR')
+async def ip_details_cmd(ctx, *targets):
+    await ip_details(ctx.author, ' '.join(targets), ctx.message)
 
-@bot.command(name='ip_details', help='Mostra detalhes completos sobre um IP')
-async def ip_details_cmd(ctx, ip_address):
-    await ip_details(ctx.author, ip_address, ctx.message)
+@bot.command(name='fingerprint', help='Identifica serviços (SSH, HTTP, TLS) dos hosts em uso de um IP, uma lista ou uma faixa CIDR')
+async def fingerprint_cmd(ctx, *targets):
+    await fingerprint_targets(ctx.author, ' '.join(targets), ctx.message)
+
+@bot.command(name='ipv6_scan', help='Descobre vizinhos IPv6 (ping multicast ff02::1 + tabela NDP)')
+async def ipv6_scan_cmd(ctx, interface=None):
+    interface = interface or IPV6_INTERFACE
+    if not interface:
+        await queue_send(ctx.channel, "❌ Nenhuma interface configurada para a descoberta IPv6. Informe a interface (ex: `!ipv6_scan eth0`) ou configure IPV6_INTERFACE.", PRIORITY_RESULT)
+        return
+    try:
+        # Um ping multicast; conta como uma sondagem
+        charge_probes(ctx.author, ctx.guild, 1)
+        msg = await queue_send(ctx.channel, f"🔍 Descobrindo vizinhos IPv6 na interface {interface}...", PRIORITY_PROGRESS)
+        neighbors = await discover_ipv6_neighbors(interface)
+        if not neighbors:
+            await queue_edit(msg, f"❌ Nenhum vizinho IPv6 encontrado na interface {interface}", PRIORITY_RESULT)
+            return
+        lines = []
+        for entry in neighbors:
+            vendor = lookup_vendor(entry["mac_address"]) or ''
+            lines.append(f"{entry['ip']:<39} {entry['mac_address'] or '-':<17} {entry['state']:<10} {vendor}".rstrip())
+        dm_success = await send_dm_results(ctx.author, f"Vizinhos IPv6 em {interface}", '\n'.join(lines))
+        if dm_success:
+            await queue_edit(msg, f"✅ {len(neighbors)} vizinhos IPv6 encontrados em {interface}. Os resultados foram enviados para sua mensagem privada.", PRIORITY_RESULT)
+        else:
+            await queue_edit(msg, "⚠️ Não foi possível enviar os resultados por mensagem privada. Verifique se suas DMs estão abertas.", PRIORITY_RESULT)
+    except ProbeQuotaExceeded as e:
+        await queue_send(ctx.channel, str(e), PRIORITY_RESULT)
+    except Exception as e:
+        log_error(f"Erro na descoberta IPv6 em {interface}", e)
+        await queue_send(ctx.channel, f"❌ Erro na descoberta IPv6: {str(e)}", PRIORITY_RESULT)
 
 @bot.command(name='network_info', help='Mostra informações da rede')
 async def network_info_cmd(ctx):
@@ -1288,15 +6285,16 @@ async def network_info_cmd(ctx):
     is_dm = isinstance(ctx.channel, discord.DMChannel)
     
     try:
-        # Obter informações da rede padrão
-        network = ipaddress.ip_network(DEFAULT_NETWORK, strict=False)
+        # Obter informações da rede do perfil deste servidor
+        profile = current_profile()
+        network = ipaddress.ip_network(profile.default_network, strict=False)
         
         # Calcular informações da rede
         info = f"""
 📊 **Informações da Rede**
 
-🌐 **Rede:** {DEFAULT_NETWORK}
-🔑 **Gateway:** {DEFAULT_GATEWAY}
+🌐 **Rede:** {', '.join(str(net) for net in profile.networks)}
+🔑 **Gateway:** {profile.gateway}
 🎭 **Máscara:** {network.netmask} (/{network.prefixlen})
 📍 **Endereço de Rede:** {network.network_address}
 📡 **Endereço de Broadcast:** {network.broadcast_address}
@@ -1306,38 +6304,102 @@ async def network_info_cmd(ctx):
 **Comandos CMD equivalentes:**
 
 ipconfig /all                        (ver configuração de rede)
-nslookup {DEFAULT_GATEWAY}           (resolver DNS do gateway)
-tracert {DEFAULT_GATEWAY}            (traçar rota até o gateway)
+nslookup {profile.gateway}           (resolver DNS do gateway)
+tracert {profile.gateway}            (traçar rota até o gateway)
 
 """
         # Enviar informações no canal
-        await ctx.send(info)
+        await queue_send(ctx.channel, info, PRIORITY_RESULT)
         
         # Enviar também por DM
         try:
-            await ctx.author.send(info)
+            await queue_send(ctx.author, info, PRIORITY_RESULT)
         except Exception as e:
             log_error("Erro ao enviar informações da rede por DM", e)
-            await ctx.send("⚠️ Não foi possível enviar as informações por mensagem privada. Verifique se suas DMs estão abertas.")
+            await queue_send(ctx.channel, "⚠️ Não foi possível enviar as informações por mensagem privada. Verifique se suas DMs estão abertas.", PRIORITY_RESULT)
     
     except Exception as e:
-        await ctx.send(f"❌ Erro ao obter informações da rede: {str(e)}")
+        await queue_send(ctx.channel, f"❌ Erro ao obter informações da rede: {str(e)}", PRIORITY_RESULT)
+
+# Função para calcular o hash da árvore de comandos slash
+def command_tree_hash():
+    """Hash estável dos comandos slash globais e da aplicação, para saber se é preciso sincronizar"""
+    payload = []
+    for command in bot.tree.get_commands():
+        try:
+            payload.append(command.to_dict(bot.tree))
+        except TypeError:
+            # discord.py < 2.4 não recebe a árvore em to_dict
+            payload.append(command.to_dict())
+    payload.sort(key=lambda item: (item.get("type", 1), item.get("name", "")))
+    data = json.dumps({"application": bot.application_id, "commands": payload}, sort_keys=True, default=str)
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+# Função para sincronizar os comandos slash apenas quando a árvore mudou
+async def sync_command_tree():
+    """Sincroniza os comandos slash se o hash diferir do gravado na última sincronização"""
+    current = command_tree_hash()
+    try:
+        with open(COMMAND_SYNC_STATE, 'r') as f:
+            stored = f.read().strip()
+    except OSError:
+        stored = None
+    if stored == current and not FORCE_COMMAND_SYNC:
+        print("Comandos slash inalterados, sincronização ignorada")
+        return
+
+    synced = await bot.tree.sync()
+    print(f"Sincronizados {len(synced)} comandos")
+    try:
+        with open(COMMAND_SYNC_STATE, 'w') as f:
+            f.write(current)
+    except OSError as e:
+        log_error(f"Não foi possível gravar {COMMAND_SYNC_STATE}", e)
+
+# Inicialização feita uma única vez por processo (on_ready dispara de novo a cada reconexão)
+startup_done = False
 
 @bot.event
 async def on_ready():
+    global startup_done
+    if startup_done:
+        if DEBUG_MODE:
+            print(f'{bot.user.name} reconectado ao Discord')
+        return
+    startup_done = True
+    
     print(f'{bot.user.name} está conectado ao Discord!')
-    print(f'Configurado para rede padrão: {DEFAULT_NETWORK}')
+    print(f'Configurado para rede padrão: {current_profile().default_network}')
+    if len(network_profiles) > 1:
+        print(f'Perfis de rede: {", ".join(network_profiles)}')
     print(f'Debug mode: {"ATIVADO" if DEBUG_MODE else "DESATIVADO"}')
     
     if check_dependencies():
         print("✅ Todas as dependências estão instaladas")
     
     try:
-        synced = await bot.tree.sync()
-        print(f"Sincronizados {len(synced)} comandos")
+        await sync_command_tree()
     except Exception as e:
         log_error("Erro ao sincronizar comandos slash", e)
         print("ERRO: Não foi possível sincronizar os comandos slash")
+    
+    # Descoberta passiva de dispositivos (ARP/DHCP)
+    start_passive_discovery()
+    
+    # Leases DHCP e planilhas do IPAM (atribuições conhecidas sem sondagem)
+    start_assignment_sources()
+    
+    # Varreduras agendadas
+    start_scan_scheduler()
+    
+    # API HTTP de inventário
+    await start_inventory_api()
+    
+    # Gravação periódica do snapshot de estado
+    start_warm_snapshots()
+    
+    # Varreduras interrompidas pelo último reinício
+    resume_scan_jobs()
 
 
 @bot.event
@@ -1345,79 +6407,28 @@ async def on_message(message):
     if message.author == bot.user:
         return
     
+    # Perfil de rede do servidor/canal (DMs usam o perfil padrão); vale para os comandos abaixo
+    use_profile(message.guild, message.channel)
+    
     if message.content.startswith("!"):
         await bot.process_commands(message)
         return
 
-    if message.reference and message.reference.resolved:
-        ref_msg = message.reference.resolved
-
-        if ref_msg.author == bot.user:
-            try:
-                if DEBUG_MODE:
-                    print(f"\nUsuário {message.author.name} respondeu a uma mensagem do bot")
-                    print(f"Conteúdo da resposta: {message.content}")
-                    print(f"Conteúdo da mensagem original: {ref_msg.content}")
-
-                if "Verificação de IP Específico" in ref_msg.content or "digite abaixo o IP que deseja verificar" in ref_msg.content:
-                    # Extrair o IP da mensagem
-                    ip_address = message.content.strip()
-                    
-                    if DEBUG_MODE:
-                        print(f"Detectada resposta para verificação de IP: {ip_address}")
-                    
-                    # Verificar o IP
-                    await check_ip(message.author, ip_address, message)
-                    
-                    # Tentar deletar a mensagem do usuário para manter a privacidade
-                    try:
-                        await message.delete()
-                    except Exception as e:
-                        log_error("Erro ao deletar mensagem do usuário", e)
-                
-                # Verificar se é uma resposta para obter detalhes de IP
-                elif "Detalhar IP e Hostname" in ref_msg.content or "digite abaixo o IP que deseja analisar" in ref_msg.content:
-                    # Extrair o IP da mensagem
-                    ip_address = message.content.strip()
-                    
-                    if DEBUG_MODE:
-                        print(f"Detectada resposta para detalhes de IP: {ip_address}")
-                    
-                    # Obter detalhes do IP
-                    await ip_details(message.author, ip_address, message)
-                    
-                    # Tentar deletar a mensagem do usuário para manter a privacidade
-                    try:
-                        await message.delete()
-                    except Exception as e:
-                        log_error("Erro ao deletar mensagem do usuário", e)
-                
-                # Verificar se é uma resposta para encontrar próximos IPs livres
-                elif "Encontrar Próximos IPs Livres" in ref_msg.content or "digite abaixo o IP inicial e quantidade" in ref_msg.content:
-                    # Extrair o IP e quantidade da mensagem
-                    parts = message.content.strip().split()
-                    
-                    if DEBUG_MODE:
-                        print(f"Detectada resposta para próximos IPs livres: {message.content}")
-                    
-                    if len(parts) >= 1:
-                        ip = parts[0]
-                        count = 5
-                        if len(parts) > 1 and parts[1].isdigit():
-                            count = int(parts[1])
-                        
-                        # Encontrar próximos IPs livres
-                        await find_next_free(message.author, ip, count, message)
-                    
-                    # Tentar deletar a mensagem do usuário para manter a privacidade
-                    try:
-                        await message.delete()
-                    except Exception as e:
-                        log_error("Erro ao deletar mensagem do usuário", e)
-            
-            except Exception as e:
-                log_error("Erro ao processar resposta do usuário", e)
-                await message.channel.send(f"❌ Erro ao processar sua mensagem: {str(e)}")
+    if message.reference is None or message.reference.message_id is None:
+        return
+    
+    # Resposta a um prompt do bot: busca direta no registro de conversas
+    session = reply_sessions.get(message.reference.message_id, message.author.id)
+    if session is None:
+        return
+    kind, profile = session
+    if profile is not None:
+        active_profile.set(profile)
+    try:
+        await handle_reply(kind, message)
+    except Exception as e:
+        log_error("Erro ao processar resposta do usuário", e)
+        await queue_send(message.channel, f"❌ Erro ao processar sua mensagem: {str(e)}", PRIORITY_RESULT)
 
 
 # Comando slash principal
@@ -1462,6 +6473,10 @@ def main():
     print(f"Sistema: {platform.system()} {platform.release()}")
     if check_dependencies():
         print("✅ Todas as dependências estão instaladas")
+    # Perfis de rede e estado da última execução, antes de conectar
+    load_network_profiles()
+    for profile in network_profiles.values():
+        load_warm_snapshot(profile)
     print("Conectando ao Discord...")
     try:
         bot.run(TOKEN)
@@ -1470,6 +6485,15 @@ def main():
         print("\n❌ Não foi possível iniciar o bot. Verifique o token e a conexão com a internet.")
         if TOKEN is None or TOKEN == "":
             print("   O token do Discord não foi encontrado. Verifique o arquivo .env ou defina o token diretamente no código.")
+    finally:
+        # Gravar o snapshot de estado e os resultados pendentes dos inventários antes de sair
+        save_warm_snapshots()
+        for profile in network_profiles.values():
+            profile.close()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    if len(sys.argv) >= 4 and sys.argv[1] == "--build-oui":
+        total = build_oui_index(sys.argv[3:], sys.argv[2])
+        print(f"✅ Índice OUI gerado em {sys.argv[2]} com {total} prefixos")
+    else:
+        main()
\ No newline at end of file
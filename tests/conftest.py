@@ -0,0 +1,10 @@
+import os
+import sys
+
+# Os testes não tocam nos arquivos de estado ao lado do nettracker.py
+os.environ.setdefault('INVENTORY_DB_PATH', '')
+os.environ.setdefault('WARM_SNAPSHOT_PATH', '')
+os.environ.setdefault('SCHEDULE_FILE', '')
+os.environ.setdefault('PROFILES_FILE', '')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
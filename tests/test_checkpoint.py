@@ -0,0 +1,25 @@
+import ipaddress
+
+import nettracker
+
+
+def test_scan_checkpoint_resumes_from_store(tmp_path):
+    store = nettracker.open_inventory_store(str(tmp_path / "inventory.db"))
+    network = ipaddress.ip_network("10.0.0.0/22")
+    job_id = store.create_scan_job(network, 42, 300)
+    checkpoint = nettracker.ScanCheckpoint(store, job_id, network, 42, 300)
+    checkpoint.update({"10.0.0.0": True, "10.0.0.9": False, "10.0.3.255": True})
+    checkpoint.update({"10.0.0.9": False})
+    checkpoint.save()
+    assert checkpoint.completed == 3
+
+    row, = store.pending_scan_jobs()
+    resumed = nettracker.ScanCheckpoint.from_row(store, row)
+    assert (resumed.job_id, resumed.network, resumed.user_id, resumed.max_age) == (job_id, network, 42, 300)
+    assert resumed.completed == 3
+    assert resumed.results() == {"10.0.0.0": True, "10.0.0.9": False, "10.0.3.255": True}
+    assert len(row["done"]) == network.num_addresses // 8
+
+    resumed.finish()
+    assert store.pending_scan_jobs() == []
+    store.close()
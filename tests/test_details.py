@@ -0,0 +1,31 @@
+import nettracker
+
+
+def details(ip):
+    return {"ip": ip, "status": "em uso (ping)", "responde_ping": True,
+            "mac_address": None, "vendor": None, "hostname": "host"}
+
+
+def test_details_rows_align_on_widest_address():
+    ips = ["10.0.0.1", "2001:db8::1:2:3:4"]
+    width = max(len(ip) for ip in ips)
+    rows = [nettracker.format_details_row(details(ip), width) for ip in ips]
+    assert rows[0].index("em") == rows[1].index("em") == width + 1
+    assert nettracker.format_details_row(details("10.0.0.1")).startswith("10.0.0.1        em")
+
+
+def test_parse_arp_output_linux_and_windows():
+    linux = (
+        "Address                  HWtype  HWaddress           Flags Mask            Iface\n"
+        "10.0.0.1                 ether   00:11:22:33:44:55   C                     eth0\n"
+        "10.0.0.9                         (incomplete)                              eth0\n"
+    )
+    windows = (
+        "Interface: 10.0.0.50 --- 0xb\n"
+        "  Internet Address      Physical Address      Type\n"
+        "  10.0.0.1              00-11-22-33-44-55     dynamic\n"
+    )
+    entries = nettracker.parse_arp_output(linux)
+    assert entries["10.0.0.1"]["mac_address"] == "00:11:22:33:44:55"
+    assert entries["10.0.0.9"]["state"] == "INCOMPLETE"
+    assert nettracker.parse_arp_output(windows)["10.0.0.1"]["state"] == "REACHABLE"
@@ -0,0 +1,24 @@
+import base64
+
+import nettracker
+
+
+# Certificado autoassinado (O=ACME Corp, OU=Lab, CN=printer.lab)
+CERTIFICATE_DER = base64.b64decode(
+    "MIIBxTCCAWugAwIBAgIUBKwW9ULs4E2WBoxJkIiPXa970DYwCgYIKoZIzj0EAwIwODESMBAGA1UECgwJQUNNRSBDb3JwMQwwCgYDVQQL"
+    "DANMYWIxFDASBgNVBAMMC3ByaW50ZXIubGFiMB4XDTI2MTAxOTA1NDQyMVoXDTM2MTAxNjA1NDQyMVowODESMBAGA1UECgwJQUNNRSBD"
+    "b3JwMQwwCgYDVQQLDANMYWIxFDASBgNVBAMMC3ByaW50ZXIubGFiMFkwEwYHKoZIzj0CAQYIKoZIzj0DAQcDQgAE8PBT6banELMNMNQO"
+    "uCOhK6ln9SrGd/mqC8IVcbRpV9I0XaKweNmuvaJQGxs+p6KCCLws74VHjDyxTPhFZYC5jKNTMFEwHQYDVR0OBBYEFI4+SBRJk/cs5M4i"
+    "+60MoyUUSPdDMB8GA1UdIwQYMBaAFI4+SBRJk/cs5M4i+60MoyUUSPdDMA8GA1UdEwEB/wQFMAMBAf8wCgYIKoZIzj0EAwIDSAAwRQIh"
+    "ANL7Iw3LEk6wRM2M8TlV2v4VCOSukLcG7zBggMT/a0uhAiBW7Ova7gzirs/MvB3dEolGmMfq4jJcs8thfP8yZ6qNdg=="
+)
+
+
+def test_certificate_subject():
+    assert nettracker.certificate_subject(CERTIFICATE_DER) == "O=ACME Corp, OU=Lab, CN=printer.lab"
+
+
+def test_parse_http_banner():
+    response = b"HTTP/1.1 200 OK\r\nServer: nginx/1.24\r\n\r\n<html><title>  Painel\n da Impressora </title>"
+    assert nettracker.parse_http_banner(response) == 'nginx/1.24 "Painel da Impressora"'
+    assert nettracker.parse_http_banner(b"SSH-2.0-OpenSSH_9.6\r\n") is None
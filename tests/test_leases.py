@@ -0,0 +1,45 @@
+import nettracker
+
+
+def test_parse_dnsmasq_leases():
+    text = (
+        "1760864400 aa:bb:cc:dd:ee:01 10.0.1.5 pc1 01:aa:bb:cc:dd:ee:01\n"
+        "0 aa:bb:cc:dd:ee:02 10.0.1.6 * *\n"
+        "duid 00:01:00:01:2c:aa:bb:cc\n"
+        "1760864400 12345678 2001:db8::5 pc6 00:01:00:01\n"
+    )
+    leases = nettracker.parse_dnsmasq_leases(text)
+    assert [(l["ip"], l["mac_address"], l["hostname"], l["expires"]) for l in leases] == [
+        ("10.0.1.5", "aa:bb:cc:dd:ee:01", "pc1", 1760864400),
+        ("10.0.1.6", "aa:bb:cc:dd:ee:02", None, None),
+        ("2001:db8::5", None, "pc6", 1760864400),
+    ]
+
+
+def test_parse_isc_leases():
+    text = """\
+authoring-byte-order little-endian;
+
+lease 10.0.2.10 {
+  starts 4 2024/01/01 10:00:00;
+  ends 4 2099/01/01 22:00:00;
+  binding state active;
+  hardware ethernet 00:11:22:33:44:55;
+  client-hostname "printer";
+}
+lease 10.0.2.11 {
+  ends never;
+  binding state free;
+}
+lease 10.0.2.12 {
+  ends epoch 4070988000; # Thu Jan 01 22:00:00 2099
+  binding state abandoned;
+}
+"""
+    leases = nettracker.parse_isc_leases(text)
+    assert [(l["ip"], l["active"], l["expires"]) for l in leases] == [
+        ("10.0.2.10", True, 4070988000),
+        ("10.0.2.11", False, None),
+        ("10.0.2.12", True, 4070988000.0),
+    ]
+    assert (leases[0]["mac_address"], leases[0]["hostname"]) == ("00:11:22:33:44:55", "printer")
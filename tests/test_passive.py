@@ -0,0 +1,91 @@
+import socket
+import struct
+
+import pytest
+
+import nettracker
+
+
+# Quadros Ethernet/ARP/DHCP
+MAC = bytes.fromhex("001122334455")
+
+
+def ethernet(ethertype, payload, vlan=None):
+    header = b'\xff' * 6 + MAC
+    if vlan is not None:
+        header += struct.pack('!HH', 0x8100, vlan)
+    return header + struct.pack('!H', ethertype) + payload
+
+
+def arp_packet(sender_ip, op=2):
+    return struct.pack('!HHBBH', 1, 0x0800, 6, 4, op) + MAC + socket.inet_aton(sender_ip) + b'\x00' * 6 + socket.inet_aton("10.0.0.254")
+
+
+def dhcp_packet(op, message_type, ciaddr="0.0.0.0", yiaddr="0.0.0.0", requested=None, hostname=b"impressora"):
+    packet = bytearray(240)
+    packet[0] = op
+    packet[12:16] = socket.inet_aton(ciaddr)
+    packet[16:20] = socket.inet_aton(yiaddr)
+    packet[28:34] = MAC
+    packet[236:240] = b'\x63\x82\x53\x63'
+    packet += bytes([53, 1, message_type])
+    if requested:
+        packet += bytes([50, 4]) + socket.inet_aton(requested)
+    packet += bytes([12, len(hostname)]) + hostname + b'\xff'
+    return bytes(packet)
+
+
+def udp_ipv4(payload, src_port=68, dst_port=67):
+    udp = struct.pack('!HHHH', src_port, dst_port, 8 + len(payload), 0) + payload
+    ip = struct.pack('!BBHHHBBH4s4s', 0x45, 0, 20 + len(udp), 0, 0, 64, 17, 0, b'\x00' * 4, b'\xff' * 4)
+    return ip + udp
+
+
+def test_parse_arp_packet():
+    assert nettracker.parse_arp_packet(arp_packet("10.0.0.5")) == ("10.0.0.5", "00:11:22:33:44:55")
+    # ARP probe (RFC 5227): remetente 0.0.0.0
+    assert nettracker.parse_arp_packet(arp_packet("0.0.0.0", op=1)) is None
+
+
+@pytest.mark.parametrize("op, message_type, kwargs, expected", [
+    (2, 5, {"yiaddr": "10.0.0.10"}, "10.0.0.10"),        # ACK do servidor
+    (1, 3, {"ciaddr": "10.0.0.11"}, "10.0.0.11"),        # REQUEST de renovação
+    (1, 8, {"ciaddr": "10.0.0.12"}, "10.0.0.12"),        # INFORM
+    (1, 3, {"requested": "10.0.0.13"}, None),            # REQUEST só com a opção 50
+    (1, 1, {"requested": "10.0.0.14"}, None),            # DISCOVER
+    (1, 4, {"requested": "10.0.0.15"}, None),            # DECLINE
+    (1, 7, {"ciaddr": "10.0.0.16"}, None),               # RELEASE
+])
+def test_parse_dhcp_packet_message_types(op, message_type, kwargs, expected):
+    sighting = nettracker.parse_dhcp_packet(dhcp_packet(op, message_type, **kwargs))
+    if expected is None:
+        assert sighting is None
+    else:
+        assert sighting == (expected, "00:11:22:33:44:55", "impressora")
+
+
+def test_replay_pcap(tmp_path):
+    frames = [
+        ethernet(0x0806, arp_packet("10.0.0.5")),
+        ethernet(0x0806, arp_packet("10.0.0.6"), vlan=10),
+        ethernet(0x0800, udp_ipv4(dhcp_packet(2, 5, yiaddr="10.0.0.7"), 67, 68)),
+        ethernet(0x0800, udp_ipv4(dhcp_packet(1, 1, requested="10.0.0.8"))),
+    ]
+    data = struct.pack('<IHHiIII', 0xa1b2c3d4, 2, 4, 0, 0, 65535, 1)
+    for index, frame in enumerate(frames):
+        data += struct.pack('<IIII', 1760860800 + index, 500000, len(frame), len(frame)) + frame
+    path = tmp_path / "captura.pcap"
+    path.write_bytes(data)
+
+    target = nettracker.NetworkInventory()
+    assert nettracker.replay_pcap(str(path), target) == 3
+    assert set(target.hosts) == {"10.0.0.5", "10.0.0.6", "10.0.0.7"}
+    assert target.get("10.0.0.7")["hostname"] == "impressora"
+    assert target.get("10.0.0.5")["last_seen"] == 1760860800.5
+
+
+def test_replay_pcap_rejects_pcapng(tmp_path):
+    path = tmp_path / "captura.pcapng"
+    path.write_bytes(b'\x0a\x0d\x0d\x0a' + b'\x00' * 28)
+    with pytest.raises(ValueError):
+        nettracker.replay_pcap(str(path), nettracker.NetworkInventory())
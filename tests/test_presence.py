@@ -0,0 +1,11 @@
+import zlib
+
+import nettracker
+
+
+def test_presence_chunk_roundtrip():
+    intervals = [[10, 50], [300, 4000], [80000, 86399]]
+    blob = nettracker.encode_presence_chunk(intervals, True)
+    assert nettracker.decode_presence_chunk(blob) == (intervals, True)
+    # Linhas gravadas antes eram comprimidas com zlib
+    assert nettracker.decode_presence_chunk(zlib.compress(blob)) == (intervals, True)
@@ -0,0 +1,24 @@
+import json
+
+import nettracker
+
+
+def test_padrao_entry_keeps_assignment_sources(tmp_path, monkeypatch):
+    monkeypatch.setattr(nettracker, "DHCP_LEASE_FILES", "/var/lib/misc/dnsmasq.leases")
+    monkeypatch.setattr(nettracker, "IPAM_CSV_FILES", "/srv/ipam/servidores.csv")
+    monkeypatch.setattr(nettracker, "default_profile", nettracker.default_profile)
+    monkeypatch.setattr(nettracker, "inventory", nettracker.inventory)
+    monkeypatch.setattr(nettracker, "network_profiles", {})
+    monkeypatch.setattr(nettracker, "guild_profiles", {})
+    monkeypatch.setattr(nettracker, "channel_profiles", {})
+    path = tmp_path / "profiles.json"
+    path.write_text(json.dumps([{"name": nettracker.DEFAULT_PROFILE_NAME, "concurrency": 4}]))
+
+    nettracker.load_network_profiles(str(path))
+
+    profile = nettracker.default_profile
+    assert profile.concurrency == 4
+    assert [(type(source).__name__, source.path) for source in profile.assignment_sources] == [
+        ("LeaseFileSource", "/var/lib/misc/dnsmasq.leases"),
+        ("IpamCsvSource", "/srv/ipam/servidores.csv"),
+    ]
@@ -0,0 +1,58 @@
+import pytest
+
+import nettracker
+
+
+class Member:
+    def __init__(self, member_id):
+        self.id = member_id
+
+
+def test_token_bucket_charge_and_refund():
+    bucket = nettracker.TokenBucket(2, 10)
+    now = bucket.updated
+    assert bucket.wait_time(10, now) == 0
+    bucket.consume(10)
+    assert bucket.wait_time(4, now) == 2.0
+    assert bucket.wait_time(4, now + 2) == 0
+    bucket.refund(100)
+    assert bucket.tokens == 10
+    # Pedido maior que a rajada: o saldo fica negativo e o próximo espera o balde encher de novo
+    bucket.consume(25)
+    assert bucket.wait_time(1, now + 2) == 8.0
+    assert bucket.wait_time(25, now + 2) == 12.5
+
+
+def test_probe_quotas_charge_both_buckets():
+    quotas = nettracker.ProbeQuotas(0.001, 10, 0.001, 20)
+    assert quotas.charge(1, 99, 8) == (0, None)
+    wait, kind = quotas.charge(1, 99, 5)
+    assert wait > 0 and kind == "usuario"
+    quotas.refund(1, 99, 3)
+    assert quotas.charge(1, 99, 5) == (0, None)
+    # A cobrança recusada não tirou fichas do servidor: restam 20 - 8 + 3 - 5
+    assert quotas.charge(2, 99, 10) == (0, None)
+    assert quotas.charge(3, 99, 1)[1] == "servidor"
+    # Sem servidor (DM) só o balde do usuário conta
+    assert quotas.charge(3, None, 1) == (0, None)
+
+
+def test_zero_rate_is_unlimited():
+    quotas = nettracker.ProbeQuotas(0, 1, 0, 1)
+    assert quotas.charge(1, 99, 1000) == (0, None)
+    assert quotas.buckets == {}
+
+
+def test_charge_probes_uses_active_profile():
+    profile = nettracker.NetworkProfile("filial", user_rate=0.5, user_burst=4, guild_rate=0)
+    token = nettracker.active_profile.set(profile)
+    try:
+        nettracker.charge_probes(Member(1), Member(99), 4)
+        with pytest.raises(nettracker.ProbeQuotaExceeded) as error:
+            nettracker.charge_probes(Member(1), Member(99), 2)
+        assert error.value.kind == "usuario"
+        assert error.value.retry_after == 4
+        nettracker.refund_probes(Member(1), Member(99), 2)
+        nettracker.charge_probes(Member(1), Member(99), 2)
+    finally:
+        nettracker.active_profile.reset(token)
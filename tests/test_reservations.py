@@ -0,0 +1,59 @@
+import time
+
+import nettracker
+
+
+class User:
+    def __init__(self, user_id, name):
+        self.id = user_id
+        self.name = name
+
+    def __str__(self):
+        return self.name
+
+
+ALICE = User(1, "alice")
+BOB = User(2, "bob")
+
+
+def test_claim_skips_ips_held_by_someone_else():
+    ledger = nettracker.ReservationLedger()
+    assert ledger.claim(["10.0.0.5", "10.0.0.6"], ALICE, ttl=60) == ["10.0.0.5", "10.0.0.6"]
+    assert ledger.claim(["10.0.0.5", "10.0.0.7"], BOB, ttl=60) == ["10.0.0.7"]
+    assert ledger.is_reserved("10.0.0.5", BOB.id)
+    assert not ledger.is_reserved("10.0.0.5", ALICE.id)
+    assert ledger.holder("10.0.0.8") is None
+    assert ledger.release(ALICE, ["10.0.0.5", "10.0.0.7"]) == ["10.0.0.5"]
+    assert ledger.claim(["10.0.0.5"], BOB, ttl=60) == ["10.0.0.5"]
+
+
+def test_expiry_heap_ignores_renewed_and_confirmed(monkeypatch):
+    monkeypatch.setattr(nettracker, "RESERVATION_CONFIRM_TTL", 0)
+    ledger = nettracker.ReservationLedger()
+    ledger.claim(["10.0.0.5", "10.0.0.6", "10.0.0.7"], ALICE, ttl=60)
+    # Renovada: o vencimento antigo continua no heap e precisa ser descartado
+    ledger.claim(["10.0.0.5"], ALICE, ttl=600)
+    ledger.confirm(["10.0.0.6"], ALICE)
+    generation = ledger.generation
+
+    ledger.expire(time.time() + 120)
+    assert sorted(ledger.entries) == ["10.0.0.5", "10.0.0.6"]
+    assert ledger.holder("10.0.0.7") is None
+    assert ledger.generation == generation + 1
+
+    ledger.expire(time.time() + 1200)
+    assert list(ledger.entries) == ["10.0.0.6"]
+    assert ledger.holder("10.0.0.6").confirmed
+
+
+def test_reservations_survive_reload(tmp_path):
+    store = nettracker.open_inventory_store(str(tmp_path / "inventory.db"))
+    ledger = nettracker.ReservationLedger(store)
+    ledger.claim(["10.0.0.5"], ALICE, ttl=60)
+    ledger.claim(["10.0.0.6"], BOB, ttl=60)
+    ledger.release(BOB)
+
+    reloaded = nettracker.ReservationLedger(store)
+    assert list(reloaded.entries) == ["10.0.0.5"]
+    assert reloaded.is_reserved("10.0.0.5", BOB.id)
+    store.close()
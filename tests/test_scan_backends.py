@@ -0,0 +1,102 @@
+import pytest
+
+import nettracker
+
+
+# Saídas gravadas das ferramentas de varredura
+FPING_OUTPUT = """\
+10.0.0.1
+10.0.0.7
+ICMP Host Unreachable from 10.0.0.254 for ICMP Echo sent to 10.0.0.9
+10.0.0.254
+"""
+
+NMAP_OUTPUT = """\
+<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE nmaprun>
+<nmaprun scanner="nmap" args="nmap -sn -n -oX - 10.0.0.0/29" start="1760860800" version="7.94" xmloutputversion="1.05">
+<verbose level="0"/>
+<debugging level="0"/>
+<host><status state="up" reason="arp-response" reason_ttl="0"/>
+<address addr="10.0.0.1" addrtype="ipv4"/>
+<address addr="00:11:22:33:44:55" addrtype="mac" vendor="Cisco"/>
+<hostnames>
+</hostnames>
+<times srtt="312" rttvar="5000" to="100000"/>
+</host>
+<host><status state="down" reason="no-response" reason_ttl="0"/>
+<address addr="10.0.0.2" addrtype="ipv4"/>
+</host>
+<host><status state="up" reason="echo-reply" reason_ttl="64"/>
+<address addr="10.0.0.3" addrtype="ipv4"/>
+<hostnames>
+</hostnames>
+</host>
+<runstats><finished time="1760860802" timestr="Sun Oct 19 08:00:02 2025" elapsed="2.05" summary="Nmap done at Sun Oct 19 08:00:02 2025; 8 IP addresses (2 hosts up) scanned in 2.05 seconds" exit="success"/><hosts up="2" down="6" total="8"/>
+</runstats>
+</nmaprun>
+"""
+
+ARP_SCAN_OUTPUT = (
+    "10.0.0.1\t00:11:22:33:44:55\tCisco Systems, Inc\n"
+    "10.0.0.20\tAA:BB:CC:DD:EE:FF\t(Unknown)\n"
+    "10.0.0.20\taa:bb:cc:dd:ee:ff\t(Unknown) (DUP: 2)\n"
+)
+
+
+def feed_lines(backend, output):
+    found = []
+    for line in output.splitlines(keepends=True):
+        found.extend(backend.feed(line))
+    return found
+
+
+def test_scan_backend_is_abstract():
+    with pytest.raises(TypeError):
+        nettracker.ScanBackend()
+
+
+def test_fping_feed():
+    assert feed_lines(nettracker.FpingBackend(), FPING_OUTPUT) == [
+        ("10.0.0.1", None), ("10.0.0.7", None), ("10.0.0.254", None)
+    ]
+
+
+def test_fping_command_uses_generator_for_cidr():
+    backend = nettracker.FpingBackend()
+    assert '-g' in backend.command(["10.0.0.0/24"])
+    assert '-g' not in backend.command(["10.0.0.1", "10.0.0.2"])
+
+
+def test_nmap_feed():
+    assert feed_lines(nettracker.NmapBackend(), NMAP_OUTPUT) == [
+        ("10.0.0.1", "00:11:22:33:44:55"), ("10.0.0.3", None)
+    ]
+
+
+def test_nmap_instances_do_not_share_parser():
+    # Cada execução precisa de um parser XML novo: o anterior já leu um documento inteiro
+    first = nettracker.NmapBackend()
+    feed_lines(first, NMAP_OUTPUT)
+    assert feed_lines(nettracker.NmapBackend(), NMAP_OUTPUT) == [
+        ("10.0.0.1", "00:11:22:33:44:55"), ("10.0.0.3", None)
+    ]
+
+
+def test_arp_scan_feed():
+    assert feed_lines(nettracker.ArpScanBackend(), ARP_SCAN_OUTPUT) == [
+        ("10.0.0.1", "00:11:22:33:44:55"),
+        ("10.0.0.20", "aa:bb:cc:dd:ee:ff"),
+        ("10.0.0.20", "aa:bb:cc:dd:ee:ff"),
+    ]
+
+
+def test_arp_scan_uses_profile_interface():
+    assert '--interface' not in nettracker.ArpScanBackend().command(["10.0.0.0/24"])
+    profile = nettracker.NetworkProfile("filial", passive_interface="eth9")
+    token = nettracker.active_profile.set(profile)
+    try:
+        command = nettracker.ArpScanBackend().command(["10.0.0.0/24"])
+    finally:
+        nettracker.active_profile.reset(token)
+    assert command[command.index('--interface') + 1] == "eth9"
@@ -0,0 +1,39 @@
+import datetime
+
+import pytest
+
+import nettracker
+
+
+def test_cron_fields():
+    cron = nettracker.CronExpression("*/15 8-18/5 1,15 * 7")
+    assert cron.minutes == {0, 15, 30, 45}
+    assert cron.hours == {8, 13, 18}
+    assert cron.days == {1, 15}
+    # 7 é domingo (6 na numeração do Python)
+    assert cron.weekdays == {6}
+    assert nettracker.CronExpression("5/20 * * * *").minutes == {5, 25, 45}
+
+
+@pytest.mark.parametrize("expression", ["* * * *", "60 * * * *", "* * 0 * *", "*/0 * * * *", "5-1 * * * *"])
+def test_cron_rejects_invalid(expression):
+    with pytest.raises(ValueError):
+        nettracker.CronExpression(expression)
+
+
+def test_cron_day_or_weekday():
+    # Dia do mês e dia da semana restritos: basta um coincidir (sexta-feira ou dia 1)
+    cron = nettracker.CronExpression("0 0 1 * 5")
+    moment = datetime.datetime(2026, 10, 19, 12, 0)    # segunda-feira
+    runs = []
+    for _ in range(3):
+        moment = cron.next_after(moment)
+        runs.append(moment.date())
+    assert runs == [datetime.date(2026, 10, 23), datetime.date(2026, 10, 30), datetime.date(2026, 11, 1)]
+
+
+def test_cron_full_range_counts_as_unrestricted():
+    # 1-31 cobre todos os dias: vale só o dia da semana (segunda)
+    cron = nettracker.CronExpression("0 0 1-31 * 1")
+    assert cron.any_day and not cron.any_weekday
+    assert cron.next_after(datetime.datetime(2026, 10, 19, 0, 0)) == datetime.datetime(2026, 10, 26, 0, 0)
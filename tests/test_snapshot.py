@@ -0,0 +1,47 @@
+import ipaddress
+import time
+
+import nettracker
+
+
+def test_warm_snapshot_roundtrip(tmp_path):
+    path = str(tmp_path / "warm.snap")
+    network = ipaddress.ip_network("10.0.0.0/24")
+    now = time.time()
+    profile = nettracker.NetworkProfile("filial", snapshot_path=path)
+    profile.sweep_snapshots[str(network)] = nettracker.SweepSnapshot.from_bitmap(
+        network, now - 60, (0b1010).to_bytes(1, 'little'), {1: "00:11:22:33:44:55"}
+    )
+    profile.inventory.record_sighting("10.0.0.3", mac="aa:bb:cc:dd:ee:ff", hostname="impressora",
+                                      source="arp", timestamp=now - 30, persist=False)
+    profile.hostname_cache["10.0.0.1"] = ("gateway", now - 10)
+    profile.rtt_estimates["10.0.0.1"] = (1.5, now - 10)
+    assert nettracker.save_warm_snapshot(profile)
+
+    restored = nettracker.NetworkProfile("filial", snapshot_path=path)
+    assert nettracker.load_warm_snapshot(restored) == 4
+    sweep = restored.previous_sweep(str(network))
+    assert [str(ip) for ip in sweep.occupied_addresses()] == ["10.0.0.1", "10.0.0.3"]
+    assert sweep.macs == {1: "00:11:22:33:44:55"}
+    entry = restored.inventory.get("10.0.0.3")
+    assert (entry["mac_address"], entry["hostname"], entry["source"]) == ("aa:bb:cc:dd:ee:ff", "impressora", "arp")
+    assert restored.hostname_cache["10.0.0.1"][0] == "gateway"
+    assert restored.rtt_estimates["10.0.0.1"][0] == 1.5
+
+    # Gravar de novo fecha o snapshot mapeado que o perfil ainda tinha aberto
+    assert nettracker.save_warm_snapshot(restored)
+    assert restored.warm_snapshot is None
+
+
+def test_reader_closes_with_sweeps_still_referenced(tmp_path):
+    path = str(tmp_path / "warm.snap")
+    network = ipaddress.ip_network("10.0.0.0/24")
+    profile = nettracker.NetworkProfile("filial", snapshot_path=path)
+    profile.sweep_snapshots[str(network)] = nettracker.SweepSnapshot.from_bitmap(network, time.time(), b'\x0a', {})
+    nettracker.save_warm_snapshot(profile)
+
+    reader = nettracker.WarmSnapshotReader(path)
+    sweeps = reader.sweeps()
+    assert bytes(sweeps[str(network)][1]) == b'\x0a'
+    reader.close()
+    assert reader.data.closed
@@ -0,0 +1,46 @@
+import pytest
+
+import nettracker
+
+
+# GetResponse v2c (community "public", request-id 0x1234) com três linhas de ipNetToMediaPhysAddress:
+# um MAC, uma entrada incompleta (sem MAC) e o fim da MIB
+SNMP_RESPONSE = bytes.fromhex(
+    "305b02010104067075626c6963a24e0202123402010002010030423018060e2b0601020104160102020a0000050406"
+    "0011223344553012060e2b0601020104160102020a00000604003012060e2b0601020104160102020a0000078200"
+)
+
+
+def test_snmp_encode_getbulk():
+    packet = nettracker.snmp_encode_getbulk("public", 1, nettracker.IP_NET_TO_MEDIA_PHYS_ADDRESS, 10)
+    assert packet.hex() == (
+        "302702010104067075626c6963"          # versão 2c, community
+        "a51a020101020100" "02010a"           # GetBulk: request-id, non-repeaters, max-repetitions
+        "300f300d06092b06010201041601020500"  # varbind: OID + NULL
+    )
+
+
+def test_snmp_decode_response():
+    request_id, status, varbinds = nettracker.snmp_decode_response(SNMP_RESPONSE)
+    assert (request_id, status) == (0x1234, 0)
+    base = nettracker.IP_NET_TO_MEDIA_PHYS_ADDRESS
+    assert varbinds == [
+        (base + (2, 10, 0, 0, 5), 0x04, bytes.fromhex("001122334455")),
+        (base + (2, 10, 0, 0, 6), 0x04, b''),
+        (base + (2, 10, 0, 0, 7), nettracker.SNMP_END_OF_MIB_VIEW, b''),
+    ]
+    entries = nettracker.parse_router_arp(varbinds[:2], base)
+    assert list(entries) == ["10.0.0.5"]
+    assert entries["10.0.0.5"]["mac_address"] == "00:11:22:33:44:55"
+    assert entries["10.0.0.5"]["ifindex"] == 2
+
+
+def test_snmp_decode_truncated():
+    with pytest.raises(ValueError):
+        nettracker.snmp_decode_response(SNMP_RESPONSE[:40])
+
+
+def test_ber_oid_roundtrip():
+    oid = (1, 3, 6, 1, 4, 1, 311, 21, 20, 128, 16384, 2097152)
+    _, payload, _ = nettracker._ber_read(nettracker._ber_oid(oid), 0)
+    assert nettracker._ber_decode_oid(payload) == oid